@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import math
+import os
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+
+
+def _jose():
+    """python-jose 导入约 50ms，首次签发或校验令牌时才导入，不计入冷启动"""
+    from jose import JWTError, jwt
+    return jwt, JWTError
+
+
+def load_secret_key(path: str) -> str:
+    """
+    读取数据目录中的会话签名密钥，不存在时生成并保存，
+    重启与多个 worker 之间使用同一个密钥。多个 worker 同时启动时只有一个能创建文件，其余读取它。
+    """
+    for _ in range(100):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            # 另一个 worker 刚创建文件，尚未写入
+            time.sleep(0.01)
+            continue
+        key = secrets.token_urlsafe(32)
+        with os.fdopen(fd, "w") as f:
+            f.write(key)
+        logger.info(f"Generated session signing key at {path}")
+        return key
+    raise RuntimeError(f"Session signing key file {path} is empty")
+
+
+class SessionCache:
+    """
+    已验证会话令牌的 LRU 缓存：令牌 -> 用户（含用户ID）。
+    条目在令牌过期时或 max_ttl 秒后失效（以较早者为准），
+    命中时跳过签名校验和用户查询。
+    """
+
+    def __init__(self, secret_key: str, max_entries: int = 1024, max_ttl: float = 300):
+        self.secret_key = secret_key
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def issue(self, username: str, max_age: int) -> str:
+        jwt, _ = _jose()
+        return jwt.encode({"sub": username, "exp": int(time.time()) + max_age}, self.secret_key, algorithm=ALGORITHM)
+
+    async def verify(self, token: str,
+                     resolve_user: Callable[[str], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        now = time.time()
+        entry = self._entries.get(token)
+        if entry is not None:
+            user, expires_at = entry
+            if expires_at > now:
+                self.hits += 1
+                self._entries.move_to_end(token)
+                return user
+            del self._entries[token]
+            self.evictions += 1
+        self.misses += 1
+        jwt, JWTError = _jose()
+        try:
+            payload = jwt.decode(token, self.secret_key, algorithms=[ALGORITHM])
+        except JWTError as e:
+            logger.warning(f"Invalid session token: {e}")
+            return None
+        user = await resolve_user(payload.get("sub"))
+        if user is None:
+            return None
+        expires_at = min(payload.get("exp", math.inf), now + self.max_ttl)
+        self._entries[token] = (user, expires_at)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return user
+
+    def discard(self, token: Optional[str]):
+        if token:
+            self._entries.pop(token, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class PasswordHasher:
+    """
+    在有界线程池中执行 bcrypt 哈希与校验，避免阻塞事件循环
+    （bcrypt 计算期间释放 GIL，线程池即可并行）。workers=0 时在事件循环内直接执行，仅用于基准对比。
+    未传入 context 时在首次使用时才导入 passlib（约 40ms）并创建 bcrypt CryptContext。
+    """
+
+    def __init__(self, context=None, workers: int = 2):
+        self._context = context
+        self.workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def context(self):
+        if self._context is None:
+            from passlib.context import CryptContext
+            self._context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        return self._context
+
+    async def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: Optional[str]) -> bool:
+        if not hashed:
+            return False
+        try:
+            return await self._run(self.context.verify, password, hashed)
+        except ValueError:
+            # 无法识别的哈希格式（例如旧版本保存的明文）
+            return False
+
+    def needs_update(self, hashed: str) -> bool:
+        return self.context.needs_update(hashed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
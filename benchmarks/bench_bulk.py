@@ -0,0 +1,108 @@
+"""
+批量导入/导出吞吐基准：对比逐条 POST /api/vps 与 POST /api/vps/bulk，
+并测量 GET /api/vps/export 的流式导出速度
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_bulk.py [--rows 1000 10000 100000] [--single 500]
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from rates import StaticRateProvider  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+def make_records(rows: int) -> list:
+    today = date.today()
+    return [
+        {
+            "vendor_name": f"vendor-{i % 50}", "cpu_cores": 2, "cpu_model": "EPYC",
+            "memory": 4, "storage": 50, "bandwidth": 1000,
+            "price": round(random.uniform(10, 500), 2), "currency": random.choice(CURRENCIES),
+            "start_date": today.isoformat(),
+            "end_date": (today + timedelta(days=random.randint(-30, 730))).isoformat(),
+        }
+        for i in range(rows)
+    ]
+
+
+def encode(records: list, format: str) -> str:
+    if format == "ndjson":
+        return "".join(json.dumps(record) + "\n" for record in records)
+    if format == "json":
+        return json.dumps(records)
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(records[0]))
+    writer.writeheader()
+    writer.writerows(records)
+    return output.getvalue()
+
+
+async def run(rows_list, single: int):
+    main.rate_cache.provider = StaticRateProvider(STUB_RATES)
+    # 逐条写入的对比不受每用户限流影响
+    main.rate_limiter.rate = 0
+    transport = httpx.ASGITransport(app=main.app)
+    print(f"{'rows':>8} {'mode':>14} {'seconds':>9} {'rows/s':>10}")
+    for rows in rows_list:
+        records = make_records(rows)
+        for mode in ("single", "bulk-csv", "bulk-ndjson", "bulk-json", "export-csv", "export-ndjson"):
+            if mode == "single" and single <= 0:
+                continue
+            with tempfile.TemporaryDirectory() as tmp:
+                main.DB_PATH = os.path.join(tmp, "vps.db")
+                await main.startup_event()
+                try:
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                        await client.post("/api/login", data={"username": "admin", "password": "benchmark"})
+                        count = rows
+                        if mode.startswith("export"):
+                            await client.post("/api/vps/bulk?format=ndjson", content=encode(records, "ndjson"))
+                        start = time.perf_counter()
+                        if mode == "single":
+                            # 逐条写入太慢，只取前 single 条推算
+                            count = min(single, rows)
+                            for record in records[:count]:
+                                await client.post("/api/vps", json=record)
+                        elif mode.startswith("bulk"):
+                            format = mode.split("-")[1]
+                            response = await client.post(f"/api/vps/bulk?format={format}",
+                                                         content=encode(records, format))
+                            assert response.json()["inserted"] == rows
+                        else:
+                            format = mode.split("-")[1]
+                            async with client.stream("GET", f"/api/vps/export?format={format}") as response:
+                                async for _ in response.aiter_bytes():
+                                    pass
+                        elapsed = time.perf_counter() - start
+                finally:
+                    await main.shutdown_event()
+            print(f"{rows:>8} {mode:>14} {elapsed:>9.3f} {count / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--single", type=int, default=500, help="逐条写入的最大行数，0 表示跳过")
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.single))
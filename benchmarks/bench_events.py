@@ -0,0 +1,208 @@
+"""
+实时更新基准：--rows 行库存，--dashboards 个页面打开 /api/events，管理员依次修改 --writes 行。
+- sse：从发出写入请求到所有页面收到 row 事件的延迟（p50/p99）与每次更新的字节数
+- reload：作为对照，每次写入后所有页面重新请求首页（改版前的整页刷新）
+- 慢客户端：另外 --slow 个连接只建立不读取，写入 --burst 次后统计溢出丢弃的事件与订阅者积压上限
+结束后检查所有连接关闭后订阅者数归零，并输出 tracemalloc 统计的内存增长。
+
+应用由进程内 uvicorn 提供服务（ASGI 进程内传输会缓冲整个响应，无法用于事件流）。
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_events.py [--rows 1000] [--dashboards 300] [--writes 50] [--slow 50] [--burst 400]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+import uvicorn  # noqa: E402
+
+import main  # noqa: E402
+from inventory import import_vps  # noqa: E402
+from rates import StaticRateProvider  # noqa: E402
+
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def listen_socket() -> socket.socket:
+    """
+    固定发送缓冲区的监听套接字（接受的连接继承该设置）：默认的缓冲区自动增长到数 MB，
+    卡住的连接要积压上千个事件才会阻塞服务端写入，无法在基准中观察到队列溢出
+    """
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    sock.bind(("127.0.0.1", 0))
+    return sock
+
+
+async def dashboard(client, received: dict, ready: asyncio.Event):
+    """读取事件流，记录每个 row 事件（按 VPS 名称）的到达时间与字节数"""
+    async with client.stream("GET", "/api/events") as response:
+        ready.set()
+        name = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                name = line[7:]
+            elif line.startswith("data: ") and name == "row":
+                html = json.loads(line[6:])["html"]
+                marker = html.split("<td>", 2)[1].split("</td>", 1)[0]
+                received.setdefault(marker, []).append((time.perf_counter(), len(line)))
+
+
+async def slow_dashboard(port: int, cookie: str, ready: asyncio.Event):
+    """只发送请求不读取响应，模拟卡住的页面；接收缓冲区设得很小，服务端很快写不进去"""
+    loop = asyncio.get_running_loop()
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, ("127.0.0.1", port))
+        await loop.sock_sendall(sock, f"GET /api/events HTTP/1.1\r\nHost: bench\r\n"
+                                      f"Cookie: session={cookie}\r\n\r\n".encode())
+        ready.set()
+        await asyncio.sleep(3600)
+    finally:
+        sock.close()
+
+
+async def run(args):
+    main.rate_cache.provider = StaticRateProvider(STUB_RATES)
+    main.rate_limiter.rate = 0  # 大量连接来自同一地址，基准中不限流
+    main.EVENTS_HEARTBEAT = 1.0
+    sock = listen_socket()
+    port = sock.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as tmp:
+        main.DB_PATH = os.path.join(tmp, "vps.db")
+        server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning"))
+        serving = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.05)
+        try:
+            today = date.today()
+
+            async def records():
+                for i in range(args.rows):
+                    yield {"vendor_name": f"seed-{i}", "price": 10 + i % 90, "currency": "USD",
+                           "start_date": today.isoformat(),
+                           "end_date": (today + timedelta(days=30 + i % 700)).isoformat()}
+
+            await import_vps(main.db_pool, records(), main.public_tenant["id"])
+            main.valuation_cache.invalidate()
+            cookie = main.session_cache.issue("admin", 3600)
+            headers = {"Cookie": f"session={cookie}"}
+            limits = httpx.Limits(max_connections=args.dashboards + 16, max_keepalive_connections=args.dashboards + 16)
+            async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=60) as client:
+                # 对照：每次写入后所有页面整页刷新
+                start = time.perf_counter()
+                reload_bytes = 0
+                reload_latencies = []
+                for i in range(min(args.writes, 10)):
+                    write_start = time.perf_counter()
+                    await client.put("/api/vps/1", json={"vendor_name": f"reload-{i}", "price": 10, "currency": "USD",
+                                                         "end_date": (today + timedelta(days=400)).isoformat()})
+
+                    async def reload():
+                        response = await client.get("/")
+                        reload_latencies.append(time.perf_counter() - write_start)
+                        return len(response.content)
+                    reload_bytes += sum(await asyncio.gather(*(reload() for _ in range(args.dashboards))))
+                reload_elapsed = time.perf_counter() - start
+                reload_writes = min(args.writes, 10)
+
+                tracemalloc.start()
+                baseline = tracemalloc.get_traced_memory()[0]
+                received: dict = {}
+                readies = [asyncio.Event() for _ in range(args.dashboards)]
+                readers = [asyncio.create_task(dashboard(client, received, ready)) for ready in readies]
+                await asyncio.gather(*(ready.wait() for ready in readies))
+                slow_readies = [asyncio.Event() for _ in range(args.slow)]
+                slow = [asyncio.create_task(slow_dashboard(port, cookie, ready)) for ready in slow_readies]
+                await asyncio.gather(*(ready.wait() for ready in slow_readies))
+                while len(main.event_bus) < args.dashboards + args.slow:
+                    await asyncio.sleep(0.05)
+                subscribed = len(main.event_bus)
+
+                latencies = []
+                event_bytes = 0
+                start = time.perf_counter()
+                for i in range(args.writes):
+                    marker = f"sse-{i}"
+                    write_start = time.perf_counter()
+                    await client.put("/api/vps/1", json={"vendor_name": marker, "price": 10, "currency": "USD",
+                                                         "end_date": (today + timedelta(days=400)).isoformat()})
+                    while len(received.get(marker, ())) < args.dashboards:
+                        await asyncio.sleep(0.001)
+                    latencies.extend(arrived - write_start for arrived, _ in received[marker])
+                    event_bytes += sum(size for _, size in received[marker])
+                sse_elapsed = time.perf_counter() - start
+
+                # 慢客户端：持续写入直到其队列溢出
+                for i in range(args.burst):
+                    await client.put("/api/vps/1", json={"vendor_name": f"burst-{i}", "price": 10, "currency": "USD",
+                                                         "end_date": (today + timedelta(days=400)).isoformat()})
+                max_pending = max((s.pending() for subscribers in main.event_bus._topics.values()
+                                   for s in subscribers), default=0)
+                peak = tracemalloc.get_traced_memory()[0] - baseline
+
+                for task in readers + slow:
+                    task.cancel()
+                await asyncio.gather(*readers, *slow, return_exceptions=True)
+                deadline = time.monotonic() + 10
+                while len(main.event_bus) and time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                remaining = len(main.event_bus)
+                received.clear()
+                gc.collect()
+                after = tracemalloc.get_traced_memory()[0] - baseline
+                tracemalloc.stop()
+        finally:
+            server.should_exit = True
+            await serving
+
+    print(f"{args.rows} rows, {args.dashboards} dashboards, {args.slow} stalled connections "
+          f"(queue limit {main.event_bus.max_queue})")
+    print(f"{'mode':>8} {'updates/s':>10} {'p50(ms)':>9} {'p99(ms)':>9} {'bytes/update':>13}")
+    print(f"{'reload':>8} {reload_writes / reload_elapsed:>10.1f} "
+          f"{percentile(reload_latencies, 0.5) * 1000:>9.2f} {percentile(reload_latencies, 0.99) * 1000:>9.2f} "
+          f"{reload_bytes / reload_writes:>13.0f}")
+    print(f"{'sse':>8} {args.writes / sse_elapsed:>10.1f} "
+          f"{percentile(latencies, 0.5) * 1000:>9.2f} {percentile(latencies, 0.99) * 1000:>9.2f} "
+          f"{event_bytes / args.writes:>13.0f}")
+    print(f"subscribers: {subscribed} open, {remaining} left after disconnect")
+    print(f"events: {main.event_bus.delivered} delivered, {main.event_bus.dropped} dropped on overflow; "
+          f"largest backlog {max_pending}")
+    print(f"traced memory (client and server): +{peak / 1024:.0f} KiB with streams open, "
+          f"+{after / 1024:.0f} KiB after close")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--dashboards", type=int, default=300)
+    parser.add_argument("--writes", type=int, default=50)
+    parser.add_argument("--slow", type=int, default=50, help="只建立连接不读取的页面数")
+    parser.add_argument("--burst", type=int, default=400, help="慢客户端阶段的写入次数")
+    asyncio.run(run(parser.parse_args()))
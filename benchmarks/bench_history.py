@@ -0,0 +1,133 @@
+"""
+机队历史基准：--rows 行库存（--vendors 个商家）连续记录 --days 天的每日快照，每天记录后按保留期降采样，
+输出保存的桶数与占用空间（与不降采样时的日快照行数对比），以及 /api/history 各种查询的延迟；
+对照为从 VPS 行重新计算同一区间（每个日期估值并汇总一次）的耗时。
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_history.py [--rows 1000] [--vendors 20] [--days 800] [--queries 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+import history  # noqa: E402
+from inventory import import_vps  # noqa: E402
+from rates import StaticRateProvider  # noqa: E402
+from valuation import EPOCH_ORDINAL, load_portfolio, summarize, value_portfolio  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def table_bytes(name: str):
+    """表与索引占用的字节数（需要 SQLite 编译了 dbstat）"""
+    try:
+        async with main.db_pool.read() as db:
+            async with db.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ? OR tbl_name = ?',
+                                  [name, name]) as cursor:
+                return (await cursor.fetchone())[0]
+    except Exception:
+        return None
+
+
+async def run(args):
+    main.rate_cache.provider = StaticRateProvider(STUB_RATES)
+    main.rate_limiter.rate = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        main.DB_PATH = os.path.join(tmp, "vps.db")
+        await main.startup_event()
+        try:
+            await main.deferred_init.wait("fleet_history")
+            await main.fleet_history.stop()
+            today = date.today()
+            random.seed(1)
+
+            async def records():
+                for i in range(args.rows):
+                    yield {"vendor_name": f"vendor-{i % args.vendors}", "price": round(random.uniform(10, 500), 2),
+                           "currency": random.choice(CURRENCIES), "start_date": today.isoformat(),
+                           "end_date": (today + timedelta(days=random.randint(30, args.days + 730))).isoformat()}
+
+            await import_vps(main.db_pool, records(), main.public_tenant["id"])
+            main.valuation_cache.invalidate()
+            async with main.db_pool.write() as db:
+                await db.execute('DELETE FROM fleet_history')
+
+            fleet = main.fleet_history
+            end = history.from_day(today)
+            start = end - args.days + 1
+            record_seconds = 0.0
+            downsample_seconds = 0.0
+            for day in range(start, end + 1):
+                started = time.perf_counter()
+                await fleet.record(day)
+                record_seconds += time.perf_counter() - started
+                started = time.perf_counter()
+                await fleet.downsample(day)
+                downsample_seconds += time.perf_counter() - started
+            async with main.db_pool.read() as db:
+                async with db.execute('SELECT resolution, COUNT(*) FROM fleet_history GROUP BY resolution') as cursor:
+                    stored = {history.RESOLUTION_NAMES[resolution]: count for resolution, count in await cursor.fetchall()}
+            per_day = 1 + args.vendors + len(CURRENCIES)
+            size = await table_bytes("fleet_history")
+            print(f"{args.rows} rows, {args.vendors} vendors, {args.days} days "
+                  f"(daily kept {fleet.daily_days}d, weekly {fleet.weekly_days}d)")
+            print(f"record {record_seconds / args.days * 1000:.2f} ms/day, "
+                  f"downsample {downsample_seconds / args.days * 1000:.2f} ms/day")
+            print(f"stored buckets: {stored} = {sum(stored.values())} rows "
+                  f"(without downsampling {per_day * args.days} rows)"
+                  + (f", {size / 1024:.0f} KiB with index" if size else ""))
+
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                print(f"\n{'query':>32} {'points':>7} {'p50(ms)':>9} {'p99(ms)':>9}")
+                for params in ({}, {"resolution": "week"}, {"resolution": "month"},
+                               {"dimension": "vendor"}, {"dimension": "currency", "resolution": "month"},
+                               {"start": (today - timedelta(days=30)).isoformat()}):
+                    latencies = []
+                    for _ in range(args.queries):
+                        started = time.perf_counter()
+                        response = await client.get("/api/history", params=params)
+                        latencies.append(time.perf_counter() - started)
+                    assert response.status_code == 200, response.text
+                    label = " ".join(f"{k}={v}" for k, v in params.items()) or "(default)"
+                    print(f"{label:>32} {len(response.json()['dates']):>7} "
+                          f"{percentile(latencies, 0.5) * 1000:>9.3f} {percentile(latencies, 0.99) * 1000:>9.3f}")
+
+            # 对照：每个数据点都从 VPS 行重新估值并汇总
+            table = await main.rate_cache.get_table()
+            started = time.perf_counter()
+            portfolio = await load_portfolio(main.db_pool, main.public_tenant["id"])
+            for day in range(start, end + 1):
+                summarize(portfolio, value_portfolio(portfolio, table, "CNY", day + EPOCH_ORDINAL))
+            print(f"\nrecompute {args.days} days from VPS rows: {(time.perf_counter() - started) * 1000:.0f} ms")
+        finally:
+            await main.shutdown_event()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--vendors", type=int, default=20)
+    parser.add_argument("--days", type=int, default=800)
+    parser.add_argument("--queries", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,110 @@
+"""
+首页渲染基准：对比旧的逐行 /api/convert 请求方式与服务端批量计算方式
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_home.py [--rows 10 100 1000] [--repeat 5]
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from rates import StaticRateProvider  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+async def seed(db_path: str, rows: int):
+    main.DB_PATH = db_path
+    # 每种规模使用新的数据库，版本计数器从头开始，上一轮缓存的页面不能复用
+    main.page_cache.clear()
+    main.fragment_cache.clear()
+    await main.startup_event()
+    today = datetime.now()
+    async with main.db_pool.write() as db:
+        await db.executemany('''
+            INSERT INTO vps (
+                vendor_name, cpu_cores, cpu_model, memory, storage, bandwidth,
+                price, currency, start_date, end_date, user_id
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+        ''', [
+            (
+                f"vendor-{i % 20}", 2, "EPYC", 4, 50, 1000,
+                round(random.uniform(10, 500), 2), random.choice(CURRENCIES),
+                today.strftime("%Y-%m-%d"),
+                (today + timedelta(days=random.randint(-30, 730))).strftime("%Y-%m-%d"),
+            )
+            for i in range(rows)
+        ])
+    main.valuation_cache.invalidate()
+
+
+async def legacy_render(client: httpx.AsyncClient) -> int:
+    """模拟旧页面：GET / 之后每个剩余价值单元格各请求一次 /api/convert"""
+    response = await client.get("/")
+    requests = 1
+    # 旧模板的每一行对应一次换算请求，这里按行数重放
+    cells = re.findall(r'class="remaining-value"', response.text)
+    async with main.db_pool.read() as db:
+        async with db.execute('SELECT price, currency FROM vps ORDER BY end_date DESC') as cursor:
+            rows = await cursor.fetchall()
+    assert len(cells) == len(rows)
+    for price, currency in rows:
+        await client.get("/api/convert", params={"amount": price, "currency": currency})
+        requests += 1
+    return requests
+
+
+async def batched_render(client: httpx.AsyncClient) -> int:
+    """新页面：一次 GET / 即包含全部剩余价值"""
+    await client.get("/")
+    return 1
+
+
+async def measure(render, client, repeat: int):
+    timings = []
+    requests = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        requests = await render(client)
+        timings.append(time.perf_counter() - start)
+    return requests, min(timings), sum(timings) / len(timings)
+
+
+async def run(rows_list, repeat: int):
+    main.rate_cache.provider = StaticRateProvider(STUB_RATES)
+    transport = httpx.ASGITransport(app=main.app)
+    print(f"{'rows':>6} {'mode':>8} {'requests':>9} {'best(ms)':>10} {'mean(ms)':>10}")
+    for rows in rows_list:
+        with tempfile.TemporaryDirectory() as tmp:
+            await seed(os.path.join(tmp, "vps.db"), rows)
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    for name, render in (("legacy", legacy_render), ("batched", batched_render)):
+                        requests, best, mean = await measure(render, client, repeat)
+                        print(f"{rows:>6} {name:>8} {requests:>9} {best * 1000:>10.1f} {mean * 1000:>10.1f}")
+            finally:
+                await main.shutdown_event()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat))
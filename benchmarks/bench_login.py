@@ -0,0 +1,78 @@
+"""
+登录吞吐基准：并发登录的同时探测其他接口的延迟，
+对比 bcrypt 在事件循环内执行（workers=0）与在线程池中执行
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_login.py [--logins 40] [--concurrency 8] [--workers 0 2 4]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from auth import PasswordHasher  # noqa: E402
+
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, latencies: list):
+    """登录进行期间每 5ms 请求一次廉价接口；延迟包含事件循环被阻塞而推迟的时间"""
+    interval = 0.005
+    while not stop.is_set():
+        scheduled = time.perf_counter()
+        await asyncio.sleep(interval)
+        await client.get("/api/convert", params={"amount": 1, "currency": "CNY"})
+        latencies.append(time.perf_counter() - scheduled - interval)
+
+
+async def login_worker(client: httpx.AsyncClient, count: int):
+    for _ in range(count):
+        response = await client.post("/api/login", data={"username": "admin", "password": "benchmark"})
+        assert response.status_code == 200
+
+
+async def run(logins: int, concurrency: int, workers_list):
+    transport = httpx.ASGITransport(app=main.app)
+    print(f"{'workers':>8} {'logins/s':>9} {'probe p50(ms)':>14} {'probe p99(ms)':>14} {'probe max(ms)':>14}")
+    for workers in workers_list:
+        main.password_hasher = PasswordHasher(workers=workers)
+        with tempfile.TemporaryDirectory() as tmp:
+            main.DB_PATH = os.path.join(tmp, "vps.db")
+            await main.startup_event()
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                    stop = asyncio.Event()
+                    latencies = []
+                    probe_task = asyncio.create_task(probe(client, stop, latencies))
+                    start = time.perf_counter()
+                    await asyncio.gather(*[
+                        login_worker(client, logins // concurrency) for _ in range(concurrency)
+                    ])
+                    elapsed = time.perf_counter() - start
+                    stop.set()
+                    await probe_task
+            finally:
+                await main.shutdown_event()
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"{workers:>8} {logins / elapsed:>9.1f} {statistics.median(latencies) * 1000:>14.1f} "
+              f"{p99 * 1000:>14.1f} {latencies[-1] * 1000:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4])
+    args = parser.parse_args()
+    asyncio.run(run(args.logins, args.concurrency, args.workers))
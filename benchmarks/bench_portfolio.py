@@ -0,0 +1,101 @@
+"""
+估值引擎基准：从 SQLite 加载列式数据并计算整个机队的剩余价值与汇总。
+--rate-mode 为 purchase / average 时另外生成 --history-days 天的历史汇率，
+计时包含历史序列的加载（history 列）。
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_portfolio.py [--rows 1000 10000 100000] [--rate-mode average] [--history-days 730]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import aiosqlite  # noqa: E402
+
+from database import ConnectionPool  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from rate_history import history_currencies, load_history  # noqa: E402
+from rates import RateTable  # noqa: E402
+from valuation import BILLING_CYCLES, EPOCH_ORDINAL, load_portfolio, summarize, value_portfolio  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+async def seed(pool: ConnectionPool, rows: int):
+    today = date.today()
+    async with pool.write() as db:
+        await db.executemany(
+            'INSERT INTO vps (vendor_name, price, currency, start_date, end_date, billing_cycle) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    f"vendor-{i % 50}", round(random.uniform(10, 500), 2), random.choice(CURRENCIES),
+                    (today - timedelta(days=random.randint(0, 700))).isoformat(),
+                    (today + timedelta(days=random.randint(-30, 730))).isoformat(),
+                    random.choice(list(BILLING_CYCLES)),
+                )
+                for i in range(rows)
+            ]
+        )
+
+
+async def seed_history(pool: ConnectionPool, days: int):
+    """每个币种每天一条，在基准汇率上随机波动"""
+    today = date.today().toordinal() - EPOCH_ORDINAL
+    async with pool.write() as db:
+        await db.executemany(
+            'INSERT OR REPLACE INTO rate_history (day, currency, rate) VALUES (?, ?, ?)',
+            [
+                (today - offset, currency, rate * random.uniform(0.9, 1.1))
+                for offset in range(days) for currency, rate in STUB_RATES.items()
+            ]
+        )
+
+
+async def run(rows_list, rate_mode: str, history_days: int):
+    table = RateTable(STUB_RATES)
+    print(f"{'rows':>8} {'load(ms)':>10} {'history(ms)':>12} {'value(ms)':>10} "
+          f"{'summary(ms)':>12} {'total(ms)':>10}")
+    for rows in rows_list:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "vps.db")
+            async with aiosqlite.connect(db_path) as db:
+                await run_migrations(db)
+            pool = ConnectionPool(db_path, readers=1)
+            await pool.open()
+            await seed(pool, rows)
+            if rate_mode != "current":
+                await seed_history(pool, history_days)
+            start = time.perf_counter()
+            portfolio = await load_portfolio(pool)
+            loaded = time.perf_counter()
+            history = None
+            if rate_mode != "current":
+                history = await load_history(pool, history_currencies(set(portfolio.currencies), "CNY"))
+            historied = time.perf_counter()
+            valuation = value_portfolio(portfolio, table, history=history, rate_mode=rate_mode)
+            valued = time.perf_counter()
+            summarize(portfolio, valuation)
+            done = time.perf_counter()
+            await pool.close()
+        print(f"{rows:>8} {(loaded - start) * 1000:>10.1f} {(historied - loaded) * 1000:>12.1f} "
+              f"{(valued - historied) * 1000:>10.1f} {(done - valued) * 1000:>12.1f} {(done - start) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--rate-mode", choices=["current", "purchase", "average"], default="current")
+    parser.add_argument("--history-days", type=int, default=730)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.rate_mode, args.history_days))
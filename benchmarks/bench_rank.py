@@ -0,0 +1,128 @@
+"""
+性价比排名基准：每个 --rows 规模下比较三种取前 --top 名的方式
+- sql：每次请求由 SQLite 按表达式 ORDER BY（换算为 CNY 月费 / 资源量）
+- sort：每次请求在内存中计算所有行的指标并排序
+- index：RankIndex（写入时维护的有序索引）直接切片
+并给出索引的重建耗时（汇率刷新或跨天时）与单行更新耗时，最后校验三种方式的结果一致。
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_rank.py [--rows 1000 10000 100000] [--top 10] [--queries 200] [--updates 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import aiosqlite  # noqa: E402
+
+from database import ConnectionPool  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from ranking import RankIndex, row_metrics  # noqa: E402
+from rates import RateTable  # noqa: E402
+from valuation import BILLING_CYCLES, cycles_per_year  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+def random_row(vps_id: int) -> dict:
+    return {
+        "id": vps_id, "user_id": 1, "vendor_name": f"vendor-{vps_id % 50}",
+        "cpu_cores": random.choice([1, 2, 4, 8]), "memory": random.choice([0.5, 1, 2, 4, 8, 16]),
+        "storage": random.choice([10, 20, 40, 80, 160]), "bandwidth": random.choice([500, 1000, 2000, 4000]),
+        "price": round(random.uniform(1, 500), 2), "currency": random.choice(CURRENCIES),
+        "billing_cycle": random.choice(list(BILLING_CYCLES)),
+    }
+
+
+async def seed(pool: ConnectionPool, rows: list):
+    async with pool.write() as db:
+        await db.executemany(
+            'INSERT INTO vps (id, user_id, vendor_name, cpu_cores, memory, storage, bandwidth, price, currency, '
+            'billing_cycle) VALUES (:id, :user_id, :vendor_name, :cpu_cores, :memory, :storage, :bandwidth, '
+            ':price, :currency, :billing_cycle)', rows)
+
+
+async def sql_top(pool: ConnectionPool, table: RateTable, top: int) -> list:
+    """对照：每次请求按表达式排序（汇率与付款周期以 CASE 传入）"""
+    factors = " ".join(f"WHEN '{code}' THEN {table.convert(1, code, 'CNY')}" for code in CURRENCIES)
+    cycles = " ".join(f"WHEN '{cycle}' THEN {cycles_per_year(cycle) / 12}" for cycle in BILLING_CYCLES)
+    async with pool.read() as db:
+        async with db.execute(
+            f'SELECT id FROM vps WHERE user_id = ? AND cpu_cores > 0 '
+            f'ORDER BY price * (CASE billing_cycle {cycles} END) * (CASE currency {factors} END) / cpu_cores, id '
+            f'LIMIT ?', [1, top]
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+def sort_top(rows: list, table: RateTable, top: int) -> list:
+    """对照：每次请求计算所有行的指标并排序"""
+    ranked = sorted((metrics["core"], row["id"]) for row in rows
+                    if "core" in (metrics := row_metrics(row, table)))
+    return [vps_id for _, vps_id in ranked[:top]]
+
+
+async def run(args):
+    table = RateTable(STUB_RATES)
+    print(f"{'rows':>8} {'sql(ms)':>9} {'sort(ms)':>9} {'index(ms)':>10} {'rebuild(ms)':>12} {'update(us)':>11}")
+    for size in args.rows:
+        random.seed(size)
+        rows = [random_row(vps_id) for vps_id in range(1, size + 1)]
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "vps.db")
+            async with aiosqlite.connect(db_path) as db:
+                await run_migrations(db)
+            pool = ConnectionPool(db_path, readers=1)
+            await pool.open()
+            try:
+                await seed(pool, rows)
+                start = time.perf_counter()
+                for _ in range(args.queries):
+                    expected = await sql_top(pool, table, args.top)
+                sql_ms = (time.perf_counter() - start) / args.queries * 1000
+            finally:
+                await pool.close()
+
+        queries = max(1, args.queries // 10 if size >= 100000 else args.queries)
+        start = time.perf_counter()
+        for _ in range(queries):
+            sorted_ids = sort_top(rows, table, args.top)
+        sort_ms = (time.perf_counter() - start) / queries * 1000
+
+        index = RankIndex("CNY")
+        start = time.perf_counter()
+        index.rebuild(rows, table)
+        rebuild_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        for _ in range(args.queries):
+            indexed_ids = [vps_id for _, vps_id in index.top(1, "core", args.top)]
+        index_ms = (time.perf_counter() - start) / args.queries * 1000
+        assert expected == sorted_ids == indexed_ids, (expected, sorted_ids, indexed_ids)
+
+        # 单行修改：重新计算该行指标并在各指标的有序列表中移动
+        start = time.perf_counter()
+        for _ in range(args.updates):
+            row = rows[random.randrange(size)]
+            row["price"] = round(random.uniform(1, 500), 2)
+            index.upsert(row, table)
+        update_us = (time.perf_counter() - start) / args.updates * 1e6
+        assert [vps_id for _, vps_id in index.top(1, "core", args.top)] == sort_top(rows, table, args.top)
+
+        print(f"{size:>8} {sql_ms:>9.3f} {sort_ms:>9.3f} {index_ms:>10.4f} {rebuild_ms:>12.1f} {update_us:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,215 @@
+"""
+冷启动基准：
+- 导入耗时分解：python -X importtime -c "import main"，按顶层包汇总 main 导入过程中各模块的自身耗时（--runs 次取中位数）
+- 首个请求：启动 uvicorn 子进程，记录从创建进程到 GET / 返回 200 的时间，
+  以及 /readyz 报告后台初始化全部完成的时间；分别测量首次启动（空数据目录，执行迁移）与重启（已有数据库）
+- 检查 LAZY_MODULES 没有在导入 main 时加载；设置 --max-import-ms 时 main 导入耗时超出即以非零状态退出，用于发现回归
+
+服务进程在临时目录中运行（data、static/images 为空目录，templates 与其余静态文件链接到仓库），不会改动仓库中的数据；
+汇率来自本地模拟的 fixer.io（首次启动时数据库中没有汇率，第一个页面请求要等待一次汇率获取）。
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_startup.py [--runs 5] [--top 12] [--max-import-ms 0]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+
+# 只在首次使用时导入的较重依赖
+LAZY_MODULES = ("aiohttp", "jose", "passlib", "bcrypt")
+
+ENV = {**os.environ, "ADMIN_PASSWORD": os.environ.get("ADMIN_PASSWORD", "benchmark"),
+       "PYTHONPATH": str(ROOT), "PYTHONDONTWRITEBYTECODE": "1"}
+
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+
+
+class StubFixer(BaseHTTPRequestHandler):
+    """本地模拟 fixer.io latest 接口"""
+
+    def do_GET(self):
+        body = json.dumps({"success": True, "base": "EUR", "rates": STUB_RATES}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run_python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=ENV,
+                          capture_output=True, text=True, check=True)
+
+
+def import_profile() -> tuple:
+    """返回 (main 的累计导入耗时 us, {顶层包: 自身耗时 us})"""
+    output = run_python("import main", "-X", "importtime").stderr
+    packages: dict = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue  # 表头
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        name = name.strip()
+        if depth == 0 and name != "main":
+            # 解释器启动时的导入（site、encodings 等）不属于 main
+            packages = {}
+            continue
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+        if depth == 0:
+            return cumulative_us, packages
+    raise RuntimeError("main not found in -X importtime output")
+
+
+def wall_time(code: str) -> float:
+    started = time.perf_counter()
+    run_python(code)
+    return time.perf_counter() - started
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(port: int, path: str):
+    """返回 (状态码, 响应体)；服务尚未监听时返回 None"""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("GET", path)
+        response = connection.getresponse()
+        return response.status, response.read()
+    except OSError:
+        return None
+    finally:
+        connection.close()
+
+
+def prepare_workdir(workdir: Path):
+    """服务进程的工作目录：模板与静态资源链接到仓库，图片目录与数据目录是空的"""
+    (workdir / "templates").symlink_to(ROOT / "templates")
+    static = workdir / "static"
+    (static / "images").mkdir(parents=True)
+    for entry in (ROOT / "static").iterdir():
+        if entry.name != "images":
+            (static / entry.name).symlink_to(entry)
+
+
+def serve_once(workdir: Path, timeout: float = 30) -> dict:
+    """启动 uvicorn 直到首个请求成功、后台初始化完成，返回各阶段距创建进程的秒数"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                                "--log-level", "warning"],
+                               cwd=workdir, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    result = {"first_response": None, "ready": None, "deferred": None}
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited: {process.stderr.read().decode(errors='replace')[-2000:]}")
+            response = get(port, "/")
+            if response is not None and response[0] == 200:
+                result["first_response"] = time.perf_counter() - started
+                break
+            time.sleep(0.002)
+        while time.perf_counter() < deadline:
+            response = get(port, "/readyz")
+            if response is not None and response[0] == 404:
+                break  # 没有就绪检查的版本
+            if response is not None and response[0] == 200:
+                report = json.loads(response[1])
+                if not report["pending"]:
+                    result["ready"] = time.perf_counter() - started
+                    result["deferred"] = report["deferred"]
+                    break
+            time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        process.stderr.close()
+    return result
+
+
+def seconds(value) -> str:
+    return f"{value * 1000:.0f}" if value is not None else "-"
+
+
+def run(args) -> int:
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubFixer)
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    ENV["FIXER_API_URL"] = f"http://127.0.0.1:{stub.server_address[1]}/api/latest"
+    # 预热文件系统缓存与字节码，避免第一次运行的编译耗时混入
+    run_python("import main")
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    total_us = statistics.median(total for total, _ in profiles)
+    packages = {name for _, breakdown in profiles for name in breakdown}
+    breakdown = sorted(((statistics.median(profile.get(name, 0) for _, profile in profiles), name)
+                        for name in packages), reverse=True)
+    print(f"import main: {total_us / 1000:.1f} ms cumulative (median of {args.runs}, -X importtime)")
+    print(f"{'package':>24} {'self(ms)':>9} {'share':>6}")
+    for self_us, name in breakdown[:args.top]:
+        print(f"{name:>24} {self_us / 1000:>9.1f} {self_us / total_us:>6.1%}")
+    rest = sum(self_us for self_us, _ in breakdown[args.top:])
+    print(f"{'(other)':>24} {rest / 1000:>9.1f} {rest / total_us:>6.1%}")
+
+    interpreter = statistics.median(wall_time("pass") for _ in range(args.runs))
+    with_main = statistics.median(wall_time("import main") for _ in range(args.runs))
+    print(f"process wall time: interpreter {interpreter * 1000:.0f} ms, with import main {with_main * 1000:.0f} ms")
+
+    loaded = json.loads(run_python(
+        f"import json, sys, main; print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))").stdout)
+    print(f"lazy modules imported by main: {', '.join(loaded) or 'none'}")
+
+    print(f"\n{'start':>8} {'first 200 (ms)':>15} {'ready (ms)':>11}  deferred steps (ms)")
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(tmp)
+            prepare_workdir(workdir)
+            for label in ("cold", "restart"):
+                result = serve_once(workdir)
+                steps = ", ".join(f"{name} {seconds(step['seconds'])}"
+                                  for name, step in (result["deferred"] or {}).items())
+                print(f"{label:>8} {seconds(result['first_response']):>15} {seconds(result['ready']):>11}  {steps}")
+
+    stub.shutdown()
+    failed = False
+    if loaded:
+        print(f"FAIL: {', '.join(loaded)} should not be imported at startup")
+        failed = True
+    if args.max_import_ms and total_us / 1000 > args.max_import_ms:
+        print(f"FAIL: import main took {total_us / 1000:.1f} ms (limit {args.max_import_ms} ms)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="导入耗时分解中列出的包数")
+    parser.add_argument("--max-import-ms", type=float, default=0, help="main 导入耗时上限（0 为不检查）")
+    sys.exit(run(parser.parse_args()))
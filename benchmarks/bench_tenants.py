@@ -0,0 +1,231 @@
+"""
+多用户基准：1 个大用户（--big-rows 行）与 --tenants 个小用户（各 --rows-per-tenant 行）。
+先测小用户列表 / 分页 / 汇总接口单独运行时的 p50/p99，再在大用户持续读写的同时重复测量，
+并统计大用户超出限流收到的 429 数量（小用户不应收到 429），以及大用户写入后小用户的 ETag 是否保持不变。
+最后一个阶段每 --foreign-interval 秒模拟一次其他 worker 的写入（只递增共享计数器，所有用户的缓存过期），
+大用户的重新加载不应拖慢小用户；各阶段同时记录事件循环的最大延迟。
+
+用户直接写入 users 表，会话令牌由 session_cache 签发，不经过 bcrypt 登录。
+
+用法（在仓库根目录执行）:
+    python benchmarks/bench_tenants.py [--tenants 500] [--rows-per-tenant 20] [--big-rows 50000]
+                                       [--requests 2000] [--concurrency 16] [--big-concurrency 8]
+                                       [--foreign-interval 0.2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from inventory import import_vps  # noqa: E402
+from rates import StaticRateProvider  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+SMALL_REQUESTS = (
+    ("list", "/api/vps", None),
+    ("page", "/api/vps", {"limit": 50}),
+    ("summary", "/api/portfolio/summary", None),
+)
+
+
+def make_record(i: int, today: date) -> dict:
+    return {
+        "vendor_name": f"vendor-{i % 50}", "price": round(random.uniform(10, 500), 2),
+        "currency": random.choice(CURRENCIES), "start_date": today.isoformat(),
+        "end_date": (today + timedelta(days=random.randint(-30, 730))).isoformat(),
+    }
+
+
+def percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def create_tenant(username: str, rows: int) -> tuple:
+    """返回 (用户 id, 会话 Cookie 头)"""
+    async with main.db_pool.write() as db:
+        cursor = await db.execute("INSERT INTO users (username, password) VALUES (?, '')", [username])
+        user_id = cursor.lastrowid
+    today = date.today()
+
+    async def records():
+        for i in range(rows):
+            yield make_record(i, today)
+
+    await import_vps(main.db_pool, records(), user_id)
+    return user_id, {"Cookie": f"session={main.session_cache.issue(username, 3600)}"}
+
+
+async def small_load(client, tenants: list, requests: int, concurrency: int) -> dict:
+    """随机小用户请求列表 / 分页 / 汇总，返回延迟与状态码统计"""
+    latencies = []
+    statuses = Counter()
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            _, headers = random.choice(tenants)
+            _, path, params = random.choice(SMALL_REQUESTS)
+            start = time.perf_counter()
+            response = await client.get(path, params=params, headers=headers)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(max_loop_lag(stop))
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        stop.set()
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "lag_ms": await lag * 1000,
+        "statuses": statuses,
+    }
+
+
+async def max_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """事件循环的最大延迟：每 interval 秒醒来一次，记录比预期晚的时间"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def foreign_writes(stop: asyncio.Event, interval: float):
+    """模拟其他 worker 的写入：只递增共享计数器，本进程无法得知写入的是哪个用户"""
+    while not stop.is_set():
+        main.shared_state.bump("vps")
+        await asyncio.sleep(interval)
+
+
+async def big_load(client, headers: dict, stop: asyncio.Event, statuses: Counter):
+    """大用户循环执行：过滤分页、汇总、新增后删除一行"""
+    today = date.today()
+    while not stop.is_set():
+        action = random.random()
+        if action < 0.4:
+            response = await client.get("/api/vps", headers=headers, params={
+                "limit": 100, "vendor": f"vendor-{random.randrange(50)}"})
+        elif action < 0.6:
+            response = await client.get("/api/portfolio/summary", headers=headers)
+        else:
+            response = await client.post("/api/vps", headers=headers,
+                                         json=make_record(random.randrange(10 ** 6), today))
+            if response.status_code == 200:
+                statuses["write"] += 1
+                response = await client.delete(f"/api/vps/{response.json()['id']}", headers=headers)
+        statuses[response.status_code] += 1
+        # 被限流时不立即重试，避免空转占满事件循环
+        if response.status_code == 429:
+            await asyncio.sleep(0.01)
+
+
+async def run(args):
+    main.rate_cache.provider = StaticRateProvider(STUB_RATES)
+    if args.rate is not None:
+        main.rate_limiter.rate = args.rate
+    if args.burst is not None:
+        main.rate_limiter.burst = args.burst
+    transport = httpx.ASGITransport(app=main.app)
+    with tempfile.TemporaryDirectory() as tmp:
+        main.DB_PATH = os.path.join(tmp, "vps.db")
+        await main.startup_event()
+        try:
+            start = time.perf_counter()
+            _, big = await create_tenant("big", args.big_rows)
+            tenants = [await create_tenant(f"tenant-{i}", args.rows_per_tenant) for i in range(args.tenants)]
+            main.valuation_cache.invalidate()
+            await main.expiry_scheduler.load()
+            print(f"seeded {args.tenants} tenants x {args.rows_per_tenant} rows + {args.big_rows} rows "
+                  f"in {time.perf_counter() - start:.2f}s "
+                  f"(limit {main.rate_limiter.rate:g}/s, burst {main.rate_limiter.burst:g})")
+
+            limits = httpx.Limits(max_connections=args.concurrency + args.big_concurrency)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                         limits=limits, timeout=60) as client:
+                # 预热：每个用户的行与汇总进入缓存
+                for _, headers in [(None, big)] + tenants:
+                    await client.get("/api/vps", headers=headers)
+                idle = await small_load(client, tenants, args.requests, args.concurrency)
+
+                sample = random.sample(tenants, min(20, len(tenants)))
+                etags = [(await client.get("/api/vps", headers=headers)).headers["etag"] for _, headers in sample]
+                main.rate_limiter.limited = 0
+                stop = asyncio.Event()
+                big_statuses = Counter()
+                noisy = [asyncio.create_task(big_load(client, big, stop, big_statuses))
+                         for _ in range(args.big_concurrency)]
+                try:
+                    busy = await small_load(client, tenants, args.requests, args.concurrency)
+                finally:
+                    stop.set()
+                    await asyncio.gather(*noisy)
+                unchanged = 0
+                for (_, headers), etag in zip(sample, etags):
+                    response = await client.get("/api/vps", headers={**headers, "If-None-Match": etag})
+                    unchanged += response.status_code == 304
+
+                misses = main.valuation_cache.misses
+                stop = asyncio.Event()
+                background = [asyncio.create_task(big_load(client, big, stop, Counter()))
+                              for _ in range(args.big_concurrency)]
+                background.append(asyncio.create_task(foreign_writes(stop, args.foreign_interval)))
+                try:
+                    foreign = await small_load(client, tenants, args.requests, args.concurrency)
+                finally:
+                    stop.set()
+                    await asyncio.gather(*background)
+                reloads = main.valuation_cache.misses - misses
+        finally:
+            await main.shutdown_event()
+
+    print(f"{'phase':>10} {'req/s':>9} {'p50(ms)':>9} {'p99(ms)':>9} {'lag(ms)':>9} {'small 429':>10}")
+    for name, result in (("idle", idle), ("busy", busy), ("foreign", foreign)):
+        print(f"{name:>10} {result['rps']:>9.1f} {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+              f"{result['lag_ms']:>9.1f} {result['statuses'][429]:>10}")
+    big_total = sum(count for status, count in big_statuses.items() if status != "write")
+    print(f"big tenant: {big_total} requests, {big_statuses['write']} writes, {big_statuses[429]} rejected (429)")
+    print(f"small tenant ETags unchanged after big tenant writes: {unchanged}/{len(sample)}")
+    print(f"foreign writes: {reloads} per-tenant reloads during the phase")
+    print(f"valuation cache: {main.valuation_cache.hits} hits, {main.valuation_cache.misses} reloads; "
+          f"summary cache: {main.summary_cache.hits} hits, {main.summary_cache.misses} misses")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=500)
+    parser.add_argument("--rows-per-tenant", type=int, default=20)
+    parser.add_argument("--big-rows", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=2000, help="每个阶段的小用户请求数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--big-concurrency", type=int, default=8)
+    parser.add_argument("--foreign-interval", type=float, default=0.2, help="模拟其他 worker 写入的间隔（秒）")
+    parser.add_argument("--rate", type=float, help="覆盖 TENANT_RATE_LIMIT")
+    parser.add_argument("--burst", type=float, help="覆盖 TENANT_BURST")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,82 @@
+"""
+到期提醒堆的回归检查：反复修改同一批 VPS 的到期日后，调度堆中的条目数不能随修改次数增长
+（每台 VPS 只有一个有效条目，过期条目超过一半时重建），并且下一次提醒时间与从数据库重建的结果一致
+
+用法（在仓库根目录执行），失败时退出码为 1:
+    python benchmarks/check_expiry_heap.py [--vps 50] [--updates 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from database import ConnectionPool  # noqa: E402
+from expiry import ExpiryScheduler, MemoryNotifier  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+from valuation import EPOCH_ORDINAL  # noqa: E402
+
+
+async def run(args) -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vps.db")
+        pool = ConnectionPool(path)
+        await pool.open()
+        try:
+            async with pool.write() as db:
+                await run_migrations(db)
+            scheduler = ExpiryScheduler(pool, MemoryNotifier())
+            await scheduler.load()
+            random.seed(1)
+            today = date.today()
+            end_dates = {}
+            peak = 0
+            for i in range(args.updates):
+                vps_id = i % args.vps + 1
+                end_dates[vps_id] = today + timedelta(days=random.randint(1, 60))
+                scheduler.upsert(vps_id, f"vendor-{vps_id}", end_dates[vps_id].isoformat(), 1)
+                peak = max(peak, len(scheduler._deadlines))
+            for vps_id in range(1, args.vps // 2 + 1):
+                scheduler.remove(vps_id)
+                end_dates.pop(vps_id)
+            # 对照：同样的到期日写入数据库后重建
+            async with pool.write() as db:
+                await db.executemany(
+                    'INSERT INTO vps (id, user_id, vendor_name, price, currency, end_date, end_day) '
+                    'VALUES (?, 1, ?, 1, "USD", ?, ?)',
+                    [(vps_id, f"vendor-{vps_id}", end.isoformat(), end.toordinal() - EPOCH_ORDINAL)
+                     for vps_id, end in end_dates.items()]
+                )
+            expected = ExpiryScheduler(pool, MemoryNotifier())
+            await expected.load()
+        finally:
+            await pool.close()
+
+    limit = 2 * args.vps + 1
+    live = len(scheduler._live)
+    failures = []
+    if peak > limit:
+        failures.append(f"heap peaked at {peak} entries for {args.vps} VPS (limit {limit})")
+    if live != len(end_dates):
+        failures.append(f"{live} live deadlines for {len(end_dates)} tracked VPS")
+    # 已越过阈值的提醒立即触发（触发时间为当时的 time.time()），只比较提醒本身
+    if sorted(d[1:] for d in scheduler._live.values()) != sorted(d[1:] for d in expected._live.values()):
+        failures.append("live deadlines differ from a reload")
+    print(f"{args.vps} VPS, {args.updates} upserts: heap peak {peak}, final {len(scheduler._deadlines)}, "
+          f"live {live}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vps", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=2000)
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,97 @@
+"""
+批量导入解析检查：CSV 与 NDJSON 请求体按各种块大小切分后逐块送入解析器，
+多字节 UTF-8 字符（中文商家名）与 BOM 会落在块边界上，解析结果必须与整体送入时一致。
+CSV 由 csv.writer 写出（与导出相同），含字段内换行与引号；另检查超长行与超大 JSON 请求体被拒绝。
+
+用法（在仓库根目录执行），失败时退出码为 1:
+    python benchmarks/check_import_parsing.py
+"""
+import asyncio
+import csv
+import io
+import json
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import inventory  # noqa: E402
+from inventory import ImportTooLarge, parse_csv, parse_json_array, parse_ndjson  # noqa: E402
+
+RECORDS = [
+    {"vendor_name": "腾讯云", "price": "12.5", "currency": "CNY", "end_date": "2030-01-01"},
+    {"vendor_name": "Ünïcode €", "price": "3", "currency": "EUR", "end_date": "2031-06-30"},
+    {"vendor_name": "🚀 host", "price": "7", "currency": "USD", "end_date": "2029-12-31"},
+    {"vendor_name": 'multi\nline "quoted", host\n\nend', "price": "1", "currency": "USD",
+     "end_date": "2029-01-01"},
+]
+# 未加引号字段中的引号是普通字符，不能开启一个跨行的引号字段
+LITERAL_QUOTE_CSV = 'vendor_name,price\n5" disk,1\nnext,2\n'.encode()
+
+
+def csv_body() -> bytes:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(RECORDS[0])
+    writer.writerows(record.values() for record in RECORDS)
+    return ("\ufeff" + output.getvalue()).encode()
+
+
+def ndjson_body() -> bytes:
+    return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in RECORDS).encode("utf-8-sig")
+
+
+async def split(body: bytes, size: int):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def parse(parser, body: bytes, size: int) -> list:
+    results = []
+    async for record in parser(split(body, size)):
+        results.append(repr(record) if isinstance(record, Exception) else record)
+    return results
+
+
+async def run() -> int:
+    failures = []
+    for name, parser, body in (("csv", parse_csv, csv_body()), ("ndjson", parse_ndjson, ndjson_body())):
+        expected = await parse(parser, body, len(body))
+        if expected != RECORDS:
+            failures.append(f"{name}: whole body parsed as {expected}")
+            continue
+        # 1..8 字节的块覆盖了 2~4 字节字符与 3 字节 BOM 的所有切分位置
+        for size in range(1, 9):
+            try:
+                got = await parse(parser, body, size)
+            except UnicodeDecodeError as e:
+                failures.append(f"{name}: chunk size {size}: {e}")
+                continue
+            if got != expected:
+                failures.append(f"{name}: chunk size {size}: {got}")
+        print(f"{name}: {len(body)} bytes, chunk sizes 1..8 checked")
+
+    got = await parse(parse_csv, LITERAL_QUOTE_CSV, 3)
+    if got != [{"vendor_name": '5" disk', "price": "1"}, {"vendor_name": "next", "price": "2"}]:
+        failures.append(f"csv: literal quote parsed as {got}")
+    # 没有换行的超长行与超大 JSON 数组：解析器在缓冲超过上限前中止
+    for name, parser, body in (
+        ("csv line", parse_csv, b"a" * (inventory.MAX_LINE_LENGTH * 2)),
+        ("csv record", parse_csv, b'vendor_name\n"' + b"a\n" * inventory.MAX_LINE_LENGTH),
+        ("ndjson line", parse_ndjson, b"a" * (inventory.MAX_LINE_LENGTH * 2)),
+        ("json body", parse_json_array, b"[" + b" " * inventory.MAX_JSON_BYTES + b"]"),
+    ):
+        try:
+            await parse(parser, body, 65536)
+        except ImportTooLarge:
+            continue
+        failures.append(f"{name}: oversized input was not rejected")
+    print("literal quotes and size limits checked")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run()))
@@ -0,0 +1,82 @@
+"""
+查询计划回归检查：热点查询必须使用预期的索引，且不能出现全表 / 全索引扫描（SCAN）与临时排序
+
+用法（在仓库根目录执行），失败时退出码为 1:
+    python benchmarks/check_query_plans.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import aiosqlite  # noqa: E402
+
+from migrations import run_migrations  # noqa: E402
+
+# (名称, SQL, 参数, 计划中必须出现的索引)
+HOT_QUERIES = [
+    ("list all", "SELECT * FROM vps WHERE user_id = ? ORDER BY end_date DESC", [1], "idx_vps_user_end_date"),
+    ("get by id", "SELECT * FROM vps WHERE id = ? AND user_id = ?", [1, 1], "INTEGER PRIMARY KEY"),
+    ("first page",
+     "SELECT id, end_date FROM vps WHERE end_date IS NOT NULL AND user_id = ? "
+     "ORDER BY end_date DESC, id DESC LIMIT ?",
+     [1, 100], "idx_vps_user_end_date"),
+    ("next page",
+     "SELECT id, end_date FROM vps WHERE end_date IS NOT NULL AND user_id = ? AND (end_date, id) < (?, ?) "
+     "ORDER BY end_date DESC, id DESC LIMIT ?",
+     [1, "2030-01-01", 10, 100], "idx_vps_user_end_date"),
+    ("vendor filter",
+     "SELECT id, end_date FROM vps WHERE end_date IS NOT NULL AND user_id = ? AND vendor_name = ? "
+     "ORDER BY end_date DESC, id DESC LIMIT ?",
+     [1, "vendor", 100], "idx_vps_user_vendor_end_date"),
+    ("currency filter",
+     "SELECT id, end_date FROM vps WHERE end_date IS NOT NULL AND user_id = ? AND currency = ? "
+     "ORDER BY end_date DESC, id DESC LIMIT ?",
+     [1, "USD", 100], "idx_vps_user_currency_end_date"),
+    ("expiring before",
+     "SELECT id, end_date FROM vps WHERE end_date IS NOT NULL AND user_id = ? AND end_date < ? "
+     "ORDER BY end_date DESC, id DESC LIMIT ?",
+     [1, "2030-01-01", 100], "idx_vps_user_end_date"),
+    ("tenant reload", "SELECT * FROM vps WHERE user_id = ?", [1], "idx_vps_user_id"),
+    ("quota count", "SELECT COUNT(*) FROM vps WHERE user_id = ?", [1], "COVERING INDEX idx_vps_user_id"),
+    ("export batch", "SELECT * FROM vps WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?", [1, 0, 500],
+     "idx_vps_user_id"),
+    ("portfolio load",
+     "SELECT id, vendor_name, price, currency, end_day, start_day, billing_cycle FROM vps WHERE user_id = ?",
+     [1], "COVERING INDEX idx_vps_user_valuation"),
+    ("rate history", "SELECT day, currency, rate FROM rate_history WHERE currency IN (?, ?) ORDER BY currency, day",
+     ["USD", "CNY"], "COVERING INDEX idx_rate_history_currency_day"),
+    ("expiry load", "SELECT id, user_id, vendor_name, end_day FROM vps WHERE end_day >= ?", [20000],
+     "COVERING INDEX idx_vps_end_day"),
+]
+
+
+async def check(db) -> list:
+    failures = []
+    for name, sql, params, expected in HOT_QUERIES:
+        async with db.execute("EXPLAIN QUERY PLAN " + sql, params) as cursor:
+            plan = " | ".join(row[3] for row in await cursor.fetchall())
+        ok = expected in plan and "SCAN" not in plan and "TEMP B-TREE" not in plan
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<16} {plan}")
+        if not ok:
+            failures.append(name)
+    return failures
+
+
+async def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        async with aiosqlite.connect(os.path.join(tmp, "vps.db")) as db:
+            await run_migrations(db)
+            failures = await check(db)
+    if failures:
+        print(f"{len(failures)} hot queries no longer use their indexes: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,157 @@
+"""
+上游容错检查：启动一个可注入延迟与错误的本地 fixer 模拟服务，
+验证 HttpClient 的超时、重试、熔断，以及熔断期间 RateCache 继续返回旧汇率。
+
+用法（在仓库根目录执行），失败时退出码为 1:
+    python benchmarks/check_upstream.py
+"""
+import asyncio
+import logging
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from aiohttp import web  # noqa: E402
+
+from http_client import CircuitBreaker, HttpClient  # noqa: E402
+from rates import FixerRateProvider, RateCache, RatesUnavailable  # noqa: E402
+
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08}
+
+
+class FakeFixer:
+    """mode: ok / slow / error / malformed / unsuccessful；fail_first > 0 时前几次返回 503"""
+
+    def __init__(self):
+        self.mode = "ok"
+        self.delay = 0.0
+        self.fail_first = 0
+        self.calls = 0
+        self.connections = set()
+
+    async def latest(self, request):
+        self.calls += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.fail_first > 0:
+            self.fail_first -= 1
+            return web.json_response({"success": False}, status=503)
+        if self.mode == "error":
+            return web.json_response({"success": False}, status=500)
+        if self.mode == "malformed":
+            return web.Response(text="<html>gateway</html>", content_type="text/html")
+        if self.mode == "unsuccessful":
+            return web.json_response({"success": False, "error": {"code": 101}})
+        return web.json_response({"success": True, "base": "EUR", "rates": STUB_RATES})
+
+    def reset(self, mode: str = "ok", delay: float = 0.0, fail_first: int = 0):
+        self.mode = mode
+        self.delay = delay
+        self.fail_first = fail_first
+        self.calls = 0
+
+
+async def start(fake: FakeFixer) -> tuple:
+    app = web.Application()
+    app.router.add_get("/api/latest", fake.latest)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/api/latest"
+
+
+async def timed(coro) -> tuple:
+    """返回 (结果或异常, 耗时秒数)"""
+    start = time.perf_counter()
+    try:
+        result = await coro
+    except Exception as e:
+        result = e
+    return result, time.perf_counter() - start
+
+
+async def run() -> list:
+    fake = FakeFixer()
+    runner, url = await start(fake)
+    client = HttpClient(connect_timeout=0.5, read_timeout=0.3, deadline=1.5, retries=2, backoff=0.05)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.5)
+    provider = FixerRateProvider("test", url, client, breaker)
+    results = []
+
+    def check(name: str, ok: bool, detail: str = ""):
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<40} {detail}")
+        results.append(ok)
+
+    try:
+        rates, _ = await timed(provider.fetch())
+        await provider.fetch()
+        check("success", rates == STUB_RATES)
+        check("connection reused", len(fake.connections) == 1, f"{len(fake.connections)} connections")
+
+        fake.reset(fail_first=2)
+        rates, _ = await timed(provider.fetch())
+        check("retries transient 503", rates == STUB_RATES and fake.calls == 3, f"{fake.calls} calls")
+
+        fake.reset(delay=5)
+        error, seconds = await timed(provider.fetch())
+        check("slow upstream bounded by deadline", isinstance(error, RatesUnavailable) and seconds < 1.7,
+              f"{seconds:.2f}s, {fake.calls} calls")
+
+        breaker.record_success()
+        fake.reset(mode="malformed")
+        error, _ = await timed(provider.fetch())
+        check("malformed body not retried", isinstance(error, RatesUnavailable) and fake.calls == 1,
+              f"{type(error).__name__}: {error}")
+
+        breaker.record_success()
+        fake.reset(mode="unsuccessful")
+        error, _ = await timed(provider.fetch())
+        check("success=false rejected", isinstance(error, RatesUnavailable) and fake.calls == 1, str(error))
+
+        breaker.record_success()
+        fake.reset(mode="error")
+        for _ in range(3):
+            await timed(provider.fetch())
+        calls = fake.calls
+        error, seconds = await timed(provider.fetch())
+        check("circuit opens after 3 failures", breaker.state == CircuitBreaker.OPEN and fake.calls == calls
+              and isinstance(error, RatesUnavailable) and seconds < 0.01, f"{breaker.state}, {seconds * 1000:.2f}ms")
+
+        # 熔断期间旧汇率照常返回，后台刷新立即失败
+        cache = RateCache(provider, ttl=60, retry_interval=0)
+        cache.set_rates(STUB_RATES, time.time() - 3600 * 48)
+        rates, seconds = await timed(cache.get_rates())
+        await asyncio.sleep(0.05)
+        check("stale rates served while open", rates == STUB_RATES and seconds < 0.01 and fake.calls == calls,
+              f"{seconds * 1000:.2f}ms")
+
+        fake.reset(mode="ok")
+        await asyncio.sleep(0.5)
+        check("half-open after reset timeout", breaker.state == CircuitBreaker.HALF_OPEN)
+        rates, _ = await timed(cache.refresh())
+        check("recovers on successful trial", breaker.state == CircuitBreaker.CLOSED and cache.is_fresh,
+              f"{fake.calls} calls")
+
+        fake.reset(mode="error")
+        for _ in range(3):
+            await timed(provider.fetch())
+        await asyncio.sleep(0.5)
+        fake.reset(mode="error")
+        await timed(provider.fetch())
+        check("failed trial reopens circuit", breaker.state == CircuitBreaker.OPEN and fake.calls == 1,
+              f"{fake.calls} calls")
+    finally:
+        await client.close()
+        await runner.cleanup()
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(0 if all(asyncio.run(run())) else 1)
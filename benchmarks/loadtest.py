@@ -0,0 +1,286 @@
+"""
+负载测试与微基准：按库存规模（默认 100 / 10k / 100k 行）生成数据，
+用本地 HTTP 服务模拟 fixer.io，以多个并发客户端压测首页、列表、换算与增删改查接口，
+输出 p50/p99 延迟、每秒请求数与进程内存（RSS），结果保存为 JSON 便于跨提交对比。
+
+客户端与应用运行在同一事件循环中（ASGI 进程内传输），绝对数值偏保守，适合同一机器上前后对比。
+
+用法（在仓库根目录执行）:
+    python benchmarks/loadtest.py [--rows 100 10000 100000] [--concurrency 16] [--requests 500]
+    python benchmarks/loadtest.py --compare benchmarks/results/<旧结果>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.chdir(ROOT)
+os.environ.setdefault("ADMIN_PASSWORD", "benchmark")
+
+import httpx  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+import main  # noqa: E402
+from inventory import import_vps  # noqa: E402
+from rates import FixerRateProvider  # noqa: E402
+
+CURRENCIES = ["CNY", "USD", "EUR", "GBP", "JPY", "CAD"]
+STUB_RATES = {"EUR": 1.0, "CNY": 7.8, "USD": 1.08, "GBP": 0.86, "JPY": 160.0, "CAD": 1.47}
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+SCENARIOS = ("home", "list", "list-page", "convert", "crud")
+# 对比时延迟或吞吐变化超过该比例视为回退
+REGRESSION_THRESHOLD = 0.10
+
+
+def make_record(i: int, today: date) -> dict:
+    return {
+        "vendor_name": f"vendor-{i % 50}", "cpu_cores": random.choice([1, 2, 4, 8]), "cpu_model": "EPYC",
+        "memory": random.choice([1, 2, 4, 8, 16]), "storage": random.choice([20, 50, 100]),
+        "bandwidth": 1000, "price": round(random.uniform(10, 500), 2),
+        "currency": random.choice(CURRENCIES), "start_date": today.isoformat(),
+        "end_date": (today + timedelta(days=random.randint(-30, 730))).isoformat(),
+    }
+
+
+async def seed(rows: int):
+    today = date.today()
+
+    async def records():
+        for i in range(rows):
+            yield make_record(i, today)
+
+    await import_vps(main.db_pool, records(), user_id=1)
+    main.valuation_cache.invalidate()
+
+
+def rss_mb() -> dict:
+    """当前 RSS 与峰值 RSS（MB）"""
+    current = 0.0
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    peak = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    return {"rss_mb": round(current, 1), "peak_rss_mb": round(peak, 1)}
+
+
+def percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def start_stub_fixer() -> tuple:
+    """本地模拟 fixer.io latest 接口，返回 (runner, url, 请求计数)"""
+    calls = {"count": 0}
+
+    async def latest(request):
+        calls["count"] += 1
+        return web.json_response({"success": True, "base": "EUR", "rates": STUB_RATES})
+
+    app = web.Application()
+    app.router.add_get("/api/latest", latest)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/api/latest", calls
+
+
+def make_request(scenario: str):
+    """返回一次请求的协程工厂；crud 为 创建 -> 读取 -> 修改 -> 删除 的完整流程"""
+    if scenario == "home":
+        return lambda client: client.get("/")
+    if scenario == "list":
+        return lambda client: client.get("/api/vps")
+    if scenario == "list-page":
+        return lambda client: client.get("/api/vps", params={"limit": 100, "currency": random.choice(CURRENCIES)})
+    if scenario == "convert":
+        return lambda client: client.get("/api/convert", params={
+            "amount": round(random.uniform(1, 500), 2), "currency": random.choice(CURRENCIES)})
+
+    async def crud(client):
+        record = make_record(random.randint(0, 10 ** 6), date.today())
+        response = await client.post("/api/vps", json=record)
+        vps_id = response.json()["id"]
+        await client.get(f"/api/vps/{vps_id}")
+        record["price"] = round(record["price"] * 1.1, 2)
+        await client.put(f"/api/vps/{vps_id}", json=record)
+        return await client.delete(f"/api/vps/{vps_id}")
+
+    return crud
+
+
+async def run_scenario(client, scenario: str, requests: int, concurrency: int) -> dict:
+    request = make_request(scenario)
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await request(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        **rss_mb(),
+    }
+
+
+async def micro_benchmarks(iterations: int) -> list:
+    """单次调用耗时（微秒）；汇率已缓存，测的是换算本身的开销"""
+    end_date = (date.today() + timedelta(days=200)).isoformat()
+    cases = {
+        "calculate_remaining_value": lambda: main.calculate_remaining_value(100.0, "USD", end_date),
+        "convert_to_cny": lambda: main.convert_to_cny(100.0, "USD"),
+    }
+    results = []
+    for name, call in cases.items():
+        await call()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            await call()
+        elapsed = time.perf_counter() - start
+        results.append({"name": name, "iterations": iterations,
+                        "us_per_call": round(elapsed / iterations * 1e6, 3)})
+    return results
+
+
+async def run(args) -> dict:
+    runner, stub_url, stub_calls = await start_stub_fixer()
+    main.rate_cache.provider = FixerRateProvider("benchmark", stub_url)
+    # 所有请求来自同一个用户，测的是吞吐而不是限流
+    main.rate_limiter.rate = 0
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    micro = []
+    try:
+        for rows in args.rows:
+            with tempfile.TemporaryDirectory() as tmp:
+                main.DB_PATH = os.path.join(tmp, "vps.db")
+                # 每轮使用全新的数据库与缓存，汇率首次请求时从模拟服务获取
+                main.rate_cache.set_rates({}, 0)
+                main.valuation_cache.invalidate()
+                await main.startup_event()
+                try:
+                    start = time.perf_counter()
+                    await seed(rows)
+                    print(f"seeded {rows} rows in {time.perf_counter() - start:.2f}s")
+                    limits = httpx.Limits(max_connections=args.concurrency)
+                    async with httpx.AsyncClient(transport=transport, base_url="http://bench",
+                                                 limits=limits, timeout=60) as client:
+                        await client.post("/api/login", data={"username": "admin", "password": "benchmark"})
+                        for scenario in args.scenarios:
+                            # 预热一次，缓存与预编译语句就绪后再计时
+                            await make_request(scenario)(client)
+                            result = await run_scenario(client, scenario, args.requests, args.concurrency)
+                            result.update(rows=rows, scenario=scenario, concurrency=args.concurrency)
+                            results.append(result)
+                            print(f"{rows:>7} {scenario:>10} {result['rps']:>9.1f} req/s "
+                                  f"p50 {result['p50_ms']:>8.2f}ms p99 {result['p99_ms']:>8.2f}ms "
+                                  f"rss {result['rss_mb']:>7.1f}MB errors {result['errors']}")
+                    if not micro:
+                        micro = await micro_benchmarks(args.iterations)
+                        for item in micro:
+                            print(f"{item['name']:>28} {item['us_per_call']:>9.3f} us/call")
+                finally:
+                    await main.shutdown_event()
+    finally:
+        await runner.cleanup()
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {"rows": args.rows, "concurrency": args.concurrency, "requests": args.requests,
+                   "scenarios": list(args.scenarios)},
+        "fixer_requests": stub_calls["count"],
+        "results": results,
+        "micro": micro,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(baseline: dict, current: dict) -> int:
+    """逐项对比两次结果，返回回退项数"""
+    previous = {(r["rows"], r["scenario"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\ncompare {baseline['commit']} -> {current['commit']}")
+    for result in current["results"]:
+        old = previous.get((result["rows"], result["scenario"]))
+        if not old:
+            continue
+        p99 = result["p99_ms"] / old["p99_ms"] - 1 if old["p99_ms"] else 0.0
+        rps = result["rps"] / old["rps"] - 1 if old["rps"] else 0.0
+        flag = ""
+        if p99 > REGRESSION_THRESHOLD or rps < -REGRESSION_THRESHOLD:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{result['rows']:>7} {result['scenario']:>10} req/s {rps:+7.1%}  p99 {p99:+7.1%}{flag}")
+    previous_micro = {m["name"]: m for m in baseline.get("micro", [])}
+    for item in current["micro"]:
+        old = previous_micro.get(item["name"])
+        if old:
+            print(f"{item['name']:>28} {item['us_per_call'] / old['us_per_call'] - 1:+7.1%}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="每个场景的请求数")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=20000, help="微基准调用次数")
+    parser.add_argument("--output", type=Path, help="结果文件，默认 benchmarks/results/<提交>-<时间>.json")
+    parser.add_argument("--compare", type=Path, help="与之前保存的结果对比，存在回退时退出码为 1")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    output = args.output or RESULTS_DIR / f"{report['commit']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"results written to {output}")
+    if args.compare:
+        sys.exit(1 if compare(json.loads(args.compare.read_text()), report) else 0)
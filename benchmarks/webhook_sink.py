@@ -0,0 +1,41 @@
+"""
+本地 webhook 接收端：打印收到的到期提醒，用于检查 EXPIRY_WEBHOOK_URL 配置。
+--fail 使其返回 HTTP 500，可观察调度器的失败重试。
+
+用法（在仓库根目录执行）:
+    python benchmarks/webhook_sink.py [--port 9900] [--fail]
+    EXPIRY_WEBHOOK_URL=http://127.0.0.1:9900/alerts uvicorn main:app
+"""
+import argparse
+import json
+
+from aiohttp import web
+
+
+def make_app(fail: bool) -> web.Application:
+    received = []
+
+    async def alerts(request):
+        alert = await request.json()
+        received.append(alert)
+        print(f"[{len(received)}] {json.dumps(alert, ensure_ascii=False)}", flush=True)
+        if fail:
+            return web.json_response({"success": False}, status=500)
+        return web.json_response({"success": True})
+
+    async def list_alerts(request):
+        return web.json_response(received)
+
+    app = web.Application()
+    app.router.add_post("/alerts", alerts)
+    app.router.add_get("/alerts", list_alerts)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--fail", action="store_true", help="始终返回 HTTP 500")
+    args = parser.parse_args()
+    web.run_app(make_app(args.fail), host=args.host, port=args.port, access_log=None)
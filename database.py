@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# 每个连接的 PRAGMA 配置
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",   # 约 8MB 页缓存
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+# sqlite3 按连接缓存已编译的语句，连接复用即可复用预编译语句
+STATEMENT_CACHE_SIZE = 256
+
+
+class TimedConnection(aiosqlite.Connection):
+    """
+    记录每条 SQL 在数据库线程中的实际执行时间（不含排队等待），
+    执行结束后在事件循环中回调 observer(sql, seconds)。
+    """
+
+    observer: Optional[Callable[[str, float], None]] = None
+
+    async def _execute(self, fn, *args, **kwargs):
+        observer = self.observer
+        if observer is None or not args or not isinstance(args[0], str):
+            return await super()._execute(fn, *args, **kwargs)
+        elapsed = []
+
+        def timed(*inner_args, **inner_kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*inner_args, **inner_kwargs)
+            finally:
+                elapsed.append(time.perf_counter() - start)
+
+        try:
+            return await super()._execute(timed, *args, **kwargs)
+        finally:
+            if elapsed:
+                observer(args[0], elapsed[0])
+
+
+class ConnectionPool:
+    """进程级 SQLite 连接池：单写连接 + 多个只读连接（WAL 模式下读写互不阻塞）"""
+
+    def __init__(self, db_path: str, readers: int = 4,
+                 observer: Optional[Callable[[str, float], None]] = None):
+        self.db_path = db_path
+        self.size = readers
+        self.observer = observer
+        # 空闲只读连接与按到达顺序排队的等待者；连接归还时直接交给最早的等待者
+        self._readers: deque = deque()
+        self._read_waiters: deque = deque()
+        self._all_readers = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._closed = True
+        # 统计信息
+        self._reads = 0
+        self._writes = 0
+        self._read_wait = 0.0
+        self._write_wait = 0.0
+        self._max_wait = 0.0
+        self._readers_in_use = 0
+        self._writer_in_use = False
+
+    async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        db_path = self.db_path
+        db = TimedConnection(lambda: sqlite3.connect(db_path, cached_statements=STATEMENT_CACHE_SIZE), 64)
+        db.observer = self.observer
+        await db
+        db.row_factory = aiosqlite.Row
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        if readonly:
+            await db.execute("PRAGMA query_only=ON")
+        return db
+
+    async def open(self):
+        if not self._closed:
+            return
+        self._writer = await self._connect()
+        for _ in range(self.size):
+            db = await self._connect(readonly=True)
+            self._all_readers.append(db)
+            self._readers.append(db)
+        self._closed = False
+        logger.info(f"Database pool opened: 1 writer, {self.size} readers")
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        async with self._write_lock:
+            await self._writer.close()
+            self._writer = None
+        for db in self._all_readers:
+            await db.close()
+        self._all_readers.clear()
+        self._readers.clear()
+        logger.info("Database pool closed")
+
+    def _record_wait(self, waited: float):
+        if waited > self._max_wait:
+            self._max_wait = waited
+
+    async def _acquire_reader(self) -> aiosqlite.Connection:
+        # 不用 asyncio.Queue：被唤醒的等待者可能被新到的请求抢先，重新排到队尾，高并发下个别请求会等待数秒
+        if self._readers and not self._read_waiters:
+            return self._readers.popleft()
+        waiter = asyncio.get_running_loop().create_future()
+        self._read_waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 连接已交给本请求，但请求被取消
+                self._release_reader(waiter.result())
+            raise
+
+    def _release_reader(self, db: aiosqlite.Connection):
+        while self._read_waiters:
+            waiter = self._read_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(db)
+                return
+        self._readers.append(db)
+
+    @asynccontextmanager
+    async def read(self):
+        """获取只读连接（按请求到达顺序分配）"""
+        if self._closed:
+            raise RuntimeError("Database pool is not open")
+        start = time.perf_counter()
+        db = await self._acquire_reader()
+        waited = time.perf_counter() - start
+        self._reads += 1
+        self._read_wait += waited
+        self._record_wait(waited)
+        self._readers_in_use += 1
+        try:
+            yield db
+        finally:
+            self._readers_in_use -= 1
+            self._release_reader(db)
+
+    @asynccontextmanager
+    async def write(self):
+        """获取唯一的写连接，正常退出时提交，异常时回滚"""
+        if self._closed:
+            raise RuntimeError("Database pool is not open")
+        start = time.perf_counter()
+        async with self._write_lock:
+            waited = time.perf_counter() - start
+            self._writes += 1
+            self._write_wait += waited
+            self._record_wait(waited)
+            self._writer_in_use = True
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            finally:
+                self._writer_in_use = False
+
+    def stats(self) -> dict:
+        """等待时间与使用率计数器"""
+        return {
+            "readers": self.size,
+            "readers_in_use": self._readers_in_use,
+            "writer_in_use": self._writer_in_use,
+            "utilization": (self._readers_in_use + self._writer_in_use) / (self.size + 1),
+            "reads": self._reads,
+            "writes": self._writes,
+            "read_wait_seconds": round(self._read_wait, 6),
+            "write_wait_seconds": round(self._write_wait, 6),
+            "avg_read_wait_seconds": round(self._read_wait / self._reads, 6) if self._reads else 0.0,
+            "avg_write_wait_seconds": round(self._write_wait / self._writes, 6) if self._writes else 0.0,
+            "max_wait_seconds": round(self._max_wait, 6),
+        }
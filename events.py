@@ -0,0 +1,174 @@
+import asyncio
+import json
+from collections import deque
+from typing import Optional
+
+from starlette.responses import StreamingResponse
+
+
+class Event:
+    """
+    总线上的一条事件，所有订阅者共享同一个对象。
+    rendered 供订阅者缓存按自身视图（币种、是否可编辑）渲染的结果，同一视图只渲染一次。
+    """
+
+    __slots__ = ("type", "data", "version", "rendered")
+
+    def __init__(self, type: str, data: Optional[dict] = None, version: Optional[str] = None):
+        self.type = type
+        self.data = data or {}
+        self.version = version
+        self.rendered: dict = {}
+
+
+# 队列溢出后代替被丢弃事件交给订阅者的事件：客户端应整体重新加载
+RESYNC = Event("reload")
+
+
+class Subscription:
+    """
+    单个订阅者的有界队列。发布方从不等待：队列已满时清空队列并标记溢出，
+    订阅者下次读取时收到 RESYNC，之后照常接收新事件。慢客户端因此最多占用 max_queue 个事件。
+    """
+
+    def __init__(self, bus: "EventBus", topic, max_queue: int):
+        self.bus = bus
+        self.topic = topic
+        self.max_queue = max_queue
+        self.overflowed = False
+        self.closed = False
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, event: Event) -> bool:
+        if self.closed:
+            return False
+        if len(self._queue) >= self.max_queue:
+            self._queue.clear()
+            self.overflowed = True
+            self._ready.set()
+            return False
+        self._queue.append(event)
+        self._ready.set()
+        return True
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    async def get(self, timeout: float) -> Optional[Event]:
+        """下一条事件；超时返回 None，总线关闭后抛出 EOFError"""
+        if not self._queue and not self.overflowed and not self.closed:
+            self._ready.clear()
+            # 与 expiry 相同，不用 wait_for（3.11 中唤醒与取消同时发生时会吞掉取消）
+            waiter = asyncio.ensure_future(self._ready.wait())
+            try:
+                await asyncio.wait([waiter], timeout=timeout)
+            finally:
+                waiter.cancel()
+        if self.overflowed:
+            self.overflowed = False
+            return RESYNC
+        if self._queue:
+            return self._queue.popleft()
+        if self.closed:
+            raise EOFError
+        return None
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+        self.bus._remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SubscriberLimit(Exception):
+    pass
+
+
+class EventBus:
+    """
+    进程内发布/订阅：按主题（用户 id）分组，topic 为 None 的事件广播给所有订阅者。
+    只通知本进程的订阅者；多 worker 部署时由订阅方按版本发现其他 worker 的写入。
+    """
+
+    def __init__(self, max_queue: int = 64, max_subscribers: int = 1000):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self._topics: dict = {}
+        self._count = 0
+
+    def subscribe(self, topic) -> Subscription:
+        if self._count >= self.max_subscribers:
+            raise SubscriberLimit(f"Too many subscribers ({self.max_subscribers})")
+        subscription = Subscription(self, topic, self.max_queue)
+        self._topics.setdefault(topic, set()).add(subscription)
+        self._count += 1
+        return subscription
+
+    def _remove(self, subscription: Subscription):
+        subscribers = self._topics.get(subscription.topic)
+        if subscribers is not None and subscription in subscribers:
+            subscribers.discard(subscription)
+            self._count -= 1
+            if not subscribers:
+                del self._topics[subscription.topic]
+
+    def publish(self, topic, event: Event) -> int:
+        """返回收到事件的订阅者数（不含溢出丢弃的）"""
+        self.published += 1
+        if topic is None:
+            targets = [s for subscribers in self._topics.values() for s in subscribers]
+        else:
+            targets = list(self._topics.get(topic, ()))
+        delivered = 0
+        for subscription in targets:
+            if subscription.put(event):
+                delivered += 1
+            else:
+                self.dropped += 1
+        self.delivered += delivered
+        return delivered
+
+    def close(self):
+        """关闭所有订阅（进程退出时），进行中的事件流随之结束"""
+        for subscribers in list(self._topics.values()):
+            for subscription in list(subscribers):
+                subscription.close()
+
+    def __len__(self):
+        return self._count
+
+
+def format_sse(event: str, data, id: Optional[str] = None) -> str:
+    """一条 text/event-stream 消息；data 按 JSON 编码（单行，无需拆分）"""
+    message = f"event: {event}\n"
+    if id is not None:
+        message += f"id: {id}\n"
+    return message + f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+class EventStreamResponse(StreamingResponse):
+    """
+    text/event-stream 响应。客户端断开时 Starlette 取消的是发送任务，停在 yield 处的生成器
+    要等垃圾回收才会结束（订阅随之滞留），这里在响应结束时立即关闭生成器。
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(self, content, headers: Optional[dict] = None):
+        super().__init__(content, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                           **(headers or {})})
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
@@ -0,0 +1,373 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from http_client import HttpClient
+from shared import FileLock, SharedCounters
+from valuation import EPOCH_ORDINAL
+
+logger = logging.getLogger(__name__)
+
+# 发送失败后的重试间隔（秒）
+RETRY_INTERVAL = 300
+# 时钟跳变时最多睡眠这么久后重新检查
+MAX_SLEEP = 3600
+# 多进程部署时检查其他 worker 写入与提醒锁的间隔（秒）
+SYNC_INTERVAL = 30
+
+
+class Notifier:
+    """提醒发送接口：send 失败时抛出异常，调度器稍后重试"""
+
+    name = "base"
+
+    async def send(self, alert: dict):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LogNotifier(Notifier):
+    name = "log"
+
+    async def send(self, alert: dict):
+        logger.warning(f"VPS {alert['vps_id']} ({alert['vendor_name']}) expires on "
+                       f"{alert['end_date']} ({alert['days_left']} days left)")
+
+
+class MemoryNotifier(Notifier):
+    """保存在内存中，用于本地检查"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.alerts: list = []
+
+    async def send(self, alert: dict):
+        self.alerts.append(alert)
+
+
+class WebhookNotifier(Notifier):
+    """以 JSON POST 到 webhook 地址，错误状态视为失败（调度器负责重试）"""
+
+    name = "webhook"
+
+    def __init__(self, url: str, client: Optional[HttpClient] = None):
+        self.url = url
+        self._owns_client = client is None
+        self.client = client or HttpClient()
+
+    async def send(self, alert: dict):
+        await self.client.request("POST", self.url, json=alert, retries=0)
+
+    async def close(self):
+        if self._owns_client:
+            await self.client.close()
+
+
+@lru_cache(maxsize=4096)
+def day_start(day: int) -> float:
+    """序数日当天 0 点（本地时间）的时间戳"""
+    return datetime.combine(date.fromordinal(day), datetime.min.time()).timestamp()
+
+
+class ExpiryScheduler:
+    """
+    到期提醒调度器。
+    - 启动时从 end_day 索引读取一次未到期的 VPS，之后随 VPS 写入增量维护
+    - _deadlines 为 (触发时间, vps_id, end_day, 阈值) 的最小堆，后台任务睡眠到最近的触发时间，无需轮询；
+      每台 VPS 只有一个有效条目（_live 中记录的那个，即下一次提醒），触发后再安排下一个阈值
+    - _by_end_day 为按 (end_day, vps_id) 排序的列表，供 /api/vps/expiring 做区间查询
+    - 已发送的提醒记录在 expiry_alerts 表中，重启后不会重复发送
+    修改或删除后堆中的旧条目不立即移除，弹出时不是 _live 中的条目即丢弃；
+    过期条目超过堆的一半时用 _live 重建堆，堆的大小不随修改次数增长。
+
+    多进程部署时：每次增量更新递增共享计数器 "expiry"（与递增在同一步中检查版本，
+    本进程的并发写入不会误判为其他 worker 的写入），发现其他 worker 写入后从数据库重建；
+    只有持有 lock 的 worker 发送提醒。
+    """
+
+    def __init__(self, pool, notifier: Notifier, thresholds: Iterable[int] = (7, 3, 1, 0),
+                 counters: Optional[SharedCounters] = None, lock: Optional[FileLock] = None):
+        self.pool = pool
+        self.notifier = notifier
+        self.thresholds = tuple(sorted(set(int(t) for t in thresholds), reverse=True))
+        self.counters = counters or SharedCounters()
+        self.lock = lock
+        self._version = -1
+        self.sent = 0
+        self.failed = 0
+        # 提醒已发出但写入 expiry_alerts 失败的次数；这些提醒留在 _unrecorded 中等待重试写入
+        self.record_failures = 0
+        self._unrecorded: set = set()
+        self._entries: dict = {}
+        self._by_end_day: list = []
+        self._deadlines: list = []
+        self._live: dict = {}
+        self._stale = 0
+        self._sent_keys: set = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self):
+        """从数据库重建（启动时、批量导入后与其他 worker 写入后）"""
+        today = date.today().toordinal()
+        version = self.counters.get("expiry")
+        async with self.pool.read() as db:
+            async with db.execute(
+                'SELECT id, user_id, vendor_name, end_day FROM vps WHERE end_day >= ?', [today - EPOCH_ORDINAL]
+            ) as cursor:
+                rows = await cursor.fetchall()
+            async with db.execute(
+                'SELECT vps_id, end_day, threshold FROM expiry_alerts WHERE end_day >= ?',
+                [today - EPOCH_ORDINAL]
+            ) as cursor:
+                sent = await cursor.fetchall()
+        self._sent_keys = {(vps_id, end_day + EPOCH_ORDINAL, threshold) for vps_id, end_day, threshold in sent}
+        # 已发送但尚未落库的提醒不能因重建而重发，只重试写入
+        self._unrecorded -= self._sent_keys
+        self._sent_keys |= self._unrecorded
+        self._entries = {}
+        self._by_end_day = []
+        self._live = {}
+        for vps_id, user_id, vendor_name, end_day in rows:
+            self._entries[vps_id] = (end_day + EPOCH_ORDINAL, vendor_name or "", user_id)
+            self._by_end_day.append((end_day + EPOCH_ORDINAL, vps_id))
+            deadline = self._next_deadline(vps_id, end_day + EPOCH_ORDINAL, today)
+            if deadline is not None:
+                self._live[vps_id] = deadline
+        self._by_end_day.sort()
+        self._deadlines = list(self._live.values())
+        heapq.heapify(self._deadlines)
+        self._stale = 0
+        self._version = version
+        self._wakeup.set()
+        logger.info(f"Expiry scheduler tracking {len(self._entries)} VPS")
+
+    async def sync(self):
+        if self.counters.get("expiry") != self._version:
+            await self.load()
+
+    def _follow(self) -> bool:
+        """本进程写入后调用：递增版本，期间其他进程也有写入时放弃增量更新，等待 sync 重建"""
+        version = self.counters.bump("expiry")
+        if version != self._version + 1:
+            self._version = -1
+            self._wakeup.set()
+            return False
+        self._version = version
+        return True
+
+    def invalidate(self):
+        """批量写入等绕过逐行更新的场景，通知所有 worker 下次 sync 时重建"""
+        self.counters.bump("expiry")
+        self._version = -1
+        self._wakeup.set()
+
+    def _next_deadline(self, vps_id: int, end_day: int, today: int) -> Optional[tuple]:
+        """
+        下一次提醒的堆条目：先重试已发送未落库的提醒；已越过的阈值中只补发最紧迫的一个；
+        否则为下一个未到的阈值
+        """
+        days_left = end_day - today
+        if days_left < 0:
+            return None
+        for threshold in self.thresholds:
+            if (vps_id, end_day, threshold) in self._unrecorded:
+                return (time.time(), vps_id, end_day, threshold)
+        crossed = [t for t in self.thresholds if days_left <= t]
+        if crossed and (vps_id, end_day, crossed[-1]) not in self._sent_keys:
+            return (time.time(), vps_id, end_day, crossed[-1])
+        for threshold in self.thresholds:
+            if days_left > threshold:
+                return (day_start(end_day - threshold), vps_id, end_day, threshold)
+        return None
+
+    def _push(self, deadline: Optional[tuple]):
+        """把 deadline 设为该 VPS 唯一有效的条目，之前的条目变为过期"""
+        if deadline is None:
+            return
+        if self._live.pop(deadline[1], None) is not None:
+            self._stale += 1
+        self._live[deadline[1]] = deadline
+        heapq.heappush(self._deadlines, deadline)
+        self._compact()
+
+    def _drop(self, vps_id: int):
+        if self._live.pop(vps_id, None) is not None:
+            self._stale += 1
+            self._compact()
+
+    def _compact(self):
+        """过期条目超过一半时只保留有效条目重建堆，摊还 O(1)"""
+        if self._stale * 2 > len(self._deadlines):
+            self._deadlines = list(self._live.values())
+            heapq.heapify(self._deadlines)
+            self._stale = 0
+
+    def _pop_stale(self):
+        """丢弃堆顶的过期条目"""
+        while self._deadlines and self._live.get(self._deadlines[0][1]) is not self._deadlines[0]:
+            heapq.heappop(self._deadlines)
+            self._stale -= 1
+
+    def _schedule_next(self, vps_id: int, end_day: int):
+        """提醒处理完后安排同一 VPS 的下一个阈值（期间 VPS 已被修改、重新安排过的不覆盖）"""
+        if vps_id not in self._live:
+            self._push(self._next_deadline(vps_id, end_day, date.today().toordinal()))
+
+    def _remove_index(self, vps_id: int):
+        entry = self._entries.pop(vps_id, None)
+        if entry is not None:
+            position = bisect.bisect_left(self._by_end_day, (entry[0], vps_id))
+            if position < len(self._by_end_day) and self._by_end_day[position] == (entry[0], vps_id):
+                del self._by_end_day[position]
+
+    def upsert(self, vps_id: int, vendor_name: Optional[str], end_date: Optional[str],
+               user_id: Optional[int] = None):
+        """新增或修改后调用；到期日无效或已过期时不再跟踪"""
+        if not self._follow():
+            return
+        self._remove_index(vps_id)
+        self._drop(vps_id)
+        try:
+            end_day = date.fromisoformat(end_date).toordinal()
+        except (TypeError, ValueError):
+            return
+        today = date.today().toordinal()
+        if end_day < today:
+            return
+        self._entries[vps_id] = (end_day, vendor_name or "", user_id)
+        bisect.insort(self._by_end_day, (end_day, vps_id))
+        self._push(self._next_deadline(vps_id, end_day, today))
+        self._wakeup.set()
+
+    def remove(self, vps_id: int):
+        if self._follow():
+            self._remove_index(vps_id)
+            self._drop(vps_id)
+
+    def expiring(self, days: int, today: Optional[int] = None, user_id: Optional[int] = None) -> list:
+        """今天起 days 天内（含）到期的 VPS，按到期日升序；指定 user_id 时只返回该用户的"""
+        if today is None:
+            today = date.today().toordinal()
+        start = bisect.bisect_left(self._by_end_day, (today, -1))
+        end = bisect.bisect_right(self._by_end_day, (today + days, float("inf")))
+        return [
+            {
+                "id": vps_id,
+                "vendor_name": self._entries[vps_id][1],
+                "end_date": date.fromordinal(end_day).isoformat(),
+                "days_left": end_day - today,
+            }
+            for end_day, vps_id in self._by_end_day[start:end]
+            if user_id is None or self._entries[vps_id][2] == user_id
+        ]
+
+    async def _fire(self, vps_id: int, end_day: int, threshold: int):
+        entry = self._entries.get(vps_id)
+        key = (vps_id, end_day, threshold)
+        if entry is None or entry[0] != end_day:
+            self._unrecorded.discard(key)
+            return
+        if key in self._sent_keys:
+            if key in self._unrecorded:
+                await self._record(key)
+            self._schedule_next(vps_id, end_day)
+            return
+        today = date.today().toordinal()
+        alert = {
+            "vps_id": vps_id,
+            "user_id": entry[2],
+            "vendor_name": entry[1],
+            "end_date": date.fromordinal(end_day).isoformat(),
+            "days_left": end_day - today,
+            "threshold": threshold,
+        }
+        try:
+            await self.notifier.send(alert)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Expiry alert for VPS {vps_id} failed: {e}")
+            if vps_id not in self._live:
+                self._push((time.time() + RETRY_INTERVAL, vps_id, end_day, threshold))
+            return
+        self.sent += 1
+        self._sent_keys.add(key)
+        self._unrecorded.add(key)
+        await self._record(key)
+        self._schedule_next(vps_id, end_day)
+
+    async def _record(self, key: tuple):
+        """记录已发送的提醒；失败时异常交给 _run 处理，重新排队后只重试写入，不会重发"""
+        vps_id, end_day, threshold = key
+        async with self.pool.write() as db:
+            await db.execute(
+                'INSERT OR IGNORE INTO expiry_alerts (vps_id, end_day, threshold, sent_at) VALUES (?, ?, ?, ?)',
+                [vps_id, end_day - EPOCH_ORDINAL, threshold, time.time()]
+            )
+        self._unrecorded.discard(key)
+
+    def _is_leader(self) -> bool:
+        return self.lock is None or self.lock.acquire(blocking=False)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Expiry scheduler reload failed: {e}")
+            leader = self._is_leader()
+            now = time.time()
+            self._pop_stale()
+            while leader and self._deadlines and self._deadlines[0][0] <= now:
+                _, vps_id, end_day, threshold = heapq.heappop(self._deadlines)
+                del self._live[vps_id]
+                try:
+                    await self._fire(vps_id, end_day, threshold)
+                except Exception as e:
+                    # 与 history 的 _run 一样：记录失败并稍后重试，不让一次数据库错误结束调度任务
+                    self.record_failures += 1
+                    logger.error(f"Expiry alert for VPS {vps_id} could not be recorded: {e}", exc_info=True)
+                    if vps_id not in self._live:
+                        self._push((time.time() + RETRY_INTERVAL, vps_id, end_day, threshold))
+                self._pop_stale()
+            timeout = MAX_SLEEP
+            if self._deadlines and leader:
+                timeout = min(MAX_SLEEP, max(0.0, self._deadlines[0][0] - time.time()))
+            if self.counters.path or not leader:
+                # 其他 worker 的写入不会唤醒本进程，按间隔检查计数器
+                timeout = min(timeout, SYNC_INTERVAL)
+            # 不用 wait_for：Python 3.11 中唤醒与取消同时发生时 wait_for 会吞掉取消，stop() 随之卡住
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait([waiter], timeout=timeout)
+            finally:
+                waiter.cancel()
+
+    def next_deadline(self) -> Optional[float]:
+        self._pop_stale()
+        return self._deadlines[0][0] if self._deadlines else None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.lock is not None:
+            self.lock.release()
+        await self.notifier.close()
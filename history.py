@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import time
+from datetime import date, timedelta
+from typing import Optional
+
+from expiry import day_start
+from rates import RatesUnavailable, epoch_day
+from shared import FileLock
+from valuation import EPOCH_ORDINAL, summarize, value_portfolio
+
+logger = logging.getLogger(__name__)
+
+# 桶大小（fleet_history.resolution）
+DAY, WEEK, MONTH = 0, 1, 2
+RESOLUTIONS = {"day": DAY, "week": WEEK, "month": MONTH}
+RESOLUTION_NAMES = {value: name for name, value in RESOLUTIONS.items()}
+
+# 快照的分组维度（fleet_history.dimension）；合计行的 key 为空串
+DIMENSIONS = {"total": 0, "vendor": 1, "currency": 2}
+
+# 将 epoch-day 映射为所在周 / 所在月（1 日）起始 epoch-day 的 SQL 表达式；1970-01-01 为周四。
+# 周桶在月初处截断（起始日为周一与当月 1 日中较晚的一个），跨月的周拆成两个桶，
+# 每个周桶完整地属于一个月，周桶合并到月桶时不会把下个月的天数算进上个月
+MONTH_SQL = "CAST(julianday(date(bucket * 86400, 'unixepoch', 'start of month')) - 2440587.5 AS INTEGER)"
+BUCKET_SQL = {
+    DAY: "bucket",
+    WEEK: f"MAX(bucket - (bucket + 3) % 7, {MONTH_SQL})",
+    MONTH: MONTH_SQL,
+}
+
+# 快照失败（如汇率不可用）后的重试间隔（秒）
+RETRY_INTERVAL = 600
+# 跨过零点后稍等再记录，避免与时钟误差赛跑
+SNAPSHOT_DELAY = 60
+# 非 leader 的 worker 检查能否接手的间隔（秒）
+STANDBY_INTERVAL = 3600
+
+
+def to_day(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def from_day(value: date) -> int:
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def month_start(day: int) -> int:
+    return from_day(to_day(day).replace(day=1))
+
+
+def next_month_start(day: int) -> int:
+    start = to_day(day)
+    return from_day(date(start.year + start.month // 12, start.month % 12 + 1, 1))
+
+
+def bucket_start(day: int, resolution: int) -> int:
+    """epoch-day 所在桶的起始 epoch-day（周桶在月初截断，见 BUCKET_SQL）"""
+    if resolution == WEEK:
+        return max(day - (day + 3) % 7, month_start(day))
+    if resolution == MONTH:
+        return month_start(day)
+    return day
+
+
+def bucket_end(day: int, resolution: int) -> int:
+    """桶 [day, end) 的结束 epoch-day（不含）"""
+    if resolution == WEEK:
+        return min(day - (day + 3) % 7 + 7, next_month_start(day))
+    if resolution == MONTH:
+        return next_month_start(day)
+    return day + 1
+
+
+def snapshot_rows(user_id: int, portfolio, table, target: str, today: int) -> list:
+    """一个用户当天的快照行：合计、按商家、按币种（估值与汇总较重，在线程池中调用）"""
+    summary = summarize(portfolio, value_portfolio(portfolio, table, target, today + EPOCH_ORDINAL))
+    rows = [(user_id, DAY, today, DIMENSIONS["total"], "", 1, summary["count"],
+             summary["remaining_value"], summary["monthly_cost"])]
+    rows.extend((user_id, DAY, today, DIMENSIONS["vendor"], vendor, 1, values["count"],
+                 values["remaining_value"], values["monthly_cost"])
+                for vendor, values in summary["by_vendor"].items())
+    rows.extend((user_id, DAY, today, DIMENSIONS["currency"], currency, 1, values["count"],
+                 values["remaining_value"], values["monthly_cost"])
+                for currency, values in summary["by_currency"].items())
+    return rows
+
+
+class FleetHistory:
+    """
+    每日机队快照：每个用户的剩余价值、月支出与 VPS 数，合计及按商家、按币种，均以 CNY 计。
+    快照由 ValuationCache 中已缓存的行计算，每天每个用户一次，追加写入 fleet_history。
+    降采样：超过 daily_days 的日桶按周合并，超过 weekly_days 的周桶按月合并，超过 monthly_days 的月桶删除；
+    桶内保存各日数值之和与快照天数，合并时直接相加，平均值始终精确。周桶从周一开始、
+    在月初截断，跨月的周拆成两个桶，因此每个周桶都落在同一个月内，月桶恰好包含本月的天数。
+    /api/history 只读取这些预聚合的桶，不重新计算 VPS 行。
+    多进程部署时只有持有 lock 的 worker 记录快照与降采样。
+    """
+
+    def __init__(self, pool, valuation_cache, rate_cache, daily_days: int = 90, weekly_days: int = 730,
+                 monthly_days: int = 3650, lock: Optional[FileLock] = None):
+        self.pool = pool
+        self.valuation_cache = valuation_cache
+        self.rate_cache = rate_cache
+        self.daily_days = daily_days
+        self.weekly_days = weekly_days
+        self.monthly_days = monthly_days
+        self.lock = lock
+        self.snapshots = 0
+        self.failures = 0
+        self.last_snapshot: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, today: Optional[int] = None) -> int:
+        """记录当天的快照（已有快照的用户跳过），返回新记录的用户数；汇率不可用时抛出 RatesUnavailable"""
+        if today is None:
+            today = epoch_day()
+        async with self.pool.read() as db:
+            async with db.execute('SELECT id FROM users') as cursor:
+                users = [row[0] for row in await cursor.fetchall()]
+            async with db.execute(
+                'SELECT user_id FROM fleet_history WHERE resolution = ? AND bucket = ? AND dimension = 0',
+                [DAY, today]
+            ) as cursor:
+                done = {row[0] for row in await cursor.fetchall()}
+        pending = [user_id for user_id in users if user_id not in done]
+        if not pending:
+            return 0
+        table = await self.rate_cache.get_table()
+        for user_id in pending:
+            portfolio = await self.valuation_cache.portfolio(self.pool, self.rate_cache, user_id)
+            # 大机队的估值与汇总放到线程中，不阻塞事件循环
+            rows = await asyncio.to_thread(snapshot_rows, user_id, portfolio, table,
+                                           self.valuation_cache.target, today)
+            async with self.pool.write() as db:
+                await db.executemany(
+                    'INSERT OR IGNORE INTO fleet_history (user_id, resolution, bucket, dimension, key, '
+                    'samples, count, remaining_value, monthly_cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.snapshots += len(pending)
+        self.last_snapshot = time.time()
+        logger.info(f"Recorded fleet history for {len(pending)} users on {to_day(today).isoformat()}")
+        return len(pending)
+
+    async def downsample(self, today: Optional[int] = None) -> dict:
+        """
+        按保留期合并与清理，返回各级被合并 / 删除的行数。
+        截止日对齐到周 / 月起始，被合并的周与月都是完整的；同一个桶重复合并时数值累加（ON CONFLICT）。
+        """
+        if today is None:
+            today = epoch_day()
+        daily_cutoff = bucket_start(today - self.daily_days, WEEK)
+        weekly_cutoff = bucket_start(today - self.weekly_days, MONTH)
+        monthly_cutoff = today - self.monthly_days
+        result = {}
+        async with self.pool.write() as db:
+            for source, target, cutoff in ((DAY, WEEK, daily_cutoff), (WEEK, MONTH, weekly_cutoff)):
+                await db.execute(
+                    f'INSERT INTO fleet_history (user_id, resolution, bucket, dimension, key, '
+                    f'samples, count, remaining_value, monthly_cost) '
+                    f'SELECT user_id, ?, {BUCKET_SQL[target]} AS target_bucket, dimension, key, '
+                    f'SUM(samples), SUM(count), SUM(remaining_value), SUM(monthly_cost) '
+                    f'FROM fleet_history WHERE resolution = ? AND bucket < ? '
+                    f'GROUP BY user_id, target_bucket, dimension, key '
+                    f'ON CONFLICT (user_id, dimension, bucket, resolution, key) DO UPDATE SET '
+                    f'samples = samples + excluded.samples, count = count + excluded.count, '
+                    f'remaining_value = remaining_value + excluded.remaining_value, '
+                    f'monthly_cost = monthly_cost + excluded.monthly_cost',
+                    [target, source, cutoff]
+                )
+                cursor = await db.execute('DELETE FROM fleet_history WHERE resolution = ? AND bucket < ?',
+                                          [source, cutoff])
+                result[RESOLUTION_NAMES[source]] = cursor.rowcount
+            cursor = await db.execute('DELETE FROM fleet_history WHERE resolution = ? AND bucket < ?',
+                                      [MONTH, monthly_cutoff])
+            result[RESOLUTION_NAMES[MONTH]] = cursor.rowcount
+        if any(result.values()):
+            logger.info(f"Downsampled fleet history: {result}")
+        return result
+
+    async def query(self, user_id: int, dimension: str = "total", resolution: Optional[str] = None,
+                    start_day: Optional[int] = None, end_day: Optional[int] = None) -> dict:
+        """
+        图表用的区间数据：dates 为各桶起始日，series 为每个 key 与 dates 对齐的平均值数组（缺失为 None）。
+        resolution 为空时按保存的粒度返回（近期为日、较早为周 / 月）；
+        指定 week / month 时把更细的桶合并到该粒度，更粗的桶原样返回。
+        """
+        level = RESOLUTIONS[resolution] if resolution else DAY
+        bucket_sql = (f"CASE WHEN resolution >= {level} THEN bucket ELSE {BUCKET_SQL[level]} END"
+                      if level != DAY else "bucket")
+        conditions = ['user_id = ?', 'dimension = ?']
+        params = [user_id, DIMENSIONS[dimension]]
+        if resolution == "day":
+            conditions.append(f'resolution = {DAY}')
+        if start_day is not None:
+            # 包含起始日所在的月桶，之后剔除在起始日之前结束的桶
+            conditions.append('bucket >= ?')
+            params.append(bucket_start(start_day, MONTH))
+        if end_day is not None:
+            conditions.append('bucket <= ?')
+            params.append(end_day)
+        async with self.pool.read() as db:
+            async with db.execute(
+                f'SELECT {bucket_sql} AS point, MAX(resolution), key, SUM(samples), SUM(count), '
+                f'SUM(remaining_value), SUM(monthly_cost) FROM fleet_history '
+                f'WHERE {" AND ".join(conditions)} GROUP BY point, key ORDER BY point',
+                params
+            ) as cursor:
+                rows = await cursor.fetchall()
+        points: dict = {}
+        values: dict = {}
+        for point, size, key, samples, count, remaining, monthly in rows:
+            size = max(size, level)
+            if start_day is not None and bucket_end(point, size) <= start_day:
+                continue
+            points[point] = max(size, points.get(point, size))
+            values[(point, key)] = (round(count / samples, 2), round(remaining / samples, 2),
+                                    round(monthly / samples, 2))
+        dates = sorted(points)
+        keys = sorted({key for _, key in values})
+        series = []
+        for key in keys:
+            entries = [values.get((point, key)) for point in dates]
+            series.append({
+                "key": key if dimension != "total" else "total",
+                "count": [entry and entry[0] for entry in entries],
+                "remaining_value": [entry and entry[1] for entry in entries],
+                "monthly_cost": [entry and entry[2] for entry in entries],
+            })
+        return {
+            "currency": self.valuation_cache.target,
+            "dimension": dimension,
+            "resolution": resolution or "auto",
+            "dates": [to_day(point).isoformat() for point in dates],
+            "resolutions": [RESOLUTION_NAMES[points[point]] for point in dates],
+            "series": series,
+        }
+
+    def _is_leader(self) -> bool:
+        return self.lock is None or self.lock.acquire(blocking=False)
+
+    async def _run(self):
+        while True:
+            timeout = STANDBY_INTERVAL
+            if self._is_leader():
+                try:
+                    await self.record()
+                    await self.downsample()
+                    tomorrow = date.today() + timedelta(days=1)
+                    # 时钟调整后最多晚一小时发现
+                    timeout = min(STANDBY_INTERVAL,
+                                  max(0.0, day_start(tomorrow.toordinal()) + SNAPSHOT_DELAY - time.time()))
+                except RatesUnavailable as e:
+                    self.failures += 1
+                    logger.warning(f"Fleet history snapshot postponed: {e}")
+                    timeout = RETRY_INTERVAL
+                except Exception as e:
+                    self.failures += 1
+                    logger.error(f"Fleet history snapshot failed: {e}", exc_info=True)
+                    timeout = RETRY_INTERVAL
+            await asyncio.sleep(timeout)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.lock is not None:
+            self.lock.release()
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+if TYPE_CHECKING:
+    import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# 这些状态码视为上游暂时不可用，可以重试
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def _aiohttp():
+    """aiohttp 导入约 120ms，只在首次发出请求时导入（汇率多数时候来自缓存，冷启动不需要它）"""
+    import aiohttp
+    return aiohttp
+
+
+class UpstreamError(Exception):
+    """请求上游失败（重试后仍失败、返回错误状态或响应无法解析）"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpen(UpstreamError):
+    """熔断中，未发出请求"""
+
+
+class CircuitBreaker:
+    """
+    连续失败 failure_threshold 次后熔断 reset_timeout 秒，期间直接拒绝请求；
+    到期后放行一次试探请求（半开），成功则恢复，失败则重新计时。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self.rejections = 0
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.failure_threshold:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def in_trial(self) -> bool:
+        return self._trial
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        self.rejections += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._trial = False
+
+    def cancel_trial(self):
+        """请求被取消，不计入结果"""
+        self._trial = False
+
+    def record_failure(self):
+        self._trial = False
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.failures == self.failure_threshold:
+                self.opens += 1
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+
+class HttpClient:
+    """
+    应用级 HTTP 客户端：复用同一个 ClientSession（连接池），在首次请求时创建，close() 后可再次使用。
+    每次尝试有连接/读取超时，整次调用有总时限 deadline；
+    连接错误、超时与 RETRY_STATUSES 按指数退避 + 全抖动重试。
+    """
+
+    def __init__(self, connect_timeout: float = 3, read_timeout: float = 10, deadline: float = 20,
+                 retries: int = 2, backoff: float = 0.5, max_backoff: float = 5, limit: int = 20):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limit = limit
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self._session: Optional["aiohttp.ClientSession"] = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        if self._session is None or self._session.closed:
+            aiohttp = _aiohttp()
+            timeout = aiohttp.ClientTimeout(total=self.connect_timeout + self.read_timeout,
+                                            connect=self.connect_timeout, sock_read=self.read_timeout)
+            connector = aiohttp.TCPConnector(limit=self.limit, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _attempt(self, method: str, url: str, **kwargs):
+        async with self._get_session().request(method, url, **kwargs) as response:
+            if response.status in RETRY_STATUSES:
+                raise UpstreamError(f"HTTP {response.status} from {url}")
+            if response.status >= 400:
+                # 客户端错误重试也不会成功
+                raise UpstreamError(f"HTTP {response.status} from {url}", retryable=False)
+            return await response.read()
+
+    async def request(self, method: str, url: str, *, retries: Optional[int] = None,
+                      breaker: Optional[CircuitBreaker] = None,
+                      parse: Optional[Callable[[bytes], Any]] = None, **kwargs):
+        """
+        返回响应体（或 parse(响应体)）；失败时抛出 UpstreamError（熔断中为 CircuitOpen）。
+        parse 抛出 ValueError 时视为上游失败（不重试），同样计入熔断。
+        """
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpen(f"Circuit open for {url}")
+        retries = self.retries if retries is None else retries
+        if breaker is not None and breaker.in_trial:
+            # 半开状态只试探一次
+            retries = 0
+        try:
+            data = await self._request(method, url, retries, **kwargs)
+            if parse is not None:
+                try:
+                    data = parse(data)
+                except ValueError as e:
+                    raise UpstreamError(f"Invalid response from {url}: {e}", retryable=False) from e
+        except UpstreamError:
+            self.failures += 1
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.cancel_trial()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return data
+
+    async def request_json(self, method: str, url: str, *,
+                           parse: Optional[Callable[[Any], Any]] = None, **kwargs):
+        def decode(body: bytes):
+            data = json.loads(body)
+            return parse(data) if parse is not None else data
+
+        return await self.request(method, url, parse=decode, **kwargs)
+
+    async def _request(self, method: str, url: str, retries: int, **kwargs):
+        client_error = _aiohttp().ClientError
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.requests += 1
+            remaining = max(deadline - time.monotonic(), 0.001)
+            try:
+                return await asyncio.wait_for(self._attempt(method, url, **kwargs), remaining)
+            except UpstreamError as e:
+                error = e
+            except (client_error, asyncio.TimeoutError) as e:
+                error = UpstreamError(f"{type(e).__name__} from {url}" + (f": {e}" if str(e) else ""))
+                error.__cause__ = e
+            delay = self._delay(attempt)
+            if not error.retryable or attempt >= retries or time.monotonic() + delay >= deadline:
+                raise error
+            attempt += 1
+            self.retried += 1
+            logger.warning(f"{error}; retry {attempt}/{retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,402 @@
+import base64
+import codecs
+import csv
+import io
+import json
+from collections import deque
+from datetime import date
+from typing import Optional
+
+from rates import RateTable
+from valuation import BILLING_CYCLES, DEFAULT_BILLING_CYCLE, remaining_value
+
+# vps 表的全部列；remaining_value 为派生字段
+VPS_COLUMNS = (
+    "id", "vendor_name", "cpu_cores", "cpu_model", "memory", "storage", "bandwidth",
+    "price", "currency", "start_date", "end_date", "billing_cycle", "user_id",
+)
+DERIVED_FIELDS = ("remaining_value",)
+
+# 分页与流式读取时每次查询的行数，每批只短暂占用一个只读连接
+CHUNK_SIZE = 500
+# 导入时单行（CSV 为单条记录，可含字段内换行）的最大字符数，与 JSON 数组请求体的最大字节数；
+# 流式导入只缓冲一行，超出即中止，避免没有换行的超长请求体整体留在内存中
+MAX_LINE_LENGTH = 64 * 1024
+MAX_JSON_BYTES = 16 * 1024 * 1024
+
+
+class ImportTooLarge(ValueError):
+    pass
+
+
+def encode_cursor(end_date: str, vps_id: int) -> str:
+    raw = json.dumps([end_date, vps_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        end_date, vps_id = json.loads(raw)
+        return str(end_date), int(vps_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def parse_fields(fields: Optional[str]) -> Optional[list]:
+    """fields=id,vendor_name,remaining_value -> 列表；None 表示全部字段"""
+    if not fields:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in VPS_COLUMNS + DERIVED_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return selected
+
+
+async def iter_vps(pool, table: RateTable, *, user_id: Optional[int] = None, vendor: Optional[str] = None,
+                   currency: Optional[str] = None, expiring_before: Optional[str] = None,
+                   min_remaining_value: Optional[float] = None, fields: Optional[list] = None,
+                   after: Optional[tuple] = None, limit: Optional[int] = None):
+    """
+    按 (end_date, id) 倒序的键集分页读取 VPS，逐行产出 (cursor_key, dict)。
+    user_id 与其他过滤条件由 (user_id, ...) 索引支持；min_remaining_value 在计算剩余价值后过滤。
+    """
+    output = fields or list(VPS_COLUMNS + DERIVED_FIELDS)
+    with_value = "remaining_value" in output or min_remaining_value is not None
+    needed = [field for field in output if field in VPS_COLUMNS]
+    for column in ("id", "end_date") + (("price", "currency", "billing_cycle") if with_value else ()):
+        if column not in needed:
+            needed.append(column)
+
+    conditions = ["end_date IS NOT NULL"]
+    params = []
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    if vendor is not None:
+        conditions.append("vendor_name = ?")
+        params.append(vendor)
+    if currency is not None:
+        conditions.append("currency = ?")
+        params.append(currency)
+    if expiring_before is not None:
+        conditions.append("end_date < ?")
+        params.append(expiring_before)
+    select = f"SELECT {', '.join(needed)} FROM vps WHERE {' AND '.join(conditions)} "
+    order = "ORDER BY end_date DESC, id DESC LIMIT ?"
+    first_sql = select + order
+    next_sql = select + "AND (end_date, id) < (?, ?) " + order
+    # 没有后置过滤时只取所需行数
+    chunk = CHUNK_SIZE if limit is None or min_remaining_value is not None else min(limit, CHUNK_SIZE)
+
+    today = date.today().toordinal()
+    produced = 0
+    while True:
+        if after is None:
+            sql, args = first_sql, params + [chunk]
+        else:
+            sql, args = next_sql, params + [after[0], after[1], chunk]
+        async with pool.read() as db:
+            async with db.execute(sql, args) as cursor:
+                rows = await cursor.fetchall()
+        for row in rows:
+            item = dict(row)
+            after = (item["end_date"], item["id"])
+            if with_value:
+                try:
+                    item["remaining_value"] = remaining_value(
+                        item["price"] or 0, item["currency"], item["end_date"], table, today,
+                        cycle=item["billing_cycle"]
+                    )
+                except (TypeError, ValueError):
+                    item["remaining_value"] = None
+                if min_remaining_value is not None and (
+                    item["remaining_value"] is None or item["remaining_value"] < min_remaining_value
+                ):
+                    continue
+            yield after, {field: item[field] for field in output}
+            produced += 1
+            if limit is not None and produced >= limit:
+                return
+        if len(rows) < chunk:
+            return
+
+
+# 批量导入可写入的列
+IMPORT_COLUMNS = (
+    "vendor_name", "cpu_cores", "cpu_model", "memory", "storage", "bandwidth",
+    "price", "currency", "start_date", "end_date", "billing_cycle",
+)
+NUMERIC_COLUMNS = ("cpu_cores", "memory", "storage", "bandwidth", "price")
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_ERRORS = 1000
+
+
+def parse_currency(value, table: Optional[RateTable] = None) -> str:
+    """三位字母的币种代码（转为大写）；传入 table 时还必须是有汇率的币种，无效时抛出 ValueError"""
+    currency = str(value or "CNY").strip().upper()
+    if len(currency) != 3 or not currency.isalpha():
+        raise ValueError(f"invalid currency: {currency}")
+    if table is not None and currency not in table:
+        raise ValueError(f"unsupported currency: {currency}")
+    return currency
+
+
+def validate_vps(record: dict, table: Optional[RateTable] = None) -> tuple:
+    """校验一条导入记录，返回可直接插入的参数元组；无效时抛出 ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    vendor_name = str(record.get("vendor_name") or "").strip()
+    if not vendor_name:
+        raise ValueError("vendor_name is required")
+    values = {}
+    for column in NUMERIC_COLUMNS:
+        raw = record.get(column)
+        try:
+            values[column] = float(raw) if raw not in (None, "") else 0.0
+        except (TypeError, ValueError):
+            raise ValueError(f"{column} must be a number")
+        if values[column] < 0:
+            raise ValueError(f"{column} must not be negative")
+    currency = parse_currency(record.get("currency"), table)
+    dates = {}
+    for column in ("start_date", "end_date"):
+        raw = record.get(column)
+        if raw in (None, ""):
+            if column == "end_date":
+                raise ValueError("end_date is required")
+            dates[column] = date.today().isoformat()
+            continue
+        try:
+            dates[column] = date.fromisoformat(str(raw).strip()).isoformat()
+        except ValueError:
+            raise ValueError(f"{column} must be YYYY-MM-DD")
+    billing_cycle = str(record.get("billing_cycle") or DEFAULT_BILLING_CYCLE).strip().lower()
+    if billing_cycle not in BILLING_CYCLES:
+        raise ValueError(f"billing_cycle must be one of {', '.join(BILLING_CYCLES)}")
+    return (
+        vendor_name, values["cpu_cores"], str(record.get("cpu_model") or ""),
+        values["memory"], values["storage"], values["bandwidth"], values["price"],
+        currency, dates["start_date"], dates["end_date"], billing_cycle,
+    )
+
+
+async def iter_lines(chunks):
+    """
+    把字节流切分为文本行，不缓冲整个请求体。
+    增量解码：跨两个块的多字节字符留在解码器中，与下一块拼接后再输出；开头的 BOM 只在首块去除。
+    未结束的一行超过 MAX_LINE_LENGTH 时抛出 ImportTooLarge。
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if len(line) > MAX_LINE_LENGTH:
+                raise ImportTooLarge(f"Line exceeds {MAX_LINE_LENGTH} characters")
+            yield line.rstrip("\r")
+        if len(buffer) > MAX_LINE_LENGTH:
+            raise ImportTooLarge(f"Line exceeds {MAX_LINE_LENGTH} characters")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def parse_ndjson(chunks):
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"invalid JSON: {e}")
+
+
+class _LineQueue:
+    """csv.reader 的输入：parse_csv 只在队列中已有完整记录时读取，reader 不会在记录中途遇到空队列"""
+
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+def ends_in_quoted_field(line: str, quoted: bool) -> bool:
+    """
+    该行结束时是否仍在引号字段内（记录未结束）；与 csv 模块默认方言一致：
+    引号只在字段开头起作用，引号字段内的 "" 为转义，未加引号字段中的引号是普通字符
+    """
+    state = "quoted" if quoted else "start"
+    for char in line:
+        if state == "quoted":
+            if char == '"':
+                state = "quote"
+        elif char == ",":
+            state = "start"
+        elif state == "start":
+            state = "quoted" if char == '"' else "field"
+        elif state == "quote":
+            state = "quoted" if char == '"' else "field"
+    return state == "quoted"
+
+
+async def parse_csv(chunks):
+    """
+    首行为表头。所有行送入同一个 csv.reader，引号内的换行（导出的 csv.writer 会写出）按字段内容解析；
+    一行结束时不在引号字段内，记录才结束；单条记录（含字段内换行）最多 MAX_LINE_LENGTH 个字符。
+    """
+    queue = _LineQueue()
+    reader = csv.reader(queue)
+    header = None
+    quoted = False
+    length = 0
+    async for line in iter_lines(chunks):
+        if not quoted and not line.strip():
+            continue
+        queue.lines.append(line + "\n")
+        length += len(line) + 1
+        if length > MAX_LINE_LENGTH:
+            raise ImportTooLarge(f"CSV record exceeds {MAX_LINE_LENGTH} characters")
+        quoted = ends_in_quoted_field(line, quoted)
+        if quoted:
+            continue
+        length = 0
+        try:
+            values = next(reader)
+        except csv.Error as e:
+            yield ValueError(f"invalid CSV: {e}")
+            continue
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        if len(values) != len(header):
+            yield ValueError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+        yield dict(zip(header, values))
+    if queue.lines:
+        # 结尾的引号没有闭合
+        yield ValueError("invalid CSV: unterminated quoted field")
+
+
+async def parse_json_array(chunks):
+    """JSON 数组无法逐行切分，整体解析；请求体超过 MAX_JSON_BYTES 时抛出 ImportTooLarge（大批量请用 NDJSON）"""
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > MAX_JSON_BYTES:
+            raise ImportTooLarge(f"JSON body exceeds {MAX_JSON_BYTES} bytes; use NDJSON for large imports")
+        parts.append(chunk)
+    body = b"".join(parts)
+    try:
+        records = json.loads(body or b"[]")
+    except ValueError as e:
+        yield ValueError(f"invalid JSON: {e}")
+        return
+    if not isinstance(records, list):
+        yield ValueError("JSON body must be an array")
+        return
+    for record in records:
+        yield record
+
+
+IMPORT_PARSERS = {"csv": parse_csv, "ndjson": parse_ndjson, "json": parse_json_array}
+
+
+async def count_vps(pool, user_id: int) -> int:
+    async with pool.read() as db:
+        async with db.execute('SELECT COUNT(*) FROM vps WHERE user_id = ?', [user_id]) as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def import_vps(pool, records, user_id: int, quota: Optional[int] = None,
+                     table: Optional[RateTable] = None) -> dict:
+    """
+    校验并分块写入：每 IMPORT_CHUNK_SIZE 行一次 executemany + 一次提交。
+    解析或校验失败的行记录在 errors 中（行号从 1 开始），不影响其他行。
+    quota 为该用户可保存的总行数，超出部分的行记为失败；传入 table 时没有汇率的币种也记为失败。
+    """
+    available = None if quota is None else max(quota - await count_vps(pool, user_id), 0)
+    sql = f'''
+        INSERT INTO vps ({", ".join(IMPORT_COLUMNS)}, user_id)
+        VALUES ({", ".join("?" for _ in IMPORT_COLUMNS)}, ?)
+    '''
+    inserted = 0
+    error_count = 0
+    errors = []
+    batch = []
+
+    async def flush():
+        nonlocal inserted
+        async with pool.write() as db:
+            await db.executemany(sql, batch)
+        inserted += len(batch)
+        batch.clear()
+
+    row = 0
+    async for record in records:
+        row += 1
+        try:
+            if isinstance(record, Exception):
+                raise record
+            values = validate_vps(record, table) + (user_id,)
+            if available is not None:
+                if available <= inserted + len(batch):
+                    raise ValueError(f"VPS quota exceeded ({quota})")
+            batch.append(values)
+        except ValueError as e:
+            error_count += 1
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append({"row": row, "error": str(e)})
+            continue
+        if len(batch) >= IMPORT_CHUNK_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    return {"inserted": inserted, "failed": error_count, "errors": errors}
+
+
+async def iter_vps_batches(pool, user_id: int, columns=VPS_COLUMNS):
+    """按 id 键集分批读取某个用户的全部 VPS，用于导出"""
+    sql = f"SELECT {', '.join(columns)} FROM vps WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?"
+    last_id = 0
+    while True:
+        async with pool.read() as db:
+            async with db.execute(sql, [user_id, last_id, CHUNK_SIZE]) as cursor:
+                rows = await cursor.fetchall()
+        if rows:
+            yield rows
+        if len(rows) < CHUNK_SIZE:
+            return
+        last_id = rows[-1]["id"]
+
+
+async def export_vps(pool, format: str, user_id: int):
+    """流式导出，每批数据库读取产出一段文本"""
+    if format == "csv":
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(VPS_COLUMNS)
+        async for rows in iter_vps_batches(pool, user_id):
+            writer.writerows(rows)
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+        yield output.getvalue()
+    elif format == "ndjson":
+        async for rows in iter_vps_batches(pool, user_id):
+            yield "".join(json.dumps(dict(row), ensure_ascii=False) + "\n" for row in rows)
+    else:
+        separator = "["
+        async for rows in iter_vps_batches(pool, user_id):
+            yield separator + ",".join(json.dumps(dict(row), ensure_ascii=False) for row in rows)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
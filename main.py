@@ -1,376 +1,169 @@
-from fastapi import FastAPI, Request, Form, HTTPException, Cookie
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import APIRouter, FastAPI, Request, Form, HTTPException, Cookie, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import aiosqlite
-import aiohttp
-from datetime import datetime
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-import secrets
+import asyncio
+import ipaddress
+import math
+import sqlite3
+from datetime import date, datetime
+import time
+import json
 from typing import Optional
-from jinja2 import Template
+from markupsafe import Markup
 import logging
 import os
 import base64
 from pathlib import Path
 from fastapi.templating import Jinja2Templates
+from starlette.formparsers import MultiPartException, MultiPartParser
+from auth import PasswordHasher, SessionCache, load_secret_key
+from database import ConnectionPool
+from http_client import CircuitBreaker, HttpClient
+from migrations import run_migrations
+from shared import FileLock, SharedCounters
+from startup import DeferredInit, DeferredInitFailed
+from ratelimit import RateLimiter
+from rates import FixerRateProvider, RateCache, RatesUnavailable, RateTable
+from valuation import (BILLING_CYCLES, DEFAULT_BILLING_CYCLE, EPOCH_ORDINAL, RATE_MODES, ValuationCache,
+                       date_to_day, remaining_value, summarize, value_portfolio)
+from ranking import RANK_METRICS, RankIndex
+from rate_history import RateHistoryCache, history_currencies, load_history
+from render import LRUCache, RenderedPage, negotiate_encoding
+from uploads import ImageStore, UnsupportedImage, UploadTooLarge
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, QUERY_BUCKETS, LoopLagMonitor,
+                     MetricsMiddleware, Registry, statement_label)
+from expiry import ExpiryScheduler, LogNotifier, WebhookNotifier
+from history import DIMENSIONS as HISTORY_DIMENSIONS, RESOLUTIONS as HISTORY_RESOLUTIONS, FleetHistory
+from events import Event, EventBus, EventStreamResponse, SubscriberLimit, format_sse
+from snapshot import DEFAULT_FORMAT, MEDIA_TYPES, SnapshotRenderer, available_formats, format_remaining
+from inventory import (IMPORT_PARSERS, ImportTooLarge, decode_cursor, encode_cursor, export_vps, import_vps,
+                       iter_vps, parse_currency, parse_fields)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# 应用配置
-app = FastAPI()
-SECRET_KEY = secrets.token_urlsafe(32)
+# 路由在模块中注册，由 create_app() 组装成应用（见文件末尾）
+router = APIRouter()
+
+# 指标：请求延迟、SQL 耗时、汇率缓存、事件循环延迟（/metrics）
+metrics_registry = Registry()
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+db_query_seconds = metrics_registry.histogram(
+    "sqlite_query_duration_seconds", "SQLite statement execution time", ("statement",), QUERY_BUCKETS)
+rate_refresh_seconds = metrics_registry.histogram(
+    "exchange_rate_refresh_duration_seconds", "Exchange rate refresh latency", ("result",))
+loop_monitor = LoopLagMonitor(metrics_registry)
+
+def observe_query(sql: str, seconds: float):
+    db_query_seconds.observe(statement_label(sql), value=seconds)
 FIXER_API_KEY = os.getenv("FIXER_API_KEY")
+FIXER_API_URL = os.getenv("FIXER_API_URL", "http://data.fixer.io/api/latest")
 DB_PATH = os.path.join('data', 'vps.db')
 
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DOMAIN = os.getenv("DOMAIN", "localhost")
+BASE_URL = os.getenv("BASE_URL", f"http://{DOMAIN}")
+
+# 图片上传：单张大小上限、目录总大小上限与保存天数
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_MB", "200")) * 1024 * 1024
+IMAGE_RETENTION_DAYS = float(os.getenv("IMAGE_RETENTION_DAYS", "30"))
+
+# 表格快照：单张图片最多渲染的行数与同时渲染的线程数
+SNAPSHOT_MAX_ROWS = int(os.getenv("SNAPSHOT_MAX_ROWS", "500"))
+SNAPSHOT_WORKERS = int(os.getenv("SNAPSHOT_WORKERS", "2"))
+
+# 外部 HTTP 请求（fixer.io、webhook）：超时、重试次数与熔断
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "3"))
+UPSTREAM_RESET_SECONDS = float(os.getenv("UPSTREAM_RESET_SECONDS", "60"))
+
+# 到期提醒：提前天数（逗号分隔）与 webhook 地址（未设置时只写日志）
+EXPIRY_ALERT_DAYS = [int(day) for day in os.getenv("EXPIRY_ALERT_DAYS", "7,3,1,0").split(",") if day.strip()]
+EXPIRY_WEBHOOK_URL = os.getenv("EXPIRY_WEBHOOK_URL")
+
+# 多用户：每个用户（未登录访客按 IP）每秒请求数与突发上限（0 为不限），
+# 以及未单独设置 max_vps 的用户可保存的 VPS 数（0 为不限，管理员不受此限制）
+TENANT_RATE_LIMIT = float(os.getenv("TENANT_RATE_LIMIT", "20"))
+TENANT_BURST = float(os.getenv("TENANT_BURST", "40"))
+TENANT_MAX_VPS = int(os.getenv("TENANT_MAX_VPS", "0"))
+# 返回或汇总整个机队的请求按行数追加计费：每这么多行消耗一个令牌
+TENANT_ROWS_PER_TOKEN = int(os.getenv("TENANT_ROWS_PER_TOKEN", "1000"))
+# /api/convert/batch 单次请求最多换算的条数，超出返回 413
+CONVERT_MAX_BATCH = int(os.getenv("CONVERT_MAX_BATCH", "500"))
+# 反向代理的地址或网段（逗号分隔，如 172.18.0.0/16）：来自这些地址的请求按 X-Forwarded-For 识别访客 IP，
+# 否则代理后面的所有访客共用代理地址的限流桶；未设置时不信任 X-Forwarded-For（客户端可以伪造）
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy.strip(), strict=False)
+                   for proxy in os.getenv("TRUSTED_PROXIES", "").split(",") if proxy.strip()]
+
+# 实时更新（SSE）：每个订阅者最多积压的事件数、同时打开的事件流上限、心跳间隔，
+# 以及单个事件流的最长时间（秒，到期后由浏览器自动重连，进程退出时不会一直等待长连接）
+EVENTS_MAX_QUEUE = int(os.getenv("EVENTS_MAX_QUEUE", "64"))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "1000"))
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))
+EVENTS_MAX_AGE = float(os.getenv("EVENTS_MAX_AGE", "300"))
+
+# 机队价值历史：每日快照保留天数、周桶保留天数（更早的按月合并）与月桶保留天数
+HISTORY_DAILY_DAYS = int(os.getenv("HISTORY_DAILY_DAYS", "90"))
+HISTORY_WEEKLY_DAYS = int(os.getenv("HISTORY_WEEKLY_DAYS", "730"))
+HISTORY_MONTHLY_DAYS = int(os.getenv("HISTORY_MONTHLY_DAYS", "3650"))
+
 # 确保数据目录存在
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
-# 密码处理
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 会话签名密钥：优先使用 SECRET_KEY，否则保存在数据目录中，重启与多个 worker 之间保持一致
+SECRET_KEY = os.getenv("SECRET_KEY") or load_secret_key(os.path.join('data', 'secret.key'))
 
-# 设置模板目录
-templates = Jinja2Templates(directory="templates")
+# 多 worker（uvicorn --workers / WEB_CONCURRENCY）共享的缓存版本计数器，在 startup_event 中打开
+shared_state = SharedCounters()
 
-# HTML模板直接嵌入到代码中
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>VPS Value Tracker</title>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css" rel="stylesheet">
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap-icons@1.7.2/font/bootstrap-icons.css" rel="stylesheet">
-    <style>
-        .modal-backdrop {
-            background-color: rgba(0, 0, 0, 0.5);
-        }
-    </style>
-</head>
-<body>
-    <!-- 导航栏 -->
-    <nav class="navbar navbar-expand-lg navbar-light bg-light shadow-sm">
-        <div class="container">
-            <a class="navbar-brand" href="/">VPS Value Tracker</a>
-            <div class="d-flex align-items-center">
-                {% if user %}
-                    <div class="dropdown me-3">
-                        <button class="btn btn-outline-secondary dropdown-toggle" type="button" data-bs-toggle="dropdown">
-                            <i class="bi bi-person-circle"></i> {{ user.username }}
-                        </button>
-                        <ul class="dropdown-menu">
-                            <li><a class="dropdown-item" href="#" onclick="logout()">登出</a></li>
-                        </ul>
-                    </div>
-                    <button class="btn btn-primary" data-bs-toggle="modal" data-bs-target="#addVpsModal">
-                        <i class="bi bi-plus-lg"></i> 添加 VPS
-                    </button>
-                {% else %}
-                    <button class="btn btn-outline-primary" data-bs-toggle="modal" data-bs-target="#loginModal">
-                        登录
-                    </button>
-                {% endif %}
-            </div>
-        </div>
-    </nav>
-
-    <div class="container py-4">
-        <!-- 导出工具栏 -->
-        <div class="d-flex justify-content-end mb-3">
-            <div class="btn-group">
-                <button class="btn btn-outline-secondary" onclick="exportMarkdown()">
-                    <i class="bi bi-markdown"></i> 导出 Markdown
-                </button>
-                <button class="btn btn-outline-secondary" onclick="generateImage()">
-                    <i class="bi bi-image"></i> 生成图片
-                </button>
-            </div>
-        </div>
-
-        <!-- VPS 表格 -->
-        <div class="card shadow-sm">
-            <div class="table-responsive">
-                <table class="table table-hover mb-0">
-                    <thead class="table-light">
-                        <tr>
-                            <th>商家</th>
-                            <th>CPU</th>
-                            <th>内存</th>
-                            <th>硬盘</th>
-                            <th>流量</th>
-                            <th>价格</th>
-                            <th>剩余价值(CNY)</th>
-                            <th>开始时间</th>
-                            <th>到期时间</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                        {% for vps in vps_list %}
-                        <tr>
-                            <td>{{ vps['vendor_name'] }}</td>
-                            <td>{{ vps['cpu_cores'] }}核 {{ vps['cpu_model'] }}</td>
-                            <td>{{ vps['memory'] }}GB</td>
-                            <td>{{ vps['storage'] }}GB</td>
-                            <td>{{ vps['bandwidth'] }}GB</td>
-                            <td>{{ vps['price'] }} {{ vps['currency'] }}</td>
-                            <td class="remaining-value" 
-                                data-price="{{ vps['price'] }}"
-                                data-currency="{{ vps['currency'] }}"
-                                data-end-date="{{ vps['end_date'] }}">
-                                计算中...
-                            </td>
-                            <td>{{ vps['start_date'] }}</td>
-                            <td>{{ vps['end_date'] }}</td>
-                        </tr>
-                        {% endfor %}
-                    </tbody>
-                </table>
-            </div>
-        </div>
-
-        <!-- 登录模态框 -->
-        <div class="modal fade" id="loginModal" tabindex="-1" aria-labelledby="loginModalLabel" aria-hidden="true">
-            <div class="modal-dialog">
-                <div class="modal-content">
-                    <div class="modal-header">
-                        <h5 class="modal-title" id="loginModalLabel">登录</h5>
-                        <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
-                    </div>
-                    <div class="modal-body">
-                        <form id="loginForm" onsubmit="return handleLogin(event)">
-                            <div class="mb-3">
-                                <label class="form-label">密码</label>
-                                <input type="password" class="form-control" name="password" required>
-                            </div>
-                            <button type="submit" class="btn btn-primary">登录</button>
-                        </form>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <!-- 添加VPS模态框 -->
-        <div class="modal fade" id="addVpsModal" tabindex="-1" aria-labelledby="addVpsModalLabel" aria-hidden="true">
-            <div class="modal-dialog modal-lg">
-                <div class="modal-content">
-                    <div class="modal-header">
-                        <h5 class="modal-title" id="addVpsModalLabel">添加 VPS</h5>
-                        <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
-                    </div>
-                    <div class="modal-body">
-                        <form id="addVpsForm" onsubmit="return handleAddVps(event)">
-                            <div class="row mb-3">
-                                <div class="col-12">
-                                    <label class="form-label">商家名称</label>
-                                    <input type="text" class="form-control" name="vendor_name" required>
-                                </div>
-                            </div>
-                            
-                            <div class="row mb-3">
-                                <div class="col-md-6">
-                                    <label class="form-label">CPU核心数</label>
-                                    <input type="number" class="form-control" name="cpu_cores" min="1" required>
-                                </div>
-                                <div class="col-md-6">
-                                    <label class="form-label">CPU型号</label>
-                                    <input type="text" class="form-control" name="cpu_model" required>
-                                </div>
-                            </div>
-
-                            <div class="row mb-3">
-                                <div class="col-md-4">
-                                    <label class="form-label">内存(GB)</label>
-                                    <input type="number" class="form-control" name="memory" min="0.5" step="0.5" required>
-                                </div>
-                                <div class="col-md-4">
-                                    <label class="form-label">硬盘(GB)</label>
-                                    <input type="number" class="form-control" name="storage" min="1" required>
-                                </div>
-                                <div class="col-md-4">
-                                    <label class="form-label">流量(GB)</label>
-                                    <input type="number" class="form-control" name="bandwidth" min="1" required>
-                                </div>
-                            </div>
-
-                            <div class="row mb-3">
-                                <div class="col-md-6">
-                                    <label class="form-label">价格</label>
-                                    <input type="number" class="form-control" name="price" min="0.01" step="0.01" required>
-                                </div>
-                                <div class="col-md-6">
-                                    <label class="form-label">货币</label>
-                                    <select class="form-select" name="currency" required>
-                                        <option value="CNY">人民币 (CNY)</option>
-                                        <option value="USD">美元 (USD)</option>
-                                        <option value="EUR">欧元 (EUR)</option>
-                                        <option value="GBP">英镑 (GBP)</option>
-                                        <option value="JPY">日元 (JPY)</option>
-                                        <option value="CAD">加元 (CAD)</option>
-                                    </select>
-                                </div>
-                            </div>
-
-                            <div class="row mb-3">
-                                <div class="col-md-6">
-                                    <label class="form-label">开始时间</label>
-                                    <input type="date" class="form-control" name="start_date" required>
-                                </div>
-                                <div class="col-md-6">
-                                    <label class="form-label">到期时间</label>
-                                    <input type="date" class="form-control" name="end_date" required>
-                                </div>
-                            </div>
-
-                            <div class="text-end">
-                                <button type="button" class="btn btn-secondary" data-bs-dismiss="modal">取消</button>
-                                <button type="submit" class="btn btn-primary">添加</button>
-                            </div>
-                        </form>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <!-- 图片预览模态框 -->
-        <div class="modal fade" id="imagePreviewModal" tabindex="-1" aria-labelledby="imagePreviewModalLabel" aria-hidden="true">
-            <div class="modal-dialog modal-lg">
-                <div class="modal-content">
-                    <div class="modal-header">
-                        <h5 class="modal-title" id="imagePreviewModalLabel">图片预览</h5>
-                        <button type="button" class="btn-close" data-bs-dismiss="modal" aria-label="Close"></button>
-                    </div>
-                    <div class="modal-body text-center">
-                        <img id="previewImage" class="img-fluid" src="" alt="Preview">
-                        <div class="mt-3">
-                            <a id="imageDownloadLink" class="btn btn-primary" download="vps-table.png">
-                                下载图片
-                            </a>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-
-        <!-- 其他模态框保持不变 -->
-    </div>
-
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js"></script>
-    <script src="https://html2canvas.hertzen.com/dist/html2canvas.min.js"></script>
-    <script>
-        // 初始化所有模态框
-        document.addEventListener('DOMContentLoaded', function() {
-            const modals = document.querySelectorAll('.modal');
-            modals.forEach(modalEl => {
-                new bootstrap.Modal(modalEl);
-            });
-        });
-
-        // 登出功能
-        async function logout() {
-            const response = await fetch('/api/logout', {
-                method: 'POST'
-            });
-            if (response.ok) {
-                window.location.reload();
-            }
-        }
+def data_path(suffix: str) -> str:
+    """与数据库同目录的辅助文件（锁、共享计数器）"""
+    return f"{DB_PATH}.{suffix}"
 
-        // 导出 Markdown
-        function exportMarkdown() {
-            const table = document.querySelector('table');
-            let md = '| ';
-            
-            // 表头
-            const headers = table.querySelectorAll('thead th');
-            headers.forEach(header => {
-                md += header.textContent + ' | ';
-            });
-            md += '\\n|';
-            
-            // 分隔线
-            headers.forEach(() => {
-                md += ' --- |';
-            });
-            md += '\\n';
-            
-            // 数据行
-            const rows = table.querySelectorAll('tbody tr');
-            rows.forEach(row => {
-                md += '| ';
-                row.querySelectorAll('td').forEach(cell => {
-                    md += cell.textContent.trim() + ' | ';
-                });
-                md += '\\n';
-            });
-            
-            // 复制到剪贴板
-            navigator.clipboard.writeText(md).then(() => {
-                alert('Markdown 表格已复制到剪贴板');
-            });
-        }
-
-        // 生成图片
-        async function generateImage() {
-            const table = document.querySelector('.card');
-            const canvas = await html2canvas(table);
-            
-            // 转换为图片
-            const imageData = canvas.toDataURL('image/png');
-            
-            // 上传到服务器
-            const response = await fetch('/api/upload-image', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ image: imageData })
-            });
-            
-            if (response.ok) {
-                const { url } = await response.json();
-                
-                // 显示预览
-                document.getElementById('previewImage').src = url;
-                document.getElementById('imageDownloadLink').href = url;
-                new bootstrap.Modal(document.getElementById('imagePreviewModal')).show();
-            }
-        }
-
-        // 修改登录处理函数
-        async function handleLogin(event) {
-            event.preventDefault();
-            const form = event.target;
-            const formData = new FormData();
-            formData.append('username', 'admin');  // 固定用户名
-            formData.append('password', form.password.value);  // 获取密码
-            
-            try {
-                const response = await fetch('/api/login', {
-                    method: 'POST',
-                    body: formData
-                });
-                
-                if (response.ok) {
-                    window.location.reload();
-                } else {
-                    const error = await response.json();
-                    alert(error.detail || '登录失败');
-                }
-            } catch (error) {
-                console.error('Error:', error);
-                alert('登录失败: 网络错误');
-            }
-            return false;
-        }
+# 共享数据库连接池（在 startup_event 中创建）
+db_pool: Optional[ConnectionPool] = None
 
-        // 其他 JavaScript 代码保持不变
-    </script>
-</body>
-</html>
-'''
+# 到期提醒调度器（在 startup_event 中创建）
+expiry_scheduler: Optional[ExpiryScheduler] = None
+
+# 每日机队快照（在 startup_event 中创建）
+fleet_history: Optional[FleetHistory] = None
+
+# 未登录访客看到的公开列表（管理员的 VPS），在 startup_event 中加载
+public_tenant: Optional[dict] = None
+
+# 启动后在后台执行的初始化步骤（在 startup_event 中创建），以及关键路径的启动耗时
+deferred_init: Optional[DeferredInit] = None
+startup_seconds: Optional[float] = None
+shutting_down = False
+
+# 按用户 / 访客 IP 的请求限流
+rate_limiter = RateLimiter(TENANT_RATE_LIMIT, TENANT_BURST)
+
+# VPS 写入与汇率刷新的进程内事件总线，供 /api/events 推送给打开的页面
+event_bus = EventBus(EVENTS_MAX_QUEUE, EVENTS_MAX_SUBSCRIBERS)
+
+# 密码处理（bcrypt 在独立线程池中执行，passlib 在首次使用时导入）
+password_hasher = PasswordHasher(workers=int(os.getenv("PASSWORD_WORKERS", "2")))
+snapshot_renderer = SnapshotRenderer(workers=SNAPSHOT_WORKERS, max_rows=SNAPSHOT_MAX_ROWS)
+
+# 设置模板目录（模板只编译一次，不检查文件修改）
+templates = Jinja2Templates(directory="templates")
+templates.env.auto_reload = False
+templates.env.filters["remaining"] = format_remaining
+
+# 首页渲染缓存：表格片段按数据版本缓存，整页按数据版本 + 用户缓存（含压缩结果）
+fragment_cache = LRUCache(max_entries=16)
+page_cache = LRUCache(max_entries=64)
+
+# 会话：令牌有效期与已验证令牌缓存
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(7 * 86400)))
+session_cache = SessionCache(SECRET_KEY)
 
 # 配置部分
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
@@ -380,137 +173,354 @@ if not ADMIN_PASSWORD:
 # 修改数据库初始化函数
 async def init_db():
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE,
-                    password TEXT
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS vps (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    vendor_name TEXT,
-                    cpu_cores INTEGER,
-                    cpu_model TEXT,
-                    memory INTEGER,
-                    storage INTEGER,
-                    bandwidth INTEGER,
-                    price REAL,
-                    currency TEXT,
-                    start_date TEXT,
-                    end_date TEXT,
-                    user_id INTEGER
-                )
-            ''')
-            # 创建默认管理员账号
-            hashed_password = pwd_context.hash(ADMIN_PASSWORD)
-            try:
-                await db.execute('INSERT INTO users (username, password) VALUES (?, ?)',
-                               ['admin', hashed_password])
-                await db.commit()
+        # 多个 worker 同时启动时，迁移与管理员账号初始化依次执行
+        async with FileLock(data_path("lock")), aiosqlite.connect(DB_PATH) as db:
+            # 按版本执行数据库迁移（建表、索引等）
+            await run_migrations(db)
+            # 首次启动时创建管理员账号（公开列表依赖它）；密码哈希由后台的 sync_admin_password 写入，
+            # 在此之前保存的空哈希无法通过校验
+            cursor = await db.execute('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)',
+                                      ['admin', ''])
+            if cursor.rowcount:
                 logger.info("Created default admin user")
-            except:
-                # 更新已存在的管理员密码
-                await db.execute('UPDATE users SET password = ? WHERE username = ?',
-                               [hashed_password, 'admin'])
-                await db.commit()
-                logger.info("Updated admin password")
-                
+            await db.commit()
             logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Database initialization error: {e}", exc_info=True)
         raise
 
-@app.on_event("startup")
+async def sync_admin_password():
+    """
+    使管理员密码与 ADMIN_PASSWORD 一致；密码未变化时不重新哈希、不写库。
+    bcrypt 校验与哈希耗时数百毫秒，作为后台初始化步骤执行，登录接口先等待它完成。
+    多个 worker 可能同时更新，各自写入的哈希都对应同一密码。
+    """
+    async with db_pool.read() as db:
+        async with db.execute('SELECT password FROM users WHERE username = ?', ['admin']) as cursor:
+            admin = await cursor.fetchone()
+    stored = admin[0] if admin else None
+    if stored and await password_hasher.verify(ADMIN_PASSWORD, stored) \
+            and not password_hasher.needs_update(stored):
+        logger.info("Admin password unchanged")
+        return
+    hashed_password = await password_hasher.hash(ADMIN_PASSWORD)
+    async with db_pool.write() as db:
+        await db.execute('UPDATE users SET password = ? WHERE username = ?', [hashed_password, 'admin'])
+    logger.info("Updated admin password")
+
+async def precompile_templates():
+    # 模板只编译一次（auto_reload 关闭），在第一个页面请求之前预先编译
+    templates.get_template("base.html")
+    templates.get_template("vps_rows.html")
+
+async def load_expiry_alerts():
+    await expiry_scheduler.load()
+    expiry_scheduler.start()
+
+async def start_fleet_history():
+    fleet_history.start()
+
 async def startup_event():
-    logger.info(f"ADMIN_PASSWORD is set to: {ADMIN_PASSWORD}")
+    """
+    接受请求前只执行必需的步骤：迁移、连接池、汇率与公开列表；
+    其余初始化交给 deferred_init 在后台执行，完成情况见 /readyz。
+    """
+    started = time.perf_counter()
     if not ADMIN_PASSWORD:
         raise ValueError("ADMIN_PASSWORD environment variable must be set")
     await init_db()
+    shared_state.open(data_path("versions"))
+    global db_pool
+    db_pool = ConnectionPool(DB_PATH, readers=DB_READERS, observer=observe_query)
+    await db_pool.open()
+    rate_cache.attach(db_pool, FileLock(data_path("rates.lock")))
+    await rate_cache.load()
+    global public_tenant, expiry_scheduler, fleet_history, deferred_init, startup_seconds, shutting_down
+    public_tenant = await load_user("admin")
+    expiry_scheduler = ExpiryScheduler(
+        db_pool, WebhookNotifier(EXPIRY_WEBHOOK_URL, http_client) if EXPIRY_WEBHOOK_URL else LogNotifier(),
+        EXPIRY_ALERT_DAYS,
+        counters=shared_state, lock=FileLock(data_path("expiry.lock")))
+    fleet_history = FleetHistory(db_pool, valuation_cache, rate_cache, HISTORY_DAILY_DAYS, HISTORY_WEEKLY_DAYS,
+                                 HISTORY_MONTHLY_DAYS, lock=FileLock(data_path("history.lock")))
+    loop_monitor.start()
+    deferred_init = DeferredInit()
+    deferred_init.add("templates", precompile_templates)
+    deferred_init.add("admin_password", sync_admin_password)
+    deferred_init.add("expiry_alerts", load_expiry_alerts)
+    deferred_init.add("image_retention", image_store.enforce_retention)
+    deferred_init.add("fleet_history", start_fleet_history)
+    deferred_init.start()
+    shutting_down = False
+    startup_seconds = time.perf_counter() - started
+    logger.info(f"Startup finished in {startup_seconds:.3f}s; deferring {', '.join(deferred_init.pending())}")
+
+async def shutdown_event():
+    global shutting_down
+    shutting_down = True
+    event_bus.close()
+    if deferred_init:
+        await deferred_init.stop()
+    await loop_monitor.stop()
+    if expiry_scheduler:
+        await expiry_scheduler.stop()
+    if fleet_history:
+        await fleet_history.stop()
+    await rate_cache.close()
+    await http_client.close()
+    password_hasher.shutdown()
+    snapshot_renderer.shutdown()
+    if db_pool:
+        await db_pool.close()
+    shared_state.close()
+
+# 应用级 HTTP 客户端（连接池复用），在 shutdown_event 中关闭
+http_client = HttpClient(connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                         retries=HTTP_RETRIES)
+fixer_breaker = CircuitBreaker(UPSTREAM_FAILURE_THRESHOLD, UPSTREAM_RESET_SECONDS)
+
+# 汇率缓存（24小时更新一次，过期后后台刷新；fixer 熔断期间继续使用旧汇率）
+rate_cache = RateCache(FixerRateProvider(FIXER_API_KEY, FIXER_API_URL, http_client, fixer_breaker),
+                       counters=shared_state)
+
+def on_rates_refreshed(seconds: float, ok: bool):
+    rate_refresh_seconds.observe("success" if ok else "failure", value=seconds)
+    if ok:
+        # 所有用户的剩余价值随之变化
+        event_bus.publish(None, Event("rates"))
 
-# 汇率缓存
-exchange_rates_cache = {"timestamp": 0, "rates": {}}
+rate_cache.on_refresh = on_rates_refreshed
+
+# 剩余价值缓存（CNY）与性价比排名索引，VPS 写入时增量更新，汇率刷新或其他 worker 写入后各用户按需重新加载
+valuation_cache = ValuationCache("CNY", counters=shared_state, ranks=RankIndex("CNY"))
 
 # 辅助函数
 async def get_exchange_rates():
-    now = datetime.now().timestamp()
-    if now - exchange_rates_cache["timestamp"] > 86400:  # 24小时更新一次
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"http://data.fixer.io/api/latest?access_key={FIXER_API_KEY}&base=EUR") as response:
-                data = await response.json()
-                if data["success"]:
-                    exchange_rates_cache["rates"] = data["rates"]
-                    exchange_rates_cache["timestamp"] = now
-    return exchange_rates_cache["rates"]
+    return await rate_cache.get_rates()
 
-async def convert_to_cny(amount: float, currency: str) -> float:
-    if currency == "CNY":
+async def get_rate_table() -> RateTable:
+    return await rate_cache.get_table()
+
+async def convert_amount(amount: float, currency: str, target: str = "CNY") -> float:
+    if currency == target:
         return amount
-    rates = await get_exchange_rates()
-    if currency in rates and "CNY" in rates:
-        # 先转换为EUR，再转换为CNY
-        eur_amount = amount / rates[currency]
-        return eur_amount * rates["CNY"]
-    return amount
-
-async def calculate_remaining_value(price: float, currency: str, end_date: str) -> float:
-    end = datetime.strptime(end_date, "%Y-%m-%d")
-    days_remaining = (end - datetime.now()).days
-    if days_remaining < 0:
-        return 0
-    yearly_value = await convert_to_cny(price, currency)
-    return round(yearly_value * days_remaining / 365, 2)
+    table = await get_rate_table()
+    return table.convert(amount, currency, target)
+
+async def convert_to_cny(amount: float, currency: str) -> float:
+    return await convert_amount(amount, currency, "CNY")
+
+async def calculate_remaining_value(price: float, currency: str, end_date: str,
+                                    cycle: str = DEFAULT_BILLING_CYCLE) -> float:
+    table = await get_rate_table()
+    return remaining_value(price, currency, end_date, table, cycle=cycle)
+
+def target_currency(table: RateTable, currency: str) -> str:
+    """查询参数中的目标币种；汇率表中没有的币种返回 400，未知字符串不进入币种编码表与各级缓存"""
+    target = currency.upper()
+    if target not in table:
+        raise HTTPException(status_code=400, detail=f"Unsupported currency: {target}")
+    return target
+
+async def attach_remaining_values(vps_list: list, target: str = "CNY") -> list:
+    """一次性为所有VPS计算剩余价值，整个批次共用一份汇率快照"""
+    if not vps_list:
+        return vps_list
+    try:
+        table = await get_rate_table()
+    except RatesUnavailable as e:
+        # 汇率不可用时仍可换算同币种的行，其余行显示为未知
+        logger.warning(f"Remaining values without exchange rates: {e}")
+        table = RateTable({})
+    today = date.today().toordinal()
+    for vps in vps_list:
+        try:
+            vps["remaining_value"] = remaining_value(
+                vps["price"] or 0, vps["currency"], vps["end_date"], table, today, target,
+                vps.get("billing_cycle")
+            )
+        except (TypeError, ValueError):
+            # 日期缺失、格式错误或汇率缺失时不影响其他行
+            vps["remaining_value"] = None
+    return vps_list
+
+# 认证依赖
+async def load_user(username: Optional[str]) -> Optional[dict]:
+    if not username:
+        return None
+    async with db_pool.read() as db:
+        async with db.execute('SELECT id, username, max_vps FROM users WHERE username = ?',
+                              [username]) as cursor:
+            row = await cursor.fetchone()
+    return {"id": row[0], "username": row[1], "max_vps": row[2]} if row else None
+
+async def get_current_user(session: Optional[str] = Cookie(None)) -> Optional[dict]:
+    """可选登录：未登录或令牌无效时返回 None"""
+    if not session:
+        return None
+    return await session_cache.verify(session, load_user)
+
+async def require_user(user: Optional[dict] = Depends(get_current_user)) -> dict:
+    if user is None:
+        raise HTTPException(status_code=401)
+    return user
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    """
+    访客 IP：直连地址是受信任的代理时，从 X-Forwarded-For 末尾向前跳过受信任的代理，
+    取第一个其他地址（更靠前的条目由客户端提供，不可信）
+    """
+    host = request.client.host if request.client else ""
+    if not TRUSTED_PROXIES or not is_trusted_proxy(host):
+        return host
+    forwarded = [address.strip() for header in request.headers.getlist("x-forwarded-for")
+                 for address in header.split(",")]
+    for address in reversed(forwarded):
+        if not address:
+            continue
+        if not is_trusted_proxy(address):
+            return address
+        host = address
+    return host
+
+def check_rate_limit(request: Request, key: str):
+    request.state.rate_key = key
+    wait = rate_limiter.acquire(key)
+    if wait:
+        raise HTTPException(status_code=429, detail="Too many requests",
+                            headers={"Retry-After": str(math.ceil(wait))})
+
+async def require_tenant(request: Request, user: dict = Depends(require_user)) -> dict:
+    """读写 VPS 的接口：按用户限流，只能访问自己的数据"""
+    check_rate_limit(request, f"user:{user['id']}")
+    return user
+
+async def current_tenant(request: Request, user: Optional[dict] = Depends(get_current_user)) -> dict:
+    """只读接口：登录用户看到自己的 VPS，未登录访客看到公开列表（按 IP 限流）"""
+    if user is not None:
+        check_rate_limit(request, f"user:{user['id']}")
+        return user
+    check_rate_limit(request, f"ip:{client_ip(request)}")
+    return public_tenant
+
+def charge_rows(request: Request, rows: int):
+    """大结果的额外计费：大用户的整表请求更快耗尽令牌，不挤占其他用户"""
+    key = getattr(request.state, "rate_key", None)
+    if key is not None:
+        rate_limiter.charge(key, rows / TENANT_ROWS_PER_TOKEN)
+
+def vps_quota(user: dict) -> Optional[int]:
+    """用户可保存的 VPS 数，None 为不限"""
+    quota = user.get("max_vps")
+    if quota is None:
+        quota = 0 if user["username"] == "admin" else TENANT_MAX_VPS
+    return quota or None
+
+def publish_row(vps_id: int, user_id: int):
+    """写入提交且缓存更新后，通知该用户打开的页面替换这一行"""
+    row = valuation_cache.row(vps_id)
+    if row is None:
+        # 缓存未能增量更新（如其他 worker 同时写入），页面需要整体重新加载
+        event_bus.publish(user_id, Event("reload"))
+    else:
+        event_bus.publish(user_id, Event("row", row, valuation_cache.etag(user_id)))
 
 # API路由实现
-@app.post("/api/login")
+@router.post("/api/login")
 async def login(username: str = Form(...), password: str = Form(...)):
     try:
-        logger.info(f"Login attempt with password: {password}")
-        logger.info(f"Expected password: {ADMIN_PASSWORD}")
+        if username == "admin":
+            # 冷启动后管理员密码可能仍在后台同步
+            await deferred_init.wait("admin_password")
+        async with db_pool.read() as db:
+            async with db.execute('SELECT password FROM users WHERE username = ?', [username]) as cursor:
+                row = await cursor.fetchone()
         
-        # 直接比较密码
-        if password == ADMIN_PASSWORD:
-            token = jwt.encode({"sub": "admin"}, SECRET_KEY)
+        # 校验 bcrypt 哈希（在线程池中执行，不阻塞事件循环）
+        if row and await password_hasher.verify(password, row[0]):
+            token = session_cache.issue(username, SESSION_MAX_AGE)
             response = JSONResponse(content={"success": True})
-            response.set_cookie(key="session", value=token, httponly=True)
-            logger.info("Login successful")
+            response.set_cookie(key="session", value=token, httponly=True, max_age=SESSION_MAX_AGE)
+            logger.info(f"Login successful: {username}")
             return response
         else:
-            logger.warning("Invalid password")
+            logger.warning(f"Invalid password for {username}")
             raise HTTPException(status_code=401, detail="密码错误")
             
+    except HTTPException:
+        raise
+    except DeferredInitFailed as e:
+        logger.error(f"Login unavailable: {e}")
+        raise HTTPException(status_code=503, detail="服务初始化未完成，请稍后重试")
     except Exception as e:
         logger.error(f"Login error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="登录失败")
 
-@app.post("/api/vps")
-async def add_vps(vps_data: dict, session: str = Cookie(None)):
+@router.post("/api/users")
+async def create_user(user_data: dict, user: dict = Depends(require_tenant)):
+    """管理员创建用户：{username, password, max_vps?}，max_vps 为空时使用 TENANT_MAX_VPS"""
+    if user["username"] != "admin":
+        raise HTTPException(status_code=403)
+    username = str(user_data.get("username") or "").strip()
+    password = user_data.get("password")
+    if not username or not isinstance(password, str) or not password:
+        raise HTTPException(status_code=400, detail="username and password are required")
+    max_vps = user_data.get("max_vps")
+    if max_vps is not None and (not isinstance(max_vps, int) or isinstance(max_vps, bool) or max_vps < 0):
+        raise HTTPException(status_code=400, detail="max_vps must be a non-negative integer")
+    hashed_password = await password_hasher.hash(password)
     try:
-        if not session:
-            raise HTTPException(status_code=401)
-        
-        try:
-            payload = jwt.decode(session, SECRET_KEY)
-            username = payload["sub"]
-        except JWTError:
-            raise HTTPException(status_code=401)
-
-        async with aiosqlite.connect(DB_PATH) as db:
-            # 获取用户ID
-            async with db.execute('SELECT id FROM users WHERE username = ?', [username]) as cursor:
-                user = await cursor.fetchone()
-                if not user:
-                    raise HTTPException(status_code=401)
-                    
-            # 添加VPS信息，确保数值类型正确
+        async with db_pool.write() as db:
+            cursor = await db.execute('INSERT INTO users (username, password, max_vps) VALUES (?, ?, ?)',
+                                      [username, hashed_password, max_vps])
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail="User already exists")
+    logger.info(f"Created user {username}")
+    return {"success": True, "id": cursor.lastrowid}
+
+def parse_billing_cycle(vps_data: dict) -> str:
+    billing_cycle = vps_data.get("billing_cycle") or DEFAULT_BILLING_CYCLE
+    if billing_cycle not in BILLING_CYCLES:
+        raise HTTPException(status_code=400,
+                            detail=f"billing_cycle must be one of {', '.join(BILLING_CYCLES)}")
+    return billing_cycle
+
+async def currency_table() -> Optional[RateTable]:
+    """写入时校验币种用的汇率表；汇率暂不可用时为 None，只校验格式"""
+    try:
+        return await get_rate_table()
+    except RatesUnavailable:
+        return None
+
+async def parse_vps_currency(vps_data: dict) -> str:
+    """三位字母且有汇率的币种，否则返回 400；避免任意字符串进入币种编码表"""
+    try:
+        return parse_currency(vps_data.get("currency"), await currency_table())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/api/vps")
+async def add_vps(vps_data: dict, user: dict = Depends(require_tenant)):
+    billing_cycle = parse_billing_cycle(vps_data)
+    currency = await parse_vps_currency(vps_data)
+    quota = vps_quota(user)
+    try:
+        async with db_pool.write() as db:
+            # 添加VPS信息，确保数值类型正确；配额检查与插入在同一条语句中完成
             try:
-                await db.execute('''
+                cursor = await db.execute('''
                     INSERT INTO vps (
                         vendor_name, cpu_cores, cpu_model, memory, storage, bandwidth,
-                        price, currency, start_date, end_date, user_id
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        price, currency, start_date, end_date, billing_cycle, user_id
+                    ) SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                    WHERE ? IS NULL OR (SELECT COUNT(*) FROM vps WHERE user_id = ?) < ?
                 ''', [
                     vps_data.get("vendor_name"),
                     float(vps_data.get("cpu_cores", 0)),  # 转换为float
@@ -519,65 +529,330 @@ async def add_vps(vps_data: dict, session: str = Cookie(None)):
                     float(vps_data.get("storage", 0)),    # 转换为float
                     float(vps_data.get("bandwidth", 0)),  # 转换为float
                     float(vps_data.get("price", 0)),
-                    vps_data.get("currency", "CNY"),
+                    currency,
                     vps_data.get("start_date", datetime.now().strftime("%Y-%m-%d")),
                     vps_data.get("end_date"),
-                    user[0]
+                    billing_cycle,
+                    user["id"],
+                    quota, user["id"], quota
                 ])
-                await db.commit()
-                return {"success": True}
+                vps_id = cursor.lastrowid if cursor.rowcount else None
             except Exception as e:
                 logger.error(f"Database error while adding VPS: {e}")
                 raise HTTPException(status_code=500, detail=str(e))
+        if vps_id is None:
+            raise HTTPException(status_code=403, detail=f"VPS quota exceeded ({quota})")
+        await valuation_cache.refresh_row(db_pool, rate_cache, vps_id)
+        expiry_scheduler.upsert(vps_id, vps_data.get("vendor_name"), vps_data.get("end_date"), user["id"])
+        publish_row(vps_id, user["id"])
+        return {"success": True, "id": vps_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in add_vps: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/vps")
-async def get_vps():
-    async with aiosqlite.connect('vps.db') as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute('SELECT * FROM vps ORDER BY end_date DESC') as cursor:
-            vps_list = await cursor.fetchall()
-            
-        # 计算剩余价值
-        result = []
-        for vps in vps_list:
-            vps_dict = dict(vps)
-            vps_dict["remaining_value"] = await calculate_remaining_value(
-                vps["price"], vps["currency"], vps["end_date"]
-            )
-            result.append(vps_dict)
-            
+VPS_PAGE_SIZE = 100
+VPS_MAX_PAGE_SIZE = 1000
+
+@router.get("/api/vps")
+async def get_vps(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                  vendor: Optional[str] = None, currency: Optional[str] = None,
+                  expiring_before: Optional[str] = None, min_remaining_value: Optional[float] = None,
+                  fields: Optional[str] = None, format: str = "json",
+                  tenant: dict = Depends(current_tenant)):
+    if not request.query_params:
+        # 剩余价值来自缓存，该用户的数据与汇率未变化时返回 304
+        vps_list = await valuation_cache.rows(db_pool, rate_cache, tenant["id"])
+        etag = valuation_cache.etag(tenant["id"])
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        charge_rows(request, len(vps_list))
+        return JSONResponse(content=vps_list, headers={"ETag": etag})
+
+    # 分页 / 过滤 / 字段投影 / NDJSON 流式输出
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    try:
+        if expiring_before is not None:
+            expiring_before = date.fromisoformat(expiring_before).isoformat()
+        after = decode_cursor(cursor) if cursor else None
+        selected = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        table = await get_rate_table()
+    except RatesUnavailable:
+        table = RateTable({})
+    query = dict(user_id=tenant["id"], vendor=vendor, currency=currency, expiring_before=expiring_before,
+                 min_remaining_value=min_remaining_value, fields=selected, after=after)
+
+    if format == "ndjson":
+        async def stream():
+            rows = 0
+            async for _, item in iter_vps(db_pool, table, limit=limit, **query):
+                rows += 1
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            charge_rows(request, rows)
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    page_size = min(max(limit or VPS_PAGE_SIZE, 1), VPS_MAX_PAGE_SIZE)
+    items = []
+    next_cursor = None
+    # 多取一行用于判断是否还有下一页
+    async for key, item in iter_vps(db_pool, table, limit=page_size + 1, **query):
+        if len(items) == page_size:
+            next_cursor = encode_cursor(*last_key)
+            break
+        items.append(item)
+        last_key = key
+    return {"items": items, "next_cursor": next_cursor}
+
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json": "json",
+}
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+@router.post("/api/vps/bulk")
+async def bulk_import_vps(request: Request, format: Optional[str] = None,
+                          user: dict = Depends(require_tenant)):
+    """批量导入 CSV / JSON / NDJSON，分块事务写入并返回逐行错误；超出配额的行记为失败"""
+    if format is None:
+        content_type = request.headers.get("content-type", "").split(";")[0].strip()
+        format = IMPORT_CONTENT_TYPES.get(content_type)
+    if format not in IMPORT_PARSERS:
+        raise HTTPException(status_code=415, detail="Use CSV, JSON or NDJSON")
+
+    try:
+        result = await import_vps(db_pool, IMPORT_PARSERS[format](request.stream()), user["id"],
+                                  vps_quota(user), await currency_table())
+    except UnicodeDecodeError as e:
+        # 之前的批次已提交，由客户端修正编码后重新导入剩余部分
+        raise HTTPException(status_code=400, detail=f"Request body must be UTF-8: {e}")
+    except ImportTooLarge as e:
+        # 同上，之前的批次已提交
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        # 已提交的批次需要反映到缓存中
+        valuation_cache.invalidate(user["id"])
+        expiry_scheduler.invalidate()
+        await expiry_scheduler.sync()
+        event_bus.publish(user["id"], Event("reload"))
+    logger.info(f"Bulk import: {result['inserted']} inserted, {result['failed']} failed")
     return result
 
+@router.get("/api/vps/export")
+async def export_vps_inventory(format: str = "csv", tenant: dict = Depends(current_tenant)):
+    """流式导出当前用户的全部 VPS"""
+    if format not in EXPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be csv, json or ndjson")
+    return StreamingResponse(
+        export_vps(db_pool, format, tenant["id"]),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="vps.{format}"'}
+    )
+
+@router.get("/api/vps/expiring")
+async def get_expiring_vps(days: int = 30, tenant: dict = Depends(current_tenant)):
+    """今天起 days 天内到期的 VPS（按到期日升序），数据来自到期提醒调度器"""
+    if days < 0:
+        raise HTTPException(status_code=400, detail="days must not be negative")
+    await expiry_scheduler.sync()
+    return {"days": days, "items": expiry_scheduler.expiring(days, user_id=tenant["id"])}
+
+RANK_DEFAULT_TOP = 10
+RANK_MAX_TOP = 100
+
+@router.get("/api/vps/rank")
+async def rank_vps(metric: str = "core", top: int = RANK_DEFAULT_TOP, order: str = "asc", currency: str = "CNY",
+                   tenant: dict = Depends(current_tenant)):
+    """
+    按性价比排名：metric 为 monthly（月费）、core / memory / storage（每核、每 GB 内存、每 GB 硬盘的月费）
+    或 traffic（每 TB 流量的月费）。价格按付款周期折算为月费并换算为 currency；
+    order=asc 由便宜到贵。结果来自排名索引，不对整表排序；缺少该资源或汇率的行不参与排名。
+    """
+    if metric not in RANK_METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of {', '.join(RANK_METRICS)}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be asc or desc")
+    if not 1 <= top <= RANK_MAX_TOP:
+        raise HTTPException(status_code=400, detail=f"top must be between 1 and {RANK_MAX_TOP}")
+    factor = 1.0
+    target = currency.upper()
+    if target != valuation_cache.target:
+        try:
+            table = await get_rate_table()
+        except RatesUnavailable as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        # 排名不随币种变化，只需一个换算系数
+        factor = table.convert(1, valuation_cache.target, target_currency(table, currency))
+    ranked, total = await valuation_cache.rank(db_pool, rate_cache, tenant["id"], metric, top, order == "desc")
+    return {
+        "metric": metric,
+        "currency": target,
+        "order": order,
+        "total": total,
+        "items": [
+            {
+                "rank": position,
+                "id": row["id"],
+                "vendor_name": row["vendor_name"],
+                "cpu_cores": row["cpu_cores"],
+                "memory": row["memory"],
+                "storage": row["storage"],
+                "bandwidth": row["bandwidth"],
+                "value": round(value * factor, 4),
+                "metrics": {name: round(metric_value * factor, 4)
+                            for name, metric_value in valuation_cache.ranks.metrics(row["id"]).items()},
+            }
+            for position, (row, value) in enumerate(ranked, 1)
+        ],
+    }
+
 # 修改首页路由，添加用户信息
-@app.get("/", response_class=HTMLResponse)
-async def home(request: Request, session: Optional[str] = Cookie(None)):
+async def display_rows(display_currency: str, user_id: int) -> list:
+    """按显示币种返回带剩余价值的行；与缓存的目标币种相同时直接返回共享行"""
+    vps_list = await valuation_cache.rows(db_pool, rate_cache, user_id)
+    if display_currency != valuation_cache.target:
+        vps_list = await attach_remaining_values([dict(vps) for vps in vps_list], display_currency)
+    return vps_list
+
+async def view_currency(currency: str) -> str:
+    """
+    页面与事件流的显示币种，在生成任何缓存键之前校验：没有汇率的币种返回 400，
+    避免任意参数在 page_cache / fragment_cache 中挤掉其他用户的条目；汇率暂不可用时退回缓存的目标币种
+    """
+    display_currency = currency.upper()
+    if display_currency == valuation_cache.target:
+        return display_currency
     try:
-        user = None
-        if session:
-            try:
-                payload = jwt.decode(session, SECRET_KEY)
-                user = {"username": payload["sub"]}
-            except JWTError as e:
-                logger.warning(f"Invalid session token: {e}")
-                
-        async with aiosqlite.connect(DB_PATH) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute('SELECT * FROM vps ORDER BY end_date DESC') as cursor:
-                vps_list = [dict(row) for row in await cursor.fetchall()]
-                
-        return templates.TemplateResponse("base.html", {
-            "request": request,
-            "user": user,
-            "vps_list": vps_list
-        })
+        table = await get_rate_table()
+    except RatesUnavailable:
+        return valuation_cache.target
+    return target_currency(table, display_currency)
+
+@router.get("/", response_class=HTMLResponse)
+async def home(request: Request, currency: str = "CNY", user: Optional[dict] = Depends(get_current_user),
+               tenant: dict = Depends(current_tenant)):
+    display_currency = await view_currency(currency)
+    try:
+        # 服务端直接计算剩余价值，避免页面逐行请求 /api/convert
+        await valuation_cache.refresh(db_pool, rate_cache, tenant["id"])
+        # 该用户的数据、汇率或日期变化时版本随之变化（版本中含用户 id）
+        version = valuation_cache.etag(tenant["id"])
+        username = user["username"] if user else None
+
+        page = page_cache.get((version, display_currency, username))
+        if page is None:
+            fragment_key = (version, display_currency, user is not None)
+            rows_html = fragment_cache.get(fragment_key)
+            if rows_html is None:
+                vps_list = await display_rows(display_currency, tenant["id"])
+                charge_rows(request, len(vps_list))
+                rows_html = fragment_cache.put(fragment_key, Markup(templates.get_template("vps_rows.html").render(
+                    user=user, vps_list=vps_list, display_currency=display_currency
+                )))
+            body = templates.get_template("base.html").render(
+                request=request, user=user, rows_html=rows_html, display_currency=display_currency,
+                version=version
+            )
+            page = page_cache.put((version, display_currency, username), RenderedPage(body.encode()))
+
+        headers = {"ETag": page.etag, "Vary": "Accept-Encoding, Cookie", "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == page.etag:
+            return Response(status_code=304, headers=headers)
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=page.encode(encoding), media_type="text/html", headers=headers)
     except Exception as e:
         logger.error(f"Home page error: {e}", exc_info=True)
         raise
 
-@app.exception_handler(Exception)
+async def render_event(event: Event, display_currency: str, editable: bool, user_id: int) -> tuple:
+    """按订阅者的视图（币种、是否显示操作按钮）渲染事件，返回 (事件名, 数据)；同一视图只渲染一次"""
+    key = (user_id, display_currency, editable)
+    rendered = event.rendered.get(key)
+    if rendered is not None:
+        return rendered
+    if event.type == "row":
+        row = event.data
+        if display_currency != valuation_cache.target:
+            row = (await attach_remaining_values([dict(row)], display_currency))[0]
+        html = templates.get_template("vps_rows.html").render(
+            user=editable, vps_list=[row], display_currency=display_currency
+        )
+        rendered = ("row", {"id": row["id"], "end_date": row["end_date"], "html": html.strip()})
+    elif event.type == "rates":
+        rows = await display_rows(display_currency, user_id)
+        rendered = ("values", {
+            str(row["id"]): format_remaining(row["remaining_value"], display_currency) for row in rows
+        })
+    else:
+        rendered = (event.type, event.data)
+    event.rendered[key] = rendered
+    return rendered
+
+@router.get("/api/events")
+async def events(request: Request, currency: str = "CNY", since: Optional[str] = None,
+                 user: Optional[dict] = Depends(get_current_user), tenant: dict = Depends(current_tenant)):
+    """
+    Server-Sent Events：当前用户 VPS 的增删改与汇率刷新，页面据此逐行更新表格而不是整页刷新。
+    row 为新增或修改后的一行（按页面的显示币种渲染好的 <tr>），remove 为删除的行 id，
+    values 为汇率刷新后各行的剩余价值，reload 表示无法逐行更新（批量导入、其他 worker 写入、积压溢出）。
+    事件 id 为该用户的数据版本（同 /api/vps 的 ETag），连接时 Last-Event-ID（或 since）与当前版本不同则先发送 reload。
+    """
+    if len(event_bus) >= event_bus.max_subscribers:
+        raise HTTPException(status_code=503, detail="Too many event streams", headers={"Retry-After": "30"})
+    display_currency = await view_currency(currency)
+    editable = user is not None
+    user_id = tenant["id"]
+    version = request.headers.get("last-event-id") or since
+
+    async def stream():
+        nonlocal version
+        try:
+            subscription = event_bus.subscribe(user_id)
+        except SubscriberLimit:
+            return
+        deadline = time.monotonic() + EVENTS_MAX_AGE
+        with subscription:
+            # 断线后浏览器 3 秒后重连
+            yield "retry: 3000\n\n"
+            event = None
+            while True:
+                if event is None:
+                    # 连接时与每次心跳：发现本进程没有发布的变化（其他 worker 的写入、跨天）
+                    await valuation_cache.refresh(db_pool, rate_cache, user_id)
+                    current = valuation_cache.etag(user_id)
+                    if version is not None and current != version:
+                        event = Event("reload")
+                    version = current
+                if event is None:
+                    yield ": ping\n\n"
+                else:
+                    name, data = await render_event(event, display_currency, editable, user_id)
+                    if event.version is None:
+                        await valuation_cache.refresh(db_pool, rate_cache, user_id)
+                    version = event.version or valuation_cache.etag(user_id)
+                    yield format_sse(name, data, version)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event = await subscription.get(min(EVENTS_HEARTBEAT, remaining))
+                except EOFError:
+                    return
+
+    return EventStreamResponse(stream())
+
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Global error: {exc}", exc_info=True)
     return JSONResponse(
@@ -585,92 +860,341 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": "Internal server error"}
     ) 
 
-@app.get("/api/convert")
-async def convert_currency(amount: float, currency: str):
+@router.get("/api/convert")
+async def convert_currency(amount: float, currency: str, target: str = "CNY",
+                           tenant: dict = Depends(current_tenant)):
     try:
-        value = await convert_to_cny(amount, currency)
+        value = await convert_amount(amount, currency, target)
         return {"value": value}
+    except RatesUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Currency conversion error: {e}", exc_info=True)
         raise 
 
+@router.post("/api/convert/batch")
+async def convert_currency_batch(request: Request, items: list[dict], tenant: dict = Depends(current_tenant)):
+    """
+    批量换算：[{amount, currency, target?, end_date?}] -> [{value, remaining_value?}]
+    最多 CONVERT_MAX_BATCH 条；所有币种先统一校验（没有汇率的返回 400），按条数追加限流计费
+    """
+    if len(items) > CONVERT_MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {CONVERT_MAX_BATCH} items per batch")
+    charge_rows(request, len(items))
+    try:
+        table = await get_rate_table()
+    except RatesUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    pairs = []
+    for index, item in enumerate(items):
+        try:
+            pairs.append((target_currency(table, str(item.get("currency", "CNY"))),
+                          target_currency(table, str(item.get("target", "CNY")))))
+        except HTTPException as e:
+            raise HTTPException(status_code=400, detail=f"Item {index}: {e.detail}")
+    today = date.today().toordinal()
+    results = []
+    for item, (currency, target) in zip(items, pairs):
+        try:
+            amount = float(item.get("amount", 0))
+            result = {"value": table.convert(amount, currency, target)}
+            if item.get("end_date"):
+                result["remaining_value"] = remaining_value(
+                    amount, currency, item["end_date"], table, today, target,
+                    item.get("billing_cycle", DEFAULT_BILLING_CYCLE)
+                )
+        except (TypeError, ValueError) as e:
+            result = {"error": str(e)}
+        results.append(result)
+    return results
+
+# 历史汇率序列缓存（汇率刷新后失效）
+rate_history_cache = RateHistoryCache()
+
+# 各用户的汇总结果：(数据版本, 币种, 汇率模式) -> 汇总
+summary_cache = LRUCache(1024)
+# 进行中的汇总计算：同一 key 的并发未命中共享一次计算（single-flight），大用户写入后不会同时重算多次
+summary_tasks: dict = {}
+
+async def compute_summary(key: tuple, user_id: int, table: RateTable, target: str,
+                          rate_mode: str) -> tuple:
+    """返回 (汇总, 行数)，结果写入 summary_cache"""
+    portfolio = await valuation_cache.portfolio(db_pool, rate_cache, user_id)
+    history = None
+    if rate_mode != "current":
+        history = await rate_history_cache.get(
+            db_pool, rate_cache.version, history_currencies(set(portfolio.currencies), target)
+        )
+
+    def compute() -> dict:
+        summary = summarize(portfolio, value_portfolio(portfolio, table, target, history=history,
+                                                       rate_mode=rate_mode))
+        summary["rate_mode"] = rate_mode
+        return summary
+
+    # 大机队的估值为 CPU 密集操作，放到线程中执行
+    summary = await asyncio.to_thread(compute)
+    return summary_cache.put(key, summary), len(portfolio)
+
+@router.get("/api/portfolio/summary")
+async def portfolio_summary(request: Request, currency: str = "CNY", rate_mode: str = "current",
+                            tenant: dict = Depends(current_tenant)):
+    """
+    当前用户机队的剩余价值、日/月成本合计，按商家和币种汇总。
+    rate_mode: current 当前汇率 / purchase 购买日汇率 / average 持有期间按天加权的平均汇率
+    """
+    if rate_mode not in RATE_MODES:
+        raise HTTPException(status_code=400, detail=f"rate_mode must be one of {', '.join(RATE_MODES)}")
+    try:
+        table = await get_rate_table()
+    except RatesUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    target = target_currency(table, currency)
+    # 版本随该用户的数据、汇率与日期变化
+    await valuation_cache.refresh(db_pool, rate_cache, tenant["id"])
+    key = (valuation_cache.etag(tenant["id"]), target, rate_mode)
+    summary = summary_cache.get(key)
+    if summary is not None:
+        return summary
+    task = summary_tasks.get(key)
+    if task is not None:
+        summary, _ = await asyncio.shield(task)
+        return summary
+    task = summary_tasks[key] = asyncio.create_task(
+        compute_summary(key, tenant["id"], table, target, rate_mode))
+    task.add_done_callback(lambda t: summary_tasks.pop(key, None))
+    # 只向发起计算的请求按行数计费
+    summary, rows = await asyncio.shield(task)
+    charge_rows(request, rows)
+    return summary
+
+@router.get("/api/history")
+async def fleet_value_history(dimension: str = "total", resolution: str = "auto", start: Optional[str] = None,
+                              end: Optional[str] = None, tenant: dict = Depends(current_tenant)):
+    """
+    当前用户机队的剩余价值、月支出与 VPS 数的历史（CNY，各桶内每日快照的平均值），
+    dimension 为 total / vendor / currency；resolution 为 auto（按保存的粒度）/ day / week / month。
+    数据来自每日快照及其降采样桶，不重新计算 VPS 行。
+    """
+    if dimension not in HISTORY_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"dimension must be one of {', '.join(HISTORY_DIMENSIONS)}")
+    if resolution != "auto" and resolution not in HISTORY_RESOLUTIONS:
+        raise HTTPException(status_code=400,
+                            detail=f"resolution must be auto or one of {', '.join(HISTORY_RESOLUTIONS)}")
+    days = []
+    for value in (start, end):
+        day = date_to_day(value) if value else None
+        if value and day < 0:
+            raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+        days.append(None if day is None else day - EPOCH_ORDINAL)
+    return await fleet_history.query(tenant["id"], dimension, None if resolution == "auto" else resolution,
+                                     days[0], days[1])
+
+@router.get("/api/rates/history")
+async def rate_history(currency: str, base: str = "CNY", start: Optional[str] = None, end: Optional[str] = None):
+    """某币种相对 base 的每日汇率（1 单位 currency 可换得的 base），日期范围默认为全部历史"""
+    currency, base = currency.upper(), base.upper()
+    days = []
+    for value in (start, end):
+        day = date_to_day(value) if value else None
+        if value and day < 0:
+            raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+        days.append(None if day is None else day - EPOCH_ORDINAL)
+    # 不限制起始日：区间开头若无记录，需沿用之前最近一次的汇率
+    history = await load_history(db_pool, {currency, base}, None, days[1])
+    missing = [code for code in {currency, base} if code not in history.series]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"No rate history for {', '.join(sorted(missing))}")
+    first = history.first_day if days[0] is None else max(days[0], history.first_day)
+    return {
+        "currency": currency,
+        "base": base,
+        "rates": [
+            {"date": date.fromordinal(day + EPOCH_ORDINAL).isoformat(),
+             "rate": round(history.factor_on(currency, base, day), 6)}
+            for day in range(first, history.last_day + 1)
+        ],
+    }
+
 # 创建图片保存目录
 IMAGES_DIR = Path('static/images')
 IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+image_store = ImageStore(IMAGES_DIR, IMAGE_MAX_BYTES, IMAGE_STORE_MAX_BYTES, IMAGE_RETENTION_DAYS)
 
-# 添加静态文件服务
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-@app.post("/api/logout")
-async def logout():
+@router.post("/api/logout")
+async def logout(session: Optional[str] = Cookie(None)):
+    session_cache.discard(session)
     response = JSONResponse(content={"success": True})
     response.delete_cookie(key="session")
     return response
 
-@app.post("/api/upload-image")
-async def upload_image(data: dict):
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+async def iter_upload_file(upload):
+    """按块读取 multipart 上传的文件（python-multipart 已将大文件暂存到磁盘）"""
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+async def iter_bytes(data: bytes):
+    for start in range(0, len(data), UPLOAD_CHUNK_SIZE):
+        yield data[start:start + UPLOAD_CHUNK_SIZE]
+
+async def limited_stream(request: Request, limit: int):
+    """按块读取请求体，累计超过 limit 字节即抛出 UploadTooLarge；分块传输（没有 Content-Length）同样受限"""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise UploadTooLarge(f"Request body exceeds {limit} bytes")
+        yield chunk
+
+@router.post("/api/upload-image")
+async def upload_image(request: Request):
+    """
+    上传图片：请求体直接为图片（image/png 等，流式写盘）、multipart 的 image 字段，
+    或旧版客户端的 JSON base64 data URL。文件按内容哈希命名，相同图片只保存一份。
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    content_length = request.headers.get("content-length")
+    # 按 base64 膨胀与 multipart 开销留出余量，超出时不读取请求体；
+    # 没有 Content-Length 的分块请求由 limited_stream 边读边计数，任何格式都不会超过这个上限
+    body_limit = image_store.max_bytes * 4 // 3 + 4096
+    if content_length and content_length.isdigit() and int(content_length) > body_limit:
+        raise HTTPException(status_code=413, detail="Image too large")
+    form = None
     try:
-        # 解码base64图片数据
-        image_data = data['image'].split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        
-        # 生成文件名
-        filename = f"vps-table-{datetime.now().strftime('%Y%m%d-%H%M%S')}.png"
-        file_path = IMAGES_DIR / filename
-        
-        # 保存图片
-        with open(file_path, 'wb') as f:
-            f.write(image_bytes)
-            
-        # 返回图片URL（使用完整域名）
-        image_url = f"/static/images/{filename}"
-        full_url = f"{BASE_URL}{image_url}"
-            
-        return {
-            "success": True,
-            "url": image_url,
-            "full_url": full_url
-        }
+        body = limited_stream(request, body_limit)
+        if content_type == "multipart/form-data":
+            form = await MultiPartParser(request.headers, body).parse()
+            upload = form.get("image")
+            if not hasattr(upload, "read"):
+                raise HTTPException(status_code=400, detail="Missing image field")
+            chunks = iter_upload_file(upload)
+        elif content_type == "application/json":
+            data = json.loads(b"".join([chunk async for chunk in body]))
+            image_bytes = base64.b64decode(str(data.get("image", "")).split(",")[-1], validate=True)
+            chunks = iter_bytes(image_bytes)
+        else:
+            chunks = body
+        filename, created = await image_store.save(chunks)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnsupportedImage as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    except HTTPException:
+        raise
+    except (ValueError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image data: {e}")
     except Exception as e:
         logger.error(f"Error saving image: {e}")
-        raise HTTPException(status_code=500, detail="Failed to save image") 
+        raise HTTPException(status_code=500, detail="Failed to save image")
+    finally:
+        if form is not None:
+            await form.close()
 
-@app.get("/api/vps/{vps_id}")
-async def get_vps_by_id(vps_id: int, session: str = Cookie(None)):
-    if not session:
-        raise HTTPException(status_code=401)
-    
+    # 返回图片URL（使用完整域名）
+    image_url = f"/static/images/{filename}"
+    return {
+        "success": True,
+        "url": image_url,
+        "full_url": f"{BASE_URL}{image_url}",
+        "deduplicated": not created
+    }
+
+# 表格快照：(用户数据版本, 币种, 格式) -> 渲染结果 / 已保存的文件名
+snapshot_cache = LRUCache(16)
+snapshot_files = LRUCache(64)
+
+async def render_snapshot(request: Request, display_currency: str, format: str, user_id: int):
+    """在服务端将表格渲染为图片；数据与汇率未变化时直接返回缓存"""
+    await valuation_cache.refresh(db_pool, rate_cache, user_id)
+    key = (valuation_cache.etag(user_id), display_currency, format)
+    snapshot = snapshot_cache.get(key)
+    if snapshot is None:
+        vps_list = await display_rows(display_currency, user_id)
+        # 渲染为 CPU 密集操作，在有界线程池中执行；超过 SNAPSHOT_MAX_ROWS 的行只注明数量
+        body = await snapshot_renderer.render(format, vps_list, display_currency)
+        charge_rows(request, min(len(vps_list), SNAPSHOT_MAX_ROWS))
+        snapshot = snapshot_cache.put(key, RenderedPage(body))
+    return key, snapshot
+
+def snapshot_format(format: Optional[str]) -> str:
+    format = (format or DEFAULT_FORMAT).lower()
+    if format not in available_formats():
+        raise HTTPException(status_code=400, detail=f"Unsupported snapshot format: {format}")
+    return format
+
+async def snapshot_currency(currency: str) -> str:
+    """快照的显示币种；没有汇率的币种返回 400，避免任意参数绕过快照缓存"""
+    display_currency = currency.upper()
+    if display_currency == valuation_cache.target:
+        return display_currency
     try:
-        payload = jwt.decode(session, SECRET_KEY)
-    except JWTError:
-        raise HTTPException(status_code=401)
+        table = await get_rate_table()
+    except RatesUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return target_currency(table, display_currency)
+
+@router.get("/api/snapshot")
+async def get_snapshot(request: Request, format: Optional[str] = None, currency: str = "CNY",
+                       tenant: dict = Depends(current_tenant)):
+    format = snapshot_format(format)
+    _, snapshot = await render_snapshot(request, await snapshot_currency(currency), format, tenant["id"])
+    headers = {"ETag": snapshot.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    # PNG 本身已压缩，只对 SVG 协商压缩
+    encoding = negotiate_encoding(request.headers.get("accept-encoding", "")) if format == "svg" else None
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=snapshot.encode(encoding), media_type=MEDIA_TYPES[format], headers=headers)
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute('SELECT * FROM vps WHERE id = ?', [vps_id]) as cursor:
+@router.post("/api/snapshot")
+async def share_snapshot(request: Request, format: Optional[str] = None, currency: str = "CNY",
+                         tenant: dict = Depends(current_tenant)):
+    """渲染表格快照并保存到图片目录，返回可分享的链接"""
+    format = snapshot_format(format)
+    key, snapshot = await render_snapshot(request, await snapshot_currency(currency), format, tenant["id"])
+    filename = snapshot_files.get(key)
+    if filename is None or not (IMAGES_DIR / filename).exists():
+        try:
+            filename, _ = await image_store.save(iter_bytes(snapshot.body), extension=format)
+        except (UploadTooLarge, UnsupportedImage) as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        snapshot_files.put(key, filename)
+    image_url = f"/static/images/{filename}"
+    return {
+        "success": True,
+        "url": image_url,
+        "full_url": f"{BASE_URL}{image_url}"
+    }
+
+@router.get("/api/vps/{vps_id}")
+async def get_vps_by_id(vps_id: int, user: dict = Depends(require_tenant)):
+    async with db_pool.read() as db:
+        async with db.execute('SELECT * FROM vps WHERE id = ? AND user_id = ?', [vps_id, user["id"]]) as cursor:
             vps = await cursor.fetchone()
             if vps:
                 return dict(vps)
             raise HTTPException(status_code=404, detail="VPS not found")
 
-@app.put("/api/vps/{vps_id}")
-async def update_vps(vps_id: int, vps_data: dict, session: str = Cookie(None)):
-    if not session:
-        raise HTTPException(status_code=401)
-    
+@router.put("/api/vps/{vps_id}")
+async def update_vps(vps_id: int, vps_data: dict, user: dict = Depends(require_tenant)):
+    billing_cycle = parse_billing_cycle(vps_data)
+    currency = await parse_vps_currency(vps_data)
     try:
-        payload = jwt.decode(session, SECRET_KEY)
-    except JWTError:
-        raise HTTPException(status_code=401)
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute('''
+        async with db_pool.write() as db:
+            cursor = await db.execute('''
                 UPDATE vps SET 
                     vendor_name = ?, cpu_cores = ?, cpu_model = ?, 
                     memory = ?, storage = ?, bandwidth = ?,
-                    price = ?, currency = ?, start_date = ?, end_date = ?
-                WHERE id = ?
+                    price = ?, currency = ?, start_date = ?, end_date = ?, billing_cycle = ?
+                WHERE id = ? AND user_id = ?
             ''', [
                 vps_data.get("vendor_name"),
                 float(vps_data.get("cpu_cores", 0)),  # 改为 float
@@ -679,36 +1203,221 @@ async def update_vps(vps_id: int, vps_data: dict, session: str = Cookie(None)):
                 float(vps_data.get("storage", 0)),    # 改为 float
                 float(vps_data.get("bandwidth", 0)),  # 改为 float
                 float(vps_data.get("price", 0)),
-                vps_data.get("currency", "CNY"),
+                currency,
                 vps_data.get("start_date"),
                 vps_data.get("end_date"),
-                vps_id
+                billing_cycle,
+                vps_id,
+                user["id"]
             ])
-            await db.commit()
-            return {"success": True}
-        except Exception as e:
-            logger.error(f"Database error while updating VPS: {e}")
-            raise HTTPException(status_code=500, detail=str(e))  # 返回具体错误信息
+    except Exception as e:
+        logger.error(f"Database error while updating VPS: {e}")
+        raise HTTPException(status_code=500, detail=str(e))  # 返回具体错误信息
+    if not cursor.rowcount:
+        raise HTTPException(status_code=404, detail="VPS not found")
+    await valuation_cache.refresh_row(db_pool, rate_cache, vps_id)
+    expiry_scheduler.upsert(vps_id, vps_data.get("vendor_name"), vps_data.get("end_date"), user["id"])
+    publish_row(vps_id, user["id"])
+    return {"success": True}
 
-@app.delete("/api/vps/{vps_id}")
-async def delete_vps(vps_id: int, session: str = Cookie(None)):
-    if not session:
-        raise HTTPException(status_code=401)
-    
+@router.delete("/api/vps/{vps_id}")
+async def delete_vps(vps_id: int, user: dict = Depends(require_tenant)):
     try:
-        payload = jwt.decode(session, SECRET_KEY)
-    except JWTError:
+        async with db_pool.write() as db:
+            cursor = await db.execute('DELETE FROM vps WHERE id = ? AND user_id = ?', [vps_id, user["id"]])
+    except Exception as e:
+        logger.error(f"Database error while deleting VPS: {e}")
+        raise HTTPException(status_code=500, detail="Failed to delete VPS")
+    if not cursor.rowcount:
+        raise HTTPException(status_code=404, detail="VPS not found")
+    await valuation_cache.remove_row(vps_id)
+    expiry_scheduler.remove(vps_id)
+    event_bus.publish(user["id"], Event("remove", {"id": vps_id}, valuation_cache.etag(user["id"])))
+    return {"success": True}
+
+@metrics_registry.collector
+def collect_cache_metrics():
+    yield ("exchange_rate_cache_requests_total", "counter", "Exchange rate lookups by cache result", [
+        ({"result": "hit"}, rate_cache.hits),
+        ({"result": "stale"}, rate_cache.stale_hits),
+        ({"result": "miss"}, rate_cache.misses),
+    ])
+    yield ("exchange_rate_refreshes_total", "counter", "Exchange rate refreshes by result", [
+        ({"result": "success"}, rate_cache.refreshes - rate_cache.refresh_failures),
+        ({"result": "failure"}, rate_cache.refresh_failures),
+    ])
+    yield ("exchange_rate_age_seconds", "gauge", "Age of the cached exchange rates (-1 when empty)", [
+        ({}, round(time.time() - rate_cache.timestamp, 3) if rate_cache.rates else -1),
+    ])
+    caches = {
+        "session": session_cache,
+        "valuation": valuation_cache,
+        "page": page_cache,
+        "fragment": fragment_cache,
+        "snapshot": snapshot_cache,
+        "summary": summary_cache,
+    }
+    yield ("cache_requests_total", "counter", "In-process cache lookups by result", [
+        ({"cache": name, "result": result}, count)
+        for name, cache in caches.items()
+        for result, count in (("hit", cache.hits), ("miss", cache.misses))
+    ])
+
+@metrics_registry.collector
+def collect_pool_metrics():
+    if db_pool is None:
+        return
+    stats = db_pool.stats()
+    yield ("sqlite_pool_utilization", "gauge", "Fraction of pooled connections in use", [
+        ({}, stats["utilization"]),
+    ])
+    yield ("sqlite_pool_acquisitions_total", "counter", "Pooled connection acquisitions", [
+        ({"mode": "read"}, stats["reads"]),
+        ({"mode": "write"}, stats["writes"]),
+    ])
+    yield ("sqlite_pool_wait_seconds_total", "counter", "Time spent waiting for a pooled connection", [
+        ({"mode": "read"}, stats["read_wait_seconds"]),
+        ({"mode": "write"}, stats["write_wait_seconds"]),
+    ])
+
+@metrics_registry.collector
+def collect_tenant_metrics():
+    yield ("rate_limit_requests_total", "counter", "Requests checked by the per-tenant rate limiter", [
+        ({"result": "allowed"}, rate_limiter.allowed),
+        ({"result": "limited"}, rate_limiter.limited),
+    ])
+
+BREAKER_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+@metrics_registry.collector
+def collect_event_metrics():
+    yield ("sse_subscribers", "gauge", "Open /api/events streams in this process", [
+        ({}, len(event_bus)),
+    ])
+    yield ("sse_events_total", "counter", "Events handed to subscriber queues by result", [
+        ({"result": "delivered"}, event_bus.delivered),
+        ({"result": "dropped"}, event_bus.dropped),
+    ])
+
+@metrics_registry.collector
+def collect_upstream_metrics():
+    yield ("http_client_requests_total", "counter", "Outgoing HTTP attempts including retries", [
+        ({}, http_client.requests),
+    ])
+    yield ("http_client_retries_total", "counter", "Outgoing HTTP retries", [
+        ({}, http_client.retried),
+    ])
+    yield ("http_client_failures_total", "counter", "Outgoing HTTP calls that failed after retries", [
+        ({}, http_client.failures),
+    ])
+    yield ("circuit_breaker_state", "gauge", "Circuit state (0 closed, 1 half-open, 2 open)", [
+        ({"upstream": "fixer"}, BREAKER_STATES[fixer_breaker.state]),
+    ])
+    yield ("circuit_breaker_rejections_total", "counter", "Calls rejected while the circuit was open", [
+        ({"upstream": "fixer"}, fixer_breaker.rejections),
+    ])
+
+@metrics_registry.collector
+def collect_expiry_metrics():
+    if expiry_scheduler is None:
+        return
+    yield ("expiry_alerts_total", "counter", "Expiry alerts by delivery result", [
+        ({"result": "sent"}, expiry_scheduler.sent),
+        ({"result": "failed"}, expiry_scheduler.failed),
+    ])
+    yield ("expiry_alert_record_failures_total", "counter", "Sent expiry alerts that failed to be recorded", [
+        ({}, expiry_scheduler.record_failures),
+    ])
+    next_deadline = expiry_scheduler.next_deadline()
+    if next_deadline is not None:
+        yield ("expiry_next_alert_timestamp_seconds", "gauge", "Time of the next scheduled expiry alert", [
+            ({}, next_deadline),
+        ])
+
+@router.get("/metrics")
+async def metrics(request: Request):
+    """Prometheus 文本格式指标；设置 METRICS_TOKEN 时需携带 Bearer 令牌"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
         raise HTTPException(status_code=401)
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        try:
-            await db.execute('DELETE FROM vps WHERE id = ?', [vps_id])
-            await db.commit()
-            return {"success": True}
-        except Exception as e:
-            logger.error(f"Database error while deleting VPS: {e}")
-            raise HTTPException(status_code=500, detail="Failed to delete VPS") 
+@metrics_registry.collector
+def collect_startup_metrics():
+    if startup_seconds is None:
+        return
+    yield ("startup_duration_seconds", "gauge", "Time spent in startup before accepting requests", [
+        ({}, round(startup_seconds, 4)),
+    ])
+    if deferred_init is not None and deferred_init.seconds:
+        yield ("deferred_init_duration_seconds", "gauge", "Background initialisation steps after startup", [
+            ({"step": name}, round(seconds, 4)) for name, seconds in deferred_init.seconds.items()
+        ])
 
-# 添加环境变量
-DOMAIN = os.getenv("DOMAIN", "localhost")
-BASE_URL = os.getenv("BASE_URL", f"http://{DOMAIN}") 
\ No newline at end of file
+@metrics_registry.collector
+def collect_history_metrics():
+    if fleet_history is None:
+        return
+    yield ("fleet_history_snapshots_total", "counter", "Daily fleet value snapshots recorded", [
+        ({}, fleet_history.snapshots),
+    ])
+    yield ("fleet_history_failures_total", "counter", "Fleet history runs that failed or were postponed", [
+        ({}, fleet_history.failures),
+    ])
+    if fleet_history.last_snapshot is not None:
+        yield ("fleet_history_last_snapshot_timestamp_seconds", "gauge", "Time of the last recorded snapshot", [
+            ({}, round(fleet_history.last_snapshot, 3)),
+        ])
+
+@router.get("/healthz")
+async def healthz():
+    """存活检查：进程能处理请求即返回 200"""
+    return {"status": "ok"}
+
+@router.get("/readyz")
+async def readyz():
+    """
+    就绪检查：启动的关键步骤已完成且数据库可用时返回 200，可以接收流量；
+    deferred 为后台初始化各步骤的状态（pending 非空时部分功能首次使用会等待，如管理员登录）。
+    有后台步骤失败时返回 503 并在 failed 中列出（失败步骤会在后台重试，成功后恢复 200）。
+    """
+    if db_pool is None or deferred_init is None or shutting_down:
+        return JSONResponse(status_code=503, content={"status": "stopping" if shutting_down else "starting"})
+    try:
+        async with db_pool.read() as db:
+            async with db.execute('SELECT 1') as cursor:
+                await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Readiness check failed: {e}")
+        return JSONResponse(status_code=503, content={"status": "unavailable"})
+    failed = deferred_init.failed()
+    if failed:
+        return JSONResponse(status_code=503, content={
+            "status": "degraded",
+            "failed": failed,
+            "pending": deferred_init.pending(),
+            "deferred": deferred_init.report(),
+        })
+    return {
+        "status": "ready",
+        "startup_seconds": round(startup_seconds, 4),
+        "pending": deferred_init.pending(),
+        "deferred": deferred_init.report(),
+    }
+
+def create_app() -> FastAPI:
+    """
+    应用工厂：组装中间件、路由、静态文件与启动/关闭钩子。
+    状态（连接池、缓存）仍在模块级，同一进程只应有一个应用在运行；
+    可用 uvicorn --factory main:create_app 启动，main:app 为模块导入时创建的默认实例。
+    """
+    application = FastAPI()
+    application.add_middleware(MetricsMiddleware, registry=metrics_registry)
+    application.add_exception_handler(Exception, global_exception_handler)
+    application.add_event_handler("startup", startup_event)
+    application.add_event_handler("shutdown", shutdown_event)
+    application.include_router(router)
+    # 添加静态文件服务
+    application.mount("/static", StaticFiles(directory="static"), name="static")
+    return application
+
+app = create_app()
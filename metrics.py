@@ -0,0 +1,251 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import re
+import time
+from functools import lru_cache
+from typing import Callable, Iterable, Optional
+
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# Starlette 会为 text/* 自动追加 charset=utf-8
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# 单位：秒
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_WHITESPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._series: dict = {}
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, value in self._series.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        self._series[labels] = value
+
+
+class Histogram(Metric):
+    """累积直方图；每个标签组合保存各桶计数、总和与次数"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = self.header()
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(round(total, 9))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    指标注册表。除主动记录的指标外，collector 在抓取时读取各缓存/连接池已有的计数器，
+    返回 (名称, 类型, 说明, [(标签字典, 值)]) 列表。
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, func: Callable[[], Iterable[tuple]]):
+        self._collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            try:
+                samples = list(collect())
+            except Exception as e:
+                logger.warning(f"Metrics collector {collect.__name__} failed: {e}")
+                continue
+            for name, kind, help, values in samples:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    names = tuple(labels)
+                    lines.append(f"{name}{_labels(names, tuple(labels[n] for n in names))} {_number(value)}")
+        lines.append("")
+        return "\n".join(lines)
+
+
+@lru_cache(maxsize=1024)
+def statement_label(sql: str, max_length: int = 120) -> str:
+    """
+    SQL 语句规范化后作为标签：折叠空白，IN (?, ?, ...) 占位符列表不论长度记为同一条语句。
+    过长的语句截断后附上规范化语句的哈希前缀，前缀相同的不同语句不会合并到同一个标签
+    """
+    label = _IN_LIST.sub("IN (?, ...)", _WHITESPACE.sub(" ", sql).strip())
+    if len(label) <= max_length:
+        return label
+    digest = hashlib.sha1(label.encode()).hexdigest()[:8]
+    return f"{label[:max_length - 13]}... #{digest}"
+
+
+class MetricsMiddleware:
+    """
+    ASGI 中间件：按路由模板记录请求延迟、请求数与进行中的请求数。
+    路由模板在进入应用前按路由表匹配得到，未匹配的路径统一记为 "unmatched"，避免标签基数失控。
+    """
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+        self.requests = registry.counter(
+            "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+        self.in_flight = registry.gauge(
+            "http_requests_in_flight", "HTTP requests currently being served", ("method", "route"))
+
+    def _route(self, scope) -> str:
+        router = getattr(scope.get("app"), "router", None)
+        partial = None
+        for route in getattr(router, "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                # 路径匹配但方法不符（405），与路由器的处理一致
+                partial = route.path
+        return partial or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        route = self._route(scope)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.in_flight.inc(method, route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.latency.observe(method, route, value=time.perf_counter() - start)
+            self.requests.inc(method, route, str(status))
+            self.in_flight.dec(method, route)
+
+
+class LoopLagMonitor:
+    """周期性休眠，实际唤醒时间与预期之差即为事件循环延迟"""
+
+    def __init__(self, registry: Registry, interval: float = 0.5):
+        self.interval = interval
+        self.lag = registry.histogram(
+            "event_loop_lag_seconds", "Event loop scheduling delay", buckets=LAG_BUCKETS)
+        self.last_lag = registry.gauge("event_loop_lag_last_seconds", "Most recent event loop delay")
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            self.lag.observe(value=lag)
+            self.last_lag.set(value=lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
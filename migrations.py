@@ -0,0 +1,191 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# julianday() 与 Unix 纪元日（1970-01-01 为 0）之差
+EPOCH_JULIANDAY = 2440587.5
+
+
+def _day(column: str) -> str:
+    return f"CAST(julianday({column}) - {EPOCH_JULIANDAY} AS INTEGER)"
+
+
+# 迁移按版本号顺序执行，已执行的版本记录在 PRAGMA user_version 中。
+# 只能追加新版本，不要修改已发布的迁移。
+MIGRATIONS = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS vps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor_name TEXT,
+            cpu_cores INTEGER,
+            cpu_model TEXT,
+            memory INTEGER,
+            storage INTEGER,
+            bandwidth INTEGER,
+            price REAL,
+            currency TEXT,
+            start_date TEXT,
+            end_date TEXT,
+            user_id INTEGER
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS exchange_rates (
+            currency TEXT PRIMARY KEY,
+            rate REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (2, "list query indexes", [
+        # 列表查询按 (end_date, id) 键集分页，过滤列带上排序键
+        'CREATE INDEX IF NOT EXISTS idx_vps_end_date ON vps (end_date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_vps_vendor_end_date ON vps (vendor_name, end_date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_vps_currency_end_date ON vps (currency, end_date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_vps_user_end_date ON vps (user_id, end_date, id)',
+    ]),
+    (3, "integer epoch-day date columns", [
+        'ALTER TABLE vps ADD COLUMN start_day INTEGER',
+        'ALTER TABLE vps ADD COLUMN end_day INTEGER',
+        f'UPDATE vps SET start_day = {_day("start_date")}, end_day = {_day("end_date")}',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS vps_days_insert AFTER INSERT ON vps BEGIN
+            UPDATE vps SET start_day = {_day("NEW.start_date")}, end_day = {_day("NEW.end_date")}
+            WHERE id = NEW.id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS vps_days_update AFTER UPDATE OF start_date, end_date ON vps BEGIN
+            UPDATE vps SET start_day = {_day("NEW.start_date")}, end_day = {_day("NEW.end_date")}
+            WHERE id = NEW.id;
+        END
+        ''',
+        # 估值加载只需读取索引即可完成
+        'CREATE INDEX IF NOT EXISTS idx_vps_valuation ON vps (end_day, currency, price, vendor_name)',
+    ]),
+    (4, "rate history and billing cycles", [
+        # 每天每个币种一条（EUR 基准），主键即按日期查询的索引
+        '''
+        CREATE TABLE IF NOT EXISTS rate_history (
+            day INTEGER NOT NULL,
+            currency TEXT NOT NULL,
+            rate REAL NOT NULL,
+            PRIMARY KEY (day, currency)
+        ) WITHOUT ROWID
+        ''',
+        # 按币种读取一段日期的序列（覆盖索引）
+        'CREATE INDEX IF NOT EXISTS idx_rate_history_currency_day ON rate_history (currency, day, rate)',
+        # 与 rates.epoch_day 一致按本地日期计天
+        f'''
+        INSERT OR IGNORE INTO rate_history (day, currency, rate)
+        SELECT {_day("updated_at, 'unixepoch', 'localtime'")}, currency, rate FROM exchange_rates
+        ''',
+        # 价格对应的付款周期：monthly / quarterly / semiannually / yearly
+        "ALTER TABLE vps ADD COLUMN billing_cycle TEXT NOT NULL DEFAULT 'yearly'",
+        # 估值加载需要开始日与付款周期，重建覆盖索引
+        'DROP INDEX IF EXISTS idx_vps_valuation',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_vps_valuation
+        ON vps (end_day, currency, price, billing_cycle, start_day, vendor_name)
+        ''',
+    ]),
+    (5, "expiry alerts", [
+        # 已发送的到期提醒，续费（到期日变化）后按新的 end_day 重新提醒
+        '''
+        CREATE TABLE IF NOT EXISTS expiry_alerts (
+            vps_id INTEGER NOT NULL,
+            end_day INTEGER NOT NULL,
+            threshold INTEGER NOT NULL,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (vps_id, end_day, threshold)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_expiry_alerts_end_day ON expiry_alerts (end_day)',
+    ]),
+    (6, "per-user scoping and quotas", [
+        # 每个用户可保存的 VPS 数量上限，NULL 使用默认配额
+        'ALTER TABLE users ADD COLUMN max_vps INTEGER',
+        # 旧数据归属实例所有者
+        "UPDATE vps SET user_id = (SELECT id FROM users WHERE username = 'admin') WHERE user_id IS NULL",
+        # 所有查询都按用户过滤，索引以 user_id 开头；不再需要全表范围的列表索引
+        'DROP INDEX IF EXISTS idx_vps_end_date',
+        'DROP INDEX IF EXISTS idx_vps_vendor_end_date',
+        'DROP INDEX IF EXISTS idx_vps_currency_end_date',
+        'DROP INDEX IF EXISTS idx_vps_valuation',
+        'CREATE INDEX IF NOT EXISTS idx_vps_user_vendor_end_date ON vps (user_id, vendor_name, end_date, id)',
+        'CREATE INDEX IF NOT EXISTS idx_vps_user_currency_end_date ON vps (user_id, currency, end_date, id)',
+        # 导出按 id 分批
+        'CREATE INDEX IF NOT EXISTS idx_vps_user_id ON vps (user_id, id)',
+        # 按用户加载估值列（覆盖索引）
+        '''
+        CREATE INDEX IF NOT EXISTS idx_vps_user_valuation
+        ON vps (user_id, end_day, currency, price, billing_cycle, start_day, vendor_name)
+        ''',
+        # 到期提醒跨用户加载未到期的 VPS（end_day >= 今天），按 end_day 范围查找的覆盖索引
+        'CREATE INDEX IF NOT EXISTS idx_vps_end_day ON vps (end_day, user_id, vendor_name)',
+    ]),
+    (7, "fleet value history", [
+        # 每日机队快照及其降采样桶（resolution 0 日 / 1 周 / 2 月，bucket 为桶起始的 epoch-day）。
+        # dimension 0 为合计（key 为空串）、1 按商家、2 按币种；数值为桶内各日快照之和，
+        # samples 为快照天数，平均值 = 和 / samples，合并桶时直接相加。主键即按用户读取区间的索引
+        '''
+        CREATE TABLE IF NOT EXISTS fleet_history (
+            user_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            dimension INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            remaining_value REAL NOT NULL,
+            monthly_cost REAL NOT NULL,
+            PRIMARY KEY (user_id, dimension, bucket, resolution, key)
+        ) WITHOUT ROWID
+        ''',
+        # 降采样与保留期清理按 (resolution, bucket) 扫描
+        'CREATE INDEX IF NOT EXISTS idx_fleet_history_resolution ON fleet_history (resolution, bucket)',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db) -> int:
+    async with db.execute('PRAGMA user_version') as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def run_migrations(db) -> int:
+    """将数据库升级到最新版本，每个版本在单独的事务中执行；返回执行的迁移数"""
+    current = await get_schema_version(db)
+    applied = 0
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        await db.execute('BEGIN')
+        try:
+            for statement in statements:
+                if isinstance(statement, tuple):
+                    await db.executemany(*statement)
+                else:
+                    await db.execute(statement)
+            # PRAGMA 不支持参数绑定
+            await db.execute(f'PRAGMA user_version = {int(version)}')
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.error(f"Migration {version} failed", exc_info=True)
+            raise
+        applied += 1
+    if applied:
+        logger.info(f"Database schema upgraded from version {current} to {SCHEMA_VERSION}")
+    return applied
@@ -0,0 +1,123 @@
+import bisect
+from typing import Iterable, Optional
+
+from rates import RateTable, currency_code
+from valuation import cycles_per_year
+
+# bandwidth 列为每月流量（GB），按每 TB 计价
+GB_PER_TB = 1000
+
+# 排名指标 -> (资源列, 资源量换算系数)：值为每单位资源的月费；monthly 为月费本身
+RANK_METRICS = {
+    "monthly": (None, 1),
+    "core": ("cpu_cores", 1),
+    "memory": ("memory", 1),
+    "storage": ("storage", 1),
+    "traffic": ("bandwidth", 1 / GB_PER_TB),
+}
+
+
+def monthly_factor(currency: Optional[str], cycle: Optional[str], table: RateTable, target: str = "CNY") -> float:
+    """单个周期的价格 -> 目标币种月费的系数；汇率缺失时为 NaN（查询编码，不驻留未知币种）"""
+    factor = table.factor(currency_code(currency or "CNY"), currency_code(target))
+    return cycles_per_year(cycle) / 12 * factor
+
+
+def resource_metrics(row: dict, monthly: float) -> dict:
+    """由月费得出各项指标；资源量为 0 或缺失的指标不计入"""
+    metrics = {}
+    for metric, (column, scale) in RANK_METRICS.items():
+        if column is None:
+            metrics[metric] = monthly
+            continue
+        amount = (row.get(column) or 0) * scale
+        if amount > 0:
+            metrics[metric] = monthly / amount
+    return metrics
+
+
+def row_metrics(row: dict, table: RateTable, target: str = "CNY") -> dict:
+    """一行的各项性价比指标（按付款周期折算的月费除以资源量）；汇率缺失时为空"""
+    factor = monthly_factor(row["currency"], row.get("billing_cycle"), table, target)
+    if factor != factor:
+        return {}
+    return resource_metrics(row, (row["price"] or 0) * factor)
+
+
+class RankIndex:
+    """
+    性价比排名索引。每行的指标在写入与汇率刷新时计算一次并保存，
+    按 (用户, 指标) 维护升序列表 [(值, vps_id)]：取前 k 名直接切片，
+    单行更新为二分查找后删除、插入，不重新排序整个列表；用户之间互不影响，可按用户整体替换。
+    """
+
+    def __init__(self, target: str = "CNY"):
+        self.target = target
+        self._metrics: dict = {}
+        self._index: dict = {}
+
+    def build(self, rows: Iterable[dict], table: RateTable) -> tuple:
+        """
+        计算一批行的指标与有序列表，返回 (stored, index)，不修改索引本身（可在线程中执行）；
+        同一 (币种, 付款周期) 的换算系数只计算一次
+        """
+        factors: dict = {}
+        stored: dict = {}
+        index: dict = {}
+        for row in rows:
+            key = (row["currency"], row.get("billing_cycle"))
+            factor = factors.get(key)
+            if factor is None:
+                factor = factors[key] = monthly_factor(key[0], key[1], table, self.target)
+            metrics = resource_metrics(row, (row["price"] or 0) * factor) if factor == factor else {}
+            vps_id, user_id = row["id"], row["user_id"]
+            stored[vps_id] = (user_id, metrics)
+            for metric, value in metrics.items():
+                entries = index.get((user_id, metric))
+                if entries is None:
+                    entries = index[(user_id, metric)] = []
+                entries.append((value, vps_id))
+        for entries in index.values():
+            entries.sort()
+        return stored, index
+
+    def rebuild(self, rows: Iterable[dict], table: RateTable):
+        """整体重算所有行"""
+        self._metrics, self._index = self.build(rows, table)
+
+    def replace(self, user_id: int, old_ids: Iterable[int], built: tuple):
+        """用 build() 的结果替换某个用户的全部条目；old_ids 为该用户原有的行"""
+        stored, index = built
+        for vps_id in old_ids:
+            self._metrics.pop(vps_id, None)
+        for metric in RANK_METRICS:
+            self._index.pop((user_id, metric), None)
+        self._metrics.update(stored)
+        self._index.update(index)
+
+    def upsert(self, row: dict, table: RateTable):
+        self.remove(row["id"])
+        metrics = self._metrics[row["id"]] = (row["user_id"], row_metrics(row, table, self.target))
+        for metric, value in metrics[1].items():
+            bisect.insort(self._index.setdefault((row["user_id"], metric), []), (value, row["id"]))
+
+    def remove(self, vps_id: int):
+        user_id, metrics = self._metrics.pop(vps_id, (None, {}))
+        for metric, value in metrics.items():
+            entries = self._index.get((user_id, metric))
+            position = bisect.bisect_left(entries, (value, vps_id))
+            if position < len(entries) and entries[position] == (value, vps_id):
+                del entries[position]
+
+    def top(self, user_id: int, metric: str, count: int, descending: bool = False) -> list:
+        """某个用户按指标排名的前 count 行 [(值, vps_id)]，默认由低到高（每单位越便宜越靠前）"""
+        entries = self._index.get((user_id, metric), [])
+        if descending:
+            return entries[:-count - 1:-1] if count else []
+        return entries[:count]
+
+    def count(self, user_id: int, metric: str) -> int:
+        return len(self._index.get((user_id, metric), ()))
+
+    def metrics(self, vps_id: int) -> dict:
+        return self._metrics.get(vps_id, (None, {}))[1]
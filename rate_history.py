@@ -0,0 +1,171 @@
+import asyncio
+from array import array
+from typing import Iterable, Optional
+
+from rates import RateTable, currency_name
+
+NAN = float("nan")
+
+
+class RateHistory:
+    """
+    按天存储的历史汇率（与 fixer 一致，以 EUR 为基准）。
+    每个币种保存覆盖 [first_day, last_day] 的稠密日序列，缺失的日期沿用前一个已知汇率；
+    早于首个记录的日期使用最早的汇率，晚于最后记录的日期使用最新汇率。
+    day 均为 epoch-day（1970-01-01 为 0）。
+    """
+
+    def __init__(self, rows: Iterable[tuple]):
+        """rows: (day, currency, rate)，同一币种内按 day 升序"""
+        points: dict = {}
+        for day, currency, rate in rows:
+            if rate and rate > 0:
+                points.setdefault(currency, []).append((day, rate))
+        days = [day for series in points.values() for day, _ in series]
+        self.first_day = min(days) if days else 0
+        self.last_day = max(days) if days else -1
+        span = self.last_day - self.first_day + 1
+        self.series: dict = {}
+        for currency, series in points.items():
+            values = array('d', [NAN]) * span
+            for day, rate in series:
+                values[day - self.first_day] = rate
+            # 前向填充；首个记录之前用首个汇率回填
+            last = series[0][1]
+            for i in range(span):
+                if values[i] != values[i]:
+                    values[i] = last
+                else:
+                    last = values[i]
+            self.series[currency] = values
+        self._prefix: dict = {}
+
+    def __len__(self):
+        return max(0, self.last_day - self.first_day + 1)
+
+    def currencies(self) -> list:
+        return sorted(self.series)
+
+    def _index(self, day: int) -> int:
+        return min(max(day, self.first_day), self.last_day) - self.first_day
+
+    def rate_on(self, currency: str, day: int) -> float:
+        values = self.series.get(currency)
+        if values is None or not len(self):
+            return NAN
+        return values[self._index(day)]
+
+    def factor_on(self, source: str, target: str, day: int) -> float:
+        """当天 1 单位 source 可换得的 target 数量；缺少汇率时返回 NaN"""
+        if source == target:
+            return 1.0
+        return self.rate_on(target, day) / self.rate_on(source, day)
+
+    def rates_on(self, day: int) -> dict:
+        return {currency: values[self._index(day)] for currency, values in self.series.items()} if len(self) else {}
+
+    def table_on(self, day: int) -> RateTable:
+        return RateTable(self.rates_on(day))
+
+    def _prefix_sums(self, source: str, target: str) -> Optional[array]:
+        """每个币种对的换算系数前缀和，首次使用时计算，此后任意区间平均值为 O(1)"""
+        key = (source, target)
+        prefix = self._prefix.get(key)
+        if prefix is None:
+            src = self.series.get(source)
+            dst = self.series.get(target)
+            if src is None or dst is None:
+                return None
+            prefix = array('d', [0.0]) * (len(self) + 1)
+            total = 0.0
+            for i, (src_rate, dst_rate) in enumerate(zip(src, dst)):
+                total += dst_rate / src_rate
+                prefix[i + 1] = total
+            self._prefix[key] = prefix
+        return prefix
+
+    def average_factor(self, source: str, target: str, start_day: int, end_day: int) -> float:
+        """[start_day, end_day] 内按天加权的平均换算系数；区间超出历史范围的部分按两端汇率计"""
+        if source == target:
+            return 1.0
+        if end_day < start_day:
+            start_day, end_day = end_day, start_day
+        prefix = self._prefix_sums(source, target)
+        if prefix is None or not len(self):
+            return NAN
+        total = 0.0
+        if start_day < self.first_day:
+            before = min(end_day, self.first_day - 1) - start_day + 1
+            total += before * (prefix[1] - prefix[0])
+        if end_day > self.last_day:
+            after = end_day - max(start_day, self.last_day + 1) + 1
+            total += after * (prefix[-1] - prefix[-2])
+        low = max(start_day, self.first_day)
+        high = min(end_day, self.last_day)
+        if low <= high:
+            total += prefix[high - self.first_day + 1] - prefix[low - self.first_day]
+        return total / (end_day - start_day + 1)
+
+
+async def load_history(pool, currencies: Optional[Iterable[str]] = None,
+                       start_day: Optional[int] = None, end_day: Optional[int] = None) -> RateHistory:
+    """按币种与日期范围读取，查询由 (currency, day) 索引完成"""
+    conditions = []
+    params = []
+    if currencies is not None:
+        currencies = sorted(set(currencies))
+        conditions.append(f"currency IN ({', '.join('?' for _ in currencies)})")
+        params.extend(currencies)
+    if start_day is not None:
+        conditions.append("day >= ?")
+        params.append(start_day)
+    if end_day is not None:
+        conditions.append("day <= ?")
+        params.append(end_day)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    async with pool.read() as db:
+        async with db.execute(
+            f'SELECT day, currency, rate FROM rate_history {where}ORDER BY currency, day', params
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return RateHistory(rows)
+
+
+class RateHistoryCache:
+    """
+    按 (汇率版本, 币种集合) 缓存已加载的历史序列；
+    历史只在汇率刷新时追加，版本不变即可复用（含已计算的前缀和）。
+    """
+
+    def __init__(self, max_entries: int = 8):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: dict = {}
+        self._lock = asyncio.Lock()
+
+    async def get(self, pool, version: int, currencies: Iterable[str]) -> RateHistory:
+        key = (version, frozenset(currencies))
+        history = self._entries.get(key)
+        if history is not None:
+            self.hits += 1
+            return history
+        async with self._lock:
+            history = self._entries.get(key)
+            if history is None:
+                self.misses += 1
+                history = await load_history(pool, key[1])
+                # 版本变化后旧条目不再使用
+                self._entries = {k: v for k, v in self._entries.items() if k[0] == version}
+                if len(self._entries) >= self.max_entries:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[key] = history
+            else:
+                self.hits += 1
+        return history
+
+
+def history_currencies(codes: Iterable[int], target: str) -> set:
+    """估值所需的币种：组合内出现的币种 + 目标币种"""
+    return {currency_name(code) for code in codes} | {target}
+
@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """
+    按键（用户或匿名访问者的 IP）的令牌桶：容量 burst，每秒补充 rate 个令牌，每个请求消耗 cost 个。
+    只保存最近活跃的 max_keys 个桶，长时间未访问的桶被淘汰后等同于满桶。rate <= 0 时不限流。
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.limited = 0
+        self._buckets: OrderedDict = OrderedDict()
+
+    def acquire(self, key, cost: float = 1.0) -> float:
+        """成功时返回 0，否则返回令牌足够前需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+            while len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            self._buckets.move_to_end(key)
+        if tokens < cost:
+            self._buckets[key] = (tokens, now)
+            self.limited += 1
+            return (cost - tokens) / self.rate
+        self._buckets[key] = (tokens - cost, now)
+        self.allowed += 1
+        return 0.0
+
+    def charge(self, key, cost: float):
+        """
+        请求完成后按实际工作量（如返回或汇总的行数）追加扣除令牌，不拒绝本次请求；
+        余额最多欠 burst 个，之后的请求需等待补足。
+        """
+        if self.rate <= 0 or cost <= 0:
+            return
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return
+        now = time.monotonic()
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        self._buckets[key] = (max(tokens - cost, -self.burst), now)
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,335 @@
+import asyncio
+import logging
+import math
+import time
+from array import array
+from contextlib import nullcontext
+from datetime import date
+from typing import Callable, Optional
+
+from http_client import CircuitBreaker, HttpClient, UpstreamError
+from shared import FileLock, SharedCounters
+
+logger = logging.getLogger(__name__)
+
+
+# 1970-01-01 的公历序数日，用于换算数据库中的 epoch-day 列
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def epoch_day(timestamp: Optional[float] = None) -> int:
+    """
+    时间戳（默认当前时间）所在本地日期的 epoch-day。汇率历史、机队快照与估值都按本地日期计天，
+    零点附近不会把快照与前一天（UTC）的汇率对应起来
+    """
+    value = date.today() if timestamp is None else date.fromtimestamp(timestamp)
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+class RatesUnavailable(ValueError):
+    """没有可用汇率，或币种不受支持"""
+
+
+# 币种驻留为小整数编码，进程内保持稳定，刷新汇率不会改变已有编码
+_CURRENCY_CODES: dict = {}
+_CURRENCY_NAMES: list = []
+
+
+def intern_currency(currency: str) -> int:
+    code = _CURRENCY_CODES.get(currency)
+    if code is None:
+        code = len(_CURRENCY_NAMES)
+        _CURRENCY_CODES[currency] = code
+        _CURRENCY_NAMES.append(currency)
+    return code
+
+
+def currency_code(currency: str) -> Optional[int]:
+    """查询编码，不驻留未知币种"""
+    return _CURRENCY_CODES.get(currency)
+
+
+def currency_name(code: int) -> str:
+    return _CURRENCY_NAMES[code]
+
+
+class RateTable:
+    """
+    交叉汇率矩阵：只包含有汇率的币种，matrix[i * size + j] 为 1 单位第 i 个币种折合第 j 个币种的数量，
+    positions 把全局币种编码映射到矩阵行号（没有汇率为 -1）。
+    每次汇率刷新时重建一次，换算为同步的一次数组查找。
+    """
+
+    def __init__(self, rates: dict):
+        # 以 EUR 为基准的汇率；只驻留数据源返回的币种，请求参数与行中的未知字符串不会让矩阵变大
+        known = [(intern_currency(currency), float(rate)) for currency, rate in rates.items() if rate]
+        size = len(known)
+        positions = array('l', [-1]) * (max(code for code, _ in known) + 1 if known else 0)
+        for position, (code, _) in enumerate(known):
+            positions[code] = position
+        matrix = array('d', [math.nan]) * (size * size)
+        for i, (_, source_rate) in enumerate(known):
+            row = i * size
+            for j, (_, target_rate) in enumerate(known):
+                matrix[row + j] = 1.0 if i == j else target_rate / source_rate
+        self.size = size
+        self.positions = positions
+        self.matrix = matrix
+
+    def _position(self, code: Optional[int]) -> int:
+        if code is None or not 0 <= code < len(self.positions):
+            return -1
+        return self.positions[code]
+
+    def __contains__(self, currency: str) -> bool:
+        """是否有该币种的汇率"""
+        return self._position(_CURRENCY_CODES.get(currency)) >= 0
+
+    def factor(self, source: Optional[int], target: Optional[int]) -> float:
+        """按编码取换算系数，汇率缺失或编码为 None（未知币种）时返回 NaN"""
+        if source == target:
+            return 1.0 if source is not None else math.nan
+        i = self._position(source)
+        j = self._position(target)
+        if i < 0 or j < 0:
+            return math.nan
+        return self.matrix[i * self.size + j]
+
+    def convert(self, amount: float, source: str, target: str = "CNY") -> float:
+        if source == target:
+            return amount
+        source_code = _CURRENCY_CODES.get(source)
+        target_code = _CURRENCY_CODES.get(target)
+        if source_code is None or target_code is None:
+            raise RatesUnavailable(f"No exchange rate for {source}->{target}")
+        factor = self.factor(source_code, target_code)
+        if factor != factor:
+            raise RatesUnavailable(f"No exchange rate for {source}->{target}")
+        return amount * factor
+
+
+class RateProvider:
+    """汇率数据源接口：fetch() 返回以 EUR 为基准的汇率字典"""
+
+    name = "base"
+
+    async def fetch(self) -> dict:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def parse_fixer_response(data) -> dict:
+    """校验 fixer 响应，只保留正数汇率"""
+    if not isinstance(data, dict) or data.get("success") is not True or not isinstance(data.get("rates"), dict):
+        error = data.get("error") if isinstance(data, dict) else data
+        raise RatesUnavailable(f"Rate provider returned an unsuccessful response: {error}")
+    rates = {
+        currency: float(rate) for currency, rate in data["rates"].items()
+        if isinstance(currency, str) and isinstance(rate, (int, float)) and not isinstance(rate, bool) and rate > 0
+    }
+    if not rates:
+        raise RatesUnavailable("Rate provider returned no usable rates")
+    return rates
+
+
+class FixerRateProvider(RateProvider):
+    """
+    fixer.io（或兼容接口的本地桩服务）。
+    请求经由共享的 HttpClient（超时与重试）；连续失败后熔断，期间 fetch 立即失败，
+    RateCache 继续返回已缓存的汇率。
+    """
+
+    name = "fixer"
+
+    def __init__(self, api_key: Optional[str], url: str = "http://data.fixer.io/api/latest",
+                 client: Optional[HttpClient] = None, breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self.url = url
+        self._owns_client = client is None
+        self.client = client or HttpClient()
+        self.breaker = breaker or CircuitBreaker()
+
+    async def fetch(self) -> dict:
+        params = {"access_key": self.api_key or "", "base": "EUR"}
+        try:
+            return await self.client.request_json("GET", self.url, params=params, breaker=self.breaker,
+                                                  parse=parse_fixer_response)
+        except UpstreamError as e:
+            raise RatesUnavailable(str(e)) from e
+
+    async def close(self):
+        if self._owns_client:
+            await self.client.close()
+
+
+class StaticRateProvider(RateProvider):
+    """固定汇率，用于离线环境与基准测试"""
+
+    name = "static"
+
+    def __init__(self, rates: dict):
+        self.rates = dict(rates)
+
+    async def fetch(self) -> dict:
+        return dict(self.rates)
+
+
+class RateCache:
+    """
+    汇率缓存：
+    - 所有调用方共享同一个进行中的刷新（single-flight）
+    - 过期后先返回旧汇率，同时在后台刷新（stale-while-revalidate）
+    - 汇率持久化到 exchange_rates 表，重启后无需冷启动请求接口
+    - 多进程部署时 version 取自共享计数器：其他 worker 刷新后从数据库重新加载，
+      刷新过程由文件锁串行化，拿到锁后汇率已是新的则不再请求接口
+    """
+
+    def __init__(self, provider: RateProvider, ttl: float = 86400, retry_interval: float = 300,
+                 counters: Optional[SharedCounters] = None):
+        self.provider = provider
+        self.counters = counters or SharedCounters()
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.rates: dict = {}
+        self.table = RateTable({})
+        self.timestamp = 0.0
+        self.version = 0
+        self._pool = None
+        self._lock: Optional[FileLock] = None
+        self._sync_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._last_failure = 0.0
+        # 统计信息：fresh 命中 / 过期命中（后台刷新）/ 未命中（需等待刷新）
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        # 每次刷新结束后回调 (耗时秒数, 是否成功)，用于指标统计
+        self.on_refresh: Optional[Callable[[float, bool], None]] = None
+
+    def attach(self, pool, lock: Optional[FileLock] = None):
+        self._pool = pool
+        self._lock = lock
+
+    @property
+    def is_fresh(self) -> bool:
+        return bool(self.rates) and time.time() - self.timestamp <= self.ttl
+
+    def set_rates(self, rates: dict, timestamp: Optional[float] = None, version: Optional[int] = None):
+        self.rates = dict(rates)
+        self.table = RateTable(self.rates)
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.version = self.version + 1 if version is None else version
+
+    async def load(self):
+        """从数据库恢复上次保存的汇率"""
+        if not self._pool:
+            return
+        # 先读计数器：加载期间若有其他进程刷新，下次读取时会再次加载
+        version = self.counters.get("rates")
+        async with self._pool.read() as db:
+            async with db.execute('SELECT currency, rate, updated_at FROM exchange_rates') as cursor:
+                rows = await cursor.fetchall()
+        if rows:
+            self.set_rates({row[0]: row[1] for row in rows}, min(row[2] for row in rows), version)
+            logger.info(f"Loaded {len(rows)} exchange rates from database")
+        else:
+            self.version = version
+
+    async def _sync(self):
+        """其他进程刷新过汇率时重新加载"""
+        if not self._pool or self.counters.get("rates") == self.version:
+            return
+        async with self._sync_lock:
+            if self.counters.get("rates") != self.version:
+                await self.load()
+
+    async def _save(self, rates: dict, timestamp: float):
+        if not self._pool:
+            return
+        async with self._pool.write() as db:
+            await db.execute('DELETE FROM exchange_rates')
+            await db.executemany(
+                'INSERT INTO exchange_rates (currency, rate, updated_at) VALUES (?, ?, ?)',
+                [(currency, rate, timestamp) for currency, rate in rates.items()]
+            )
+            # 同时记入历史表（同一天多次刷新时保留最后一次）
+            await db.executemany(
+                'INSERT OR REPLACE INTO rate_history (day, currency, rate) VALUES (?, ?, ?)',
+                [(epoch_day(timestamp), currency, rate) for currency, rate in rates.items()]
+            )
+
+    async def _refresh(self):
+        start = time.perf_counter()
+        ok = False
+        try:
+            async with self._lock or nullcontext():
+                await self._sync()
+                if self.is_fresh:
+                    # 等锁期间其他 worker 已完成刷新
+                    ok = True
+                    return
+                rates = await self.provider.fetch()
+                timestamp = time.time()
+                await self._save(rates, timestamp)
+                # 提交后再递增版本，其他进程重新加载时一定能读到新汇率
+                self.set_rates(rates, timestamp, self.counters.bump("rates") if self._pool else None)
+            ok = True
+            logger.info(f"Exchange rates refreshed from {self.provider.name}")
+        except Exception as e:
+            self._last_failure = time.time()
+            logger.error(f"Exchange rate refresh failed: {e}")
+            raise
+        finally:
+            self._refresh_task = None
+            self.refreshes += 1
+            if not ok:
+                self.refresh_failures += 1
+            if self.on_refresh:
+                self.on_refresh(time.perf_counter() - start, ok)
+
+    def refresh(self) -> asyncio.Task:
+        """启动刷新；已有刷新进行中时复用同一个任务"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh())
+            # 后台刷新失败时已记录日志，避免 "exception was never retrieved"
+            self._refresh_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._refresh_task
+
+    async def get_rates(self) -> dict:
+        await self._sync()
+        if self.is_fresh:
+            self.hits += 1
+            return self.rates
+        if self.rates:
+            self.stale_hits += 1
+            # 有旧汇率时直接返回，后台刷新（失败后等待 retry_interval 再重试）
+            if time.time() - self._last_failure > self.retry_interval:
+                self.refresh()
+            return self.rates
+        self.misses += 1
+        if time.time() - self._last_failure <= self.retry_interval:
+            raise RatesUnavailable("No exchange rates available: last refresh failed")
+        try:
+            await asyncio.shield(self.refresh())
+        except Exception as e:
+            raise RatesUnavailable(f"No exchange rates available: {e}") from e
+        return self.rates
+
+    async def get_table(self) -> RateTable:
+        """确保汇率可用后返回当前交叉汇率矩阵"""
+        await self.get_rates()
+        return self.table
+
+    async def close(self):
+        task = self._refresh_task
+        if task:
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+        await self.provider.close()
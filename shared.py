@@ -0,0 +1,113 @@
+import asyncio
+import mmap
+import os
+import struct
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 flock，只支持单进程运行
+    fcntl = None
+
+SLOT = struct.Struct("q")
+
+
+class FileLock:
+    """
+    基于 flock 的跨进程互斥锁，进程退出时由系统自动释放。
+    同一进程内不要对同一路径使用多个 FileLock（flock 按打开的文件区分）。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            # 关闭文件即释放 flock
+            os.close(fd)
+
+    async def __aenter__(self):
+        # 阻塞等待放到线程中；等待期间被取消时，拿到锁后立即释放
+        task = asyncio.ensure_future(asyncio.to_thread(self.acquire))
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(lambda _: self.release())
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class SharedCounters:
+    """
+    跨 worker 进程共享的版本计数器，保存在数据目录下的内存映射文件中。
+    各进程自行缓存数据，写入提交后递增对应计数器；读取时发现计数器与已缓存的版本不同即重新加载。
+    读取只是一次内存访问，递增时用 flock 保证原子性。未调用 open() 时只在进程内计数。
+    """
+
+    NAMES = ("vps", "rates", "expiry")
+
+    def __init__(self):
+        self.path: Optional[str] = None
+        self._fd: Optional[int] = None
+        self._map = bytearray(SLOT.size * len(self.NAMES))
+
+    def open(self, path: str):
+        self.close()
+        size = SLOT.size * len(self.NAMES)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            # 只会扩展并以 0 填充，多个进程同时执行也没有问题
+            os.ftruncate(fd, size)
+        self._map = mmap.mmap(fd, size)
+        self._fd = fd
+        self.path = path
+
+    def close(self):
+        if self._fd is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._fd = None
+            self.path = None
+            self._map = bytearray(SLOT.size * len(self.NAMES))
+
+    def _offset(self, name: str) -> int:
+        return self.NAMES.index(name) * SLOT.size
+
+    def get(self, name: str) -> int:
+        return SLOT.unpack_from(self._map, self._offset(name))[0]
+
+    def bump(self, name: str) -> int:
+        """递增并返回新值"""
+        offset = self._offset(name)
+        locked = self._fd is not None and fcntl is not None
+        if locked:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = SLOT.unpack_from(self._map, offset)[0] + 1
+            SLOT.pack_into(self._map, offset, value)
+        finally:
+            if locked:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return value
@@ -0,0 +1,188 @@
+import asyncio
+import io
+import os
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from xml.sax.saxutils import escape
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow 为可选依赖，未安装时只提供 SVG
+    Image = None
+
+FONT_SIZE = 14
+ROW_HEIGHT = 30
+PADDING = 12
+HEADER_FILL = "#f8f9fa"
+BORDER_COLOR = "#dee2e6"
+TEXT_COLOR = "#212529"
+FONT_FAMILY = "'Noto Sans CJK SC', 'Microsoft YaHei', 'PingFang SC', sans-serif"
+
+# PNG 需要含中文字形的字体；可用 SNAPSHOT_FONT 指定路径
+FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "C:/Windows/Fonts/msyh.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+MEDIA_TYPES = {
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+DEFAULT_FORMAT = "png" if Image is not None else "svg"
+
+# 非年付价格的周期后缀，与 vps_rows.html 一致
+CYCLE_LABELS = {"monthly": "月", "quarterly": "季", "semiannually": "半年"}
+
+
+def format_remaining(value: Optional[float], currency: str) -> str:
+    """剩余价值的显示文本，vps_rows.html（remaining 过滤器）与实时更新共用"""
+    if value is None:
+        return "-"
+    if currency == "CNY":
+        return f"¥{value:.2f}"
+    return f"{value:.2f} {currency}"
+
+
+def format_price(vps: dict) -> str:
+    text = f"{vps['price'] or 0:.2f} {vps['currency']}"
+    label = CYCLE_LABELS.get(vps.get("billing_cycle"))
+    return f"{text}/{label}" if label else text
+
+
+def table_cells(rows: list, display_currency: str, omitted: int = 0) -> list:
+    """表头与各行的单元格文本；omitted 为未渲染的行数，在末尾追加一行说明"""
+    cells = [("商家", "CPU", "内存", "硬盘", "流量", "价格", f"剩余价值({display_currency})", "开始时间", "到期时间")]
+    for vps in rows:
+        cells.append((
+            str(vps["vendor_name"] or ""),
+            f"{vps['cpu_cores']}核 {vps['cpu_model'] or ''}".strip(),
+            f"{vps['memory']}GB",
+            f"{vps['storage']}GB",
+            f"{vps['bandwidth']}GB",
+            format_price(vps),
+            format_remaining(vps.get("remaining_value"), display_currency),
+            str(vps["start_date"] or ""),
+            str(vps["end_date"] or ""),
+        ))
+    if omitted:
+        cells.append((f"+{omitted} 台未显示",) + ("",) * (len(cells[0]) - 1))
+    return cells
+
+
+def _text_width(text: str) -> int:
+    """SVG 无法测量字形，按全角字符一个字号、半角字符约 0.6 个字号估算"""
+    return sum(
+        FONT_SIZE if unicodedata.east_asian_width(char) in ("W", "F") else int(FONT_SIZE * 0.6) + 1
+        for char in text
+    )
+
+
+def _column_widths(cells: list, measure) -> list:
+    return [max(measure(row[i]) for row in cells) + 2 * PADDING for i in range(len(cells[0]))]
+
+
+def render_svg(rows: list, display_currency: str, omitted: int = 0) -> bytes:
+    cells = table_cells(rows, display_currency, omitted)
+    widths = _column_widths(cells, _text_width)
+    width = sum(widths)
+    height = ROW_HEIGHT * len(cells)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'viewBox="0 0 {width} {height}" font-family="{escape(FONT_FAMILY)}" font-size="{FONT_SIZE}">',
+        f'<rect width="{width}" height="{height}" fill="#ffffff"/>',
+        f'<rect width="{width}" height="{ROW_HEIGHT}" fill="{HEADER_FILL}"/>',
+    ]
+    baseline = (ROW_HEIGHT + FONT_SIZE) // 2 - 2
+    for index, row in enumerate(cells):
+        y = index * ROW_HEIGHT
+        weight = ' font-weight="bold"' if index == 0 else ""
+        x = 0
+        for text, column_width in zip(row, widths):
+            parts.append(f'<text x="{x + PADDING}" y="{y + baseline}" fill="{TEXT_COLOR}"{weight}>{escape(text)}</text>')
+            x += column_width
+        parts.append(f'<line x1="0" y1="{y + ROW_HEIGHT}" x2="{width}" y2="{y + ROW_HEIGHT}" stroke="{BORDER_COLOR}"/>')
+    parts.append('</svg>')
+    return "\n".join(parts).encode()
+
+
+_font = None
+
+
+def _load_font():
+    global _font
+    if _font is None:
+        paths = [os.getenv("SNAPSHOT_FONT")] + list(FONT_CANDIDATES)
+        for path in filter(None, paths):
+            try:
+                _font = ImageFont.truetype(path, FONT_SIZE)
+                break
+            except OSError:
+                continue
+        else:
+            _font = ImageFont.load_default()
+    return _font
+
+
+def render_png(rows: list, display_currency: str, omitted: int = 0) -> bytes:
+    if Image is None:
+        raise RuntimeError("PNG snapshots require Pillow")
+    font = _load_font()
+    cells = table_cells(rows, display_currency, omitted)
+    widths = _column_widths(cells, lambda text: int(font.getlength(text)) + 1)
+    width = sum(widths)
+    height = ROW_HEIGHT * len(cells)
+    image = Image.new("RGB", (width, height), "#ffffff")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, ROW_HEIGHT - 1), fill=HEADER_FILL)
+    for index, row in enumerate(cells):
+        y = index * ROW_HEIGHT
+        x = 0
+        for text, column_width in zip(row, widths):
+            draw.text((x + PADDING, y + ROW_HEIGHT // 2), text, fill=TEXT_COLOR, font=font, anchor="lm")
+            x += column_width
+        draw.line((0, y + ROW_HEIGHT - 1, width, y + ROW_HEIGHT - 1), fill=BORDER_COLOR)
+    output = io.BytesIO()
+    # 表格图片色彩单一，调色板模式可显著减小体积
+    image.convert("P", palette=Image.ADAPTIVE, colors=64).save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+RENDERERS = {
+    "svg": render_svg,
+    "png": render_png,
+}
+
+
+def available_formats() -> tuple:
+    return tuple(name for name in RENDERERS if name != "png" or Image is not None)
+
+
+class SnapshotRenderer:
+    """
+    在有界线程池中渲染快照，避免阻塞事件循环：PNG 渲染耗时且占用内存随行数增长，
+    同时进行的渲染不超过 workers 个，其余排队；超过 max_rows 的行不渲染，末尾注明省略的行数。
+    """
+
+    def __init__(self, workers: int = 2, max_rows: int = 500):
+        self.workers = workers
+        self.max_rows = max_rows
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def render(self, format: str, rows: list, display_currency: str) -> bytes:
+        omitted = max(0, len(rows) - self.max_rows)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="snapshot")
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, RENDERERS[format], rows[:self.max_rows], display_currency, omitted)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
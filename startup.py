@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 失败步骤在后台重试的间隔（秒），每次失败翻倍，最长 MAX_RETRY_INTERVAL
+RETRY_INTERVAL = 5
+MAX_RETRY_INTERVAL = 300
+
+
+class DeferredInitFailed(RuntimeError):
+    """等待的步骤最近一次执行失败（原始异常见 __cause__）"""
+
+
+class DeferredInit:
+    """
+    启动完成后在后台依次执行的非关键初始化（模板预编译、管理员密码同步、到期提醒加载、图片清理等）。
+    startup_event 只做接受请求前必须完成的步骤，其余步骤由 start() 放到后台，冷启动时第一个请求不必等待。
+    依赖某个步骤的请求先 await wait(name)：步骤完成后立即返回。
+    失败的步骤不会一直保持失败：后台按退避间隔重试，wait 遇到失败的步骤也会立即重试一次
+    （同一步骤同时只执行一次），仍失败时抛出 DeferredInitFailed。
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self):
+        self._steps: list = []
+        self.status: dict = {}
+        self.seconds: dict = {}
+        self.errors: dict = {}
+        self._finished: dict = {}
+        self._funcs: dict = {}
+        self._locks: dict = {}
+        self._attempts: dict = {}
+        self._stopped = False
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, func: Callable[[], Awaitable]):
+        self._steps.append((name, func))
+        self._funcs[name] = func
+        self._locks[name] = asyncio.Lock()
+        self._attempts[name] = 0
+        self.status[name] = self.PENDING
+        self._finished[name] = asyncio.Event()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _attempt(self, name: str, seen: Optional[int] = None):
+        """
+        执行一次步骤；加锁使后台重试与 wait 触发的重试不会同时执行同一步骤。
+        seen 为调用方看到的尝试次数，等锁期间已有其他尝试完成时直接使用其结果。
+        """
+        async with self._locks[name]:
+            if self.status[name] == self.DONE or self._stopped:
+                return
+            if seen is not None and self._attempts[name] != seen:
+                return
+            self.status[name] = self.RUNNING
+            step_started = time.perf_counter()
+            try:
+                await self._funcs[name]()
+            except Exception as e:
+                self.status[name] = self.FAILED
+                self.errors[name] = e
+                logger.error(f"Deferred init step {name} failed: {e}", exc_info=True)
+            else:
+                self.status[name] = self.DONE
+                self.errors.pop(name, None)
+            self.seconds[name] = time.perf_counter() - step_started
+            self._attempts[name] += 1
+            self._finished[name].set()
+
+    async def _run(self):
+        started = time.perf_counter()
+        for name, _ in self._steps:
+            await self._attempt(name)
+        logger.info(f"Deferred init finished in {time.perf_counter() - started:.3f}s")
+        interval = RETRY_INTERVAL
+        while self.failed():
+            await asyncio.sleep(interval)
+            for name in self.failed():
+                logger.info(f"Retrying deferred init step {name}")
+                await self._attempt(name)
+            interval = min(interval * 2, MAX_RETRY_INTERVAL)
+
+    async def wait(self, name: str):
+        finished = self._finished.get(name)
+        if finished is None:
+            return
+        await finished.wait()
+        if name in self.errors:
+            await self._attempt(name, self._attempts[name])
+        if name in self.errors:
+            raise DeferredInitFailed(f"Deferred init step {name} failed") from self.errors.get(name)
+
+    def pending(self) -> list:
+        return [name for name, status in self.status.items() if status in (self.PENDING, self.RUNNING)]
+
+    def failed(self) -> list:
+        """最近一次执行失败的步骤（重试进行中也算，直到成功为止）"""
+        return [name for name in self.status if name in self.errors]
+
+    def done(self) -> bool:
+        return not self.pending()
+
+    def report(self) -> dict:
+        return {
+            name: {"status": status, "seconds": round(self.seconds[name], 4) if name in self.seconds else None}
+            for name, status in self.status.items()
+        }
+
+    async def stop(self):
+        self._stopped = True
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # 进程退出前未完成的步骤：让仍在等待的请求结束而不是一直挂起
+        for name in self.pending():
+            self.status[name] = self.FAILED
+            self.errors[name] = RuntimeError(f"Deferred init step {name} cancelled")
+            self._finished[name].set()
@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# 文件头 -> 扩展名
+IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UnsupportedImage(ValueError):
+    pass
+
+
+def sniff_image(head: bytes) -> Optional[str]:
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+class ImageStore:
+    """
+    按内容哈希保存图片：相同截图只存一份。
+    分块写入临时文件（文件操作在线程中执行），超过 max_bytes 立即中止；
+    写入后按总大小与保存天数淘汰最旧的文件。
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, max_total_bytes: int, max_age_days: float):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_age = max_age_days * 86400
+        self._retention_lock = asyncio.Lock()
+
+    async def save(self, chunks, extension: Optional[str] = None) -> tuple:
+        """
+        chunks 为字节块的异步迭代器；返回 (文件名, 是否新建)。
+        extension 仅供服务端自行生成的内容使用（如 SVG 快照），用户上传一律按文件头识别。
+        """
+        temp_path = self.directory / f".upload-{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        sniffing = extension is None
+        head = b""
+        handle = await asyncio.to_thread(open, temp_path, "wb")
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise UploadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+                if sniffing and extension is None:
+                    head += chunk[:16]
+                    if len(head) >= 12:
+                        extension = sniff_image(head)
+                        if extension is None:
+                            raise UnsupportedImage("Unsupported image format")
+                digest.update(chunk)
+                await asyncio.to_thread(handle.write, chunk)
+            await asyncio.to_thread(handle.close)
+            if extension is None:
+                raise UnsupportedImage("Unsupported image format")
+            filename = f"{digest.hexdigest()[:32]}.{extension}"
+            created = await asyncio.to_thread(self._commit, temp_path, self.directory / filename)
+        except BaseException:
+            await asyncio.to_thread(self._discard, handle, temp_path)
+            raise
+        if created:
+            await self.enforce_retention()
+        return filename, created
+
+    @staticmethod
+    def _commit(temp_path: Path, final_path: Path) -> bool:
+        if final_path.exists():
+            # 相同内容已存在：只刷新修改时间，使其不被优先淘汰
+            temp_path.unlink()
+            os.utime(final_path)
+            return False
+        os.replace(temp_path, final_path)
+        return True
+
+    @staticmethod
+    def _discard(handle, temp_path: Path):
+        handle.close()
+        temp_path.unlink(missing_ok=True)
+
+    def _evict(self) -> int:
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.startswith(".upload-"):
+                # 中断的上传留下的临时文件
+                if now - stat.st_mtime > 3600:
+                    os.unlink(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            if total <= self.max_total_bytes and now - mtime <= self.max_age:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    async def enforce_retention(self):
+        async with self._retention_lock:
+            removed = await asyncio.to_thread(self._evict)
+        if removed:
+            logger.info(f"Evicted {removed} images from {self.directory}")
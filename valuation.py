@@ -0,0 +1,422 @@
+import asyncio
+from array import array
+from contextlib import nullcontext
+from datetime import date
+from typing import Optional
+
+from rates import EPOCH_ORDINAL, RateTable, RatesUnavailable, currency_code, currency_name, intern_currency
+from shared import SharedCounters
+
+# 无效或缺失的到期日
+NO_DATE = -1
+
+# 付款周期 -> 每个周期的月数；价格为单个周期的费用
+BILLING_CYCLES = {"monthly": 1, "quarterly": 3, "semiannually": 6, "yearly": 12}
+DEFAULT_BILLING_CYCLE = "yearly"
+
+# 换算汇率：current 当前汇率；purchase 开始日汇率；average 开始日至今（或到期日）按天加权的平均汇率
+RATE_MODES = ("current", "purchase", "average")
+
+
+def cycles_per_year(cycle: Optional[str]) -> float:
+    """每年的付款次数；未知周期按年付计"""
+    return 12 / BILLING_CYCLES.get(cycle or DEFAULT_BILLING_CYCLE, 12)
+
+
+def date_to_day(value: Optional[str]) -> int:
+    """'YYYY-MM-DD' -> 公历序数日，无效时返回 NO_DATE"""
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        return NO_DATE
+
+
+def remaining_value(price: float, currency: str, end_date: str, table: RateTable,
+                    today: Optional[int] = None, target: str = "CNY",
+                    cycle: Optional[str] = DEFAULT_BILLING_CYCLE) -> float:
+    """单行剩余价值（价格按付款周期折算为年费）；日期无效或汇率缺失时抛出 ValueError"""
+    end_day = date.fromisoformat(end_date).toordinal()
+    if today is None:
+        today = date.today().toordinal()
+    # 今天不计入剩余天数
+    days = end_day - today - 1
+    if days <= 0:
+        return 0
+    yearly_value = table.convert(price * cycles_per_year(cycle), currency, target)
+    return round(yearly_value * days / 365, 2)
+
+
+class Portfolio:
+    """按列存储的 VPS 数据：年化价格、币种编码、开始日与到期日（序数日）"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.prices = array('d')
+        self.currencies = array('l')
+        self.start_days = array('l')
+        self.end_days = array('l')
+        self.vendors: list = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, vps_id: int, vendor: str, price: float, currency: str, end_date: str,
+               start_date: Optional[str] = None, cycle: Optional[str] = DEFAULT_BILLING_CYCLE):
+        self.ids.append(vps_id)
+        self.vendors.append(vendor or "")
+        self.prices.append(float(price or 0) * cycles_per_year(cycle))
+        self.currencies.append(intern_currency(currency or "CNY"))
+        self.start_days.append(date_to_day(start_date))
+        self.end_days.append(date_to_day(end_date))
+
+    @classmethod
+    def from_rows(cls, rows) -> "Portfolio":
+        """
+        rows: (id, vendor_name, price, currency, end_day, start_day, billing_cycle)，
+        日期列为 epoch-day 整数；价格按付款周期折算为年费
+        """
+        portfolio = cls()
+        if not rows:
+            return portfolio
+        ids, vendors, prices, currencies, end_days, start_days, cycles = zip(*rows)
+        codes = {currency: intern_currency(currency or "CNY") for currency in set(currencies)}
+        per_year = {cycle: cycles_per_year(cycle) for cycle in set(cycles)}
+        portfolio.ids = array('q', ids)
+        portfolio.vendors = [vendor or "" for vendor in vendors]
+        portfolio.prices = array('d', [(price or 0) * per_year[cycle] for price, cycle in zip(prices, cycles)])
+        portfolio.currencies = array('l', [codes[currency] for currency in currencies])
+        portfolio.start_days = array('l', [
+            NO_DATE if day is None else day + EPOCH_ORDINAL for day in start_days
+        ])
+        portfolio.end_days = array('l', [
+            NO_DATE if day is None else day + EPOCH_ORDINAL for day in end_days
+        ])
+        return portfolio
+
+
+async def load_portfolio(pool, user_id: Optional[int] = None) -> Portfolio:
+    # 使用迁移生成的整数日期列，无需逐行解析日期字符串；按用户加载时走覆盖索引
+    sql = 'SELECT id, vendor_name, price, currency, end_day, start_day, billing_cycle FROM vps'
+    params = []
+    if user_id is not None:
+        sql += ' WHERE user_id = ?'
+        params.append(user_id)
+    async with pool.read() as db:
+        async with db.execute(sql, params) as cursor:
+            rows = await cursor.fetchall()
+    return Portfolio.from_rows(rows)
+
+
+def value_portfolio(portfolio: Portfolio, table: RateTable, target: str = "CNY",
+                    today: Optional[int] = None, history=None, rate_mode: str = "current") -> dict:
+    """
+    单次遍历计算整个机队的剩余价值、日成本、月成本（价格已折算为年费）。
+    rate_mode 为 purchase / average 时使用 history（RateHistory）中的历史汇率，
+    平均汇率由前缀和得出，每行 O(1)；历史中缺少的币种退回当前汇率。
+    汇率缺失或日期无效的行剩余价值为 NaN，不计入合计。
+    """
+    if today is None:
+        today = date.today().toordinal()
+    if rate_mode not in RATE_MODES:
+        raise ValueError(f"Unknown rate mode: {rate_mode}")
+    use_history = rate_mode != "current" and history is not None and len(history)
+    # 查询不驻留：未知的目标币种编码为 None，所有行的换算系数为 NaN
+    target_code = currency_code(target)
+    size = len(portfolio)
+    # 每个币种的当前换算系数只查一次
+    factors = {}
+    historical_factors = {}
+    remaining = array('d', bytes(8 * size))
+    daily = array('d', bytes(8 * size))
+    for i, (price, code, start_day, end_day) in enumerate(
+        zip(portfolio.prices, portfolio.currencies, portfolio.start_days, portfolio.end_days)
+    ):
+        factor = factors.get(code)
+        if factor is None:
+            factor = factors[code] = table.factor(code, target_code)
+        if use_history and start_day != NO_DATE:
+            # 同一天开始（及到期）的同币种行共享历史系数
+            if rate_mode == "purchase":
+                key = (code, start_day)
+            else:
+                key = (code, start_day, min(today, end_day if end_day != NO_DATE else today))
+            historical = historical_factors.get(key)
+            if historical is None:
+                source = currency_name(code)
+                start = start_day - EPOCH_ORDINAL
+                if rate_mode == "purchase":
+                    historical = history.factor_on(source, target, start)
+                else:
+                    historical = history.average_factor(source, target, start, max(start, key[2] - EPOCH_ORDINAL))
+                historical_factors[key] = historical
+            if historical == historical:
+                factor = historical
+        yearly = price * factor
+        daily[i] = yearly / 365
+        if end_day == NO_DATE:
+            remaining[i] = float("nan")
+            continue
+        # 与 remaining_value 一致：今天不计入剩余天数
+        days = end_day - today - 1
+        remaining[i] = round(yearly * days / 365, 2) if days > 0 else 0.0
+    return {"currency": target, "remaining": remaining, "daily": daily}
+
+
+def summarize(portfolio: Portfolio, valuation: dict) -> dict:
+    """按商家、按币种汇总"""
+    total = {"count": 0, "remaining_value": 0.0, "daily_cost": 0.0, "monthly_cost": 0.0}
+    by_vendor = {}
+    by_currency = {}
+    unpriced = 0
+    for vendor, code, price, remaining, daily in zip(
+        portfolio.vendors, portfolio.currencies, portfolio.prices,
+        valuation["remaining"], valuation["daily"]
+    ):
+        currency = currency_name(code)
+        currency_total = by_currency.get(currency)
+        if currency_total is None:
+            currency_total = by_currency[currency] = {
+                "count": 0, "price_total": 0.0, "remaining_value": 0.0, "monthly_cost": 0.0
+            }
+        currency_total["count"] += 1
+        currency_total["price_total"] += price
+        total["count"] += 1
+        if remaining != remaining or daily != daily:
+            unpriced += 1
+            continue
+        monthly = daily * 365 / 12
+        vendor_total = by_vendor.get(vendor)
+        if vendor_total is None:
+            vendor_total = by_vendor[vendor] = {"count": 0, "remaining_value": 0.0, "monthly_cost": 0.0}
+        vendor_total["count"] += 1
+        vendor_total["remaining_value"] += remaining
+        vendor_total["monthly_cost"] += monthly
+        currency_total["remaining_value"] += remaining
+        currency_total["monthly_cost"] += monthly
+        total["remaining_value"] += remaining
+        total["daily_cost"] += daily
+        total["monthly_cost"] += monthly
+
+    def rounded(values: dict) -> dict:
+        return {k: round(v, 2) if isinstance(v, float) else v for k, v in values.items()}
+
+    return {
+        "currency": valuation["currency"],
+        **rounded(total),
+        "unpriced": unpriced,
+        "by_vendor": {k: rounded(v) for k, v in by_vendor.items()},
+        "by_currency": {k: rounded(v) for k, v in by_currency.items()},
+    }
+
+
+class ValuationCache:
+    """
+    每行派生值（剩余价值）的缓存，按用户分组保存，每个用户对应 (汇率版本, 当天, 代次) 这一键。
+    VPS 写入时逐行增量更新，只影响该用户的排序结果与版本；
+    汇率刷新、跨天或其他进程写入后所有用户标记为过期，各用户在下次读取时只重新加载自己的行，
+    行的估值与排名计算在线程中完成后整体替换，重新加载一个用户不会阻塞其他用户的请求。
+    传入 ranks（ranking.RankIndex）时，同一批行的性价比排名索引随缓存一起替换与逐行更新。
+    data_version 取自共享计数器 "vps"，每次写入递增；计数器不是本进程递增的，说明有其他 worker 写入，
+    无法得知是哪个用户，代次加一。
+    返回的行列表为共享对象，调用方不应修改。
+    """
+
+    def __init__(self, target: str = "CNY", counters: Optional[SharedCounters] = None, ranks=None):
+        self.target = target
+        self.counters = counters or SharedCounters()
+        self.data_version = 0
+        self.hits = 0
+        self.misses = 0
+        self._tenants: dict = {}
+        self._owners: dict = {}
+        self._ordered: dict = {}
+        self._versions: dict = {}
+        # 用户 -> 加载时的 (汇率版本, 当天, 代次)
+        self._loaded: dict = {}
+        self._generation = 0
+        self._locks: dict = {}
+        self.ranks = ranks
+
+    @staticmethod
+    async def _table(rate_cache) -> RateTable:
+        try:
+            return await rate_cache.get_table()
+        except RatesUnavailable:
+            return RateTable({})
+
+    def _value(self, row: dict, table: RateTable, today: int) -> dict:
+        try:
+            row["remaining_value"] = remaining_value(
+                row["price"] or 0, row["currency"], row["end_date"], table, today, self.target,
+                row.get("billing_cycle")
+            )
+        except (TypeError, ValueError):
+            row["remaining_value"] = None
+        return row
+
+    def _add(self, row: dict):
+        self._tenants.setdefault(row["user_id"], {})[row["id"]] = row
+        self._owners[row["id"]] = row["user_id"]
+
+    def _discard(self, vps_id: int):
+        """移除一行，返回原所属用户"""
+        user_id = self._owners.pop(vps_id, None)
+        if user_id is not None:
+            self._tenants.get(user_id, {}).pop(vps_id, None)
+        return user_id
+
+    def _touch(self, user_id):
+        self._ordered.pop(user_id, None)
+        self._versions[user_id] = self.data_version
+
+    def _sync_version(self):
+        """发现其他进程的写入（或 invalidate）：所有用户在下次读取时重新加载"""
+        version = self.counters.get("vps")
+        if version != self.data_version:
+            self.data_version = version
+            self._generation += 1
+
+    def _build(self, rows: list, table: RateTable, today: int, old: dict) -> tuple:
+        """
+        在线程中执行：计算某个用户所有行的剩余价值与排名条目，并与原有行比较是否有变化。
+        调用方持有该用户的锁，期间 old 不会被修改
+        """
+        tenant = {}
+        for row in rows:
+            row = self._value(dict(row), table, today)
+            tenant[row["id"]] = row
+        ranked = self.ranks.build(tenant.values(), table) if self.ranks is not None else None
+        return tenant, ranked, tenant != old
+
+    async def refresh(self, pool, rate_cache, user_id: int):
+        """该用户的缓存过期时只重新加载该用户的行；之后 etag(user_id) 为最新版本"""
+        table = await self._table(rate_cache)
+        self._sync_version()
+        key = (rate_cache.version, date.today().toordinal(), self._generation)
+        if self._loaded.get(user_id) == key:
+            self.hits += 1
+            return
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        async with lock:
+            if self._loaded.get(user_id) == key:
+                self.hits += 1
+                return
+            self.misses += 1
+            async with pool.read() as db:
+                async with db.execute('SELECT * FROM vps WHERE user_id = ?', [user_id]) as cursor:
+                    rows = await cursor.fetchall()
+            old = self._tenants.get(user_id, {})
+            tenant, ranked, changed = await asyncio.to_thread(self._build, rows, table, key[1], old)
+            # 以下没有 await，其他请求看到的要么是旧数据要么是新数据
+            for vps_id in old:
+                self._owners.pop(vps_id, None)
+            for vps_id in tenant:
+                self._owners[vps_id] = user_id
+            self._tenants[user_id] = tenant
+            self._ordered.pop(user_id, None)
+            if ranked is not None:
+                self.ranks.replace(user_id, old, ranked)
+            # 重新加载后行内容不变（例如其他用户的写入使代次变化）时保留原版本，页面与汇总缓存继续有效
+            if changed or user_id not in self._versions:
+                self._versions[user_id] = self.data_version
+            self._loaded[user_id] = key
+
+    async def rows(self, pool, rate_cache, user_id: int) -> list:
+        """按到期日倒序返回某个用户的所有行（附带剩余价值）"""
+        await self.refresh(pool, rate_cache, user_id)
+        ordered = self._ordered.get(user_id)
+        if ordered is None:
+            ordered = self._ordered[user_id] = sorted(
+                self._tenants.get(user_id, {}).values(),
+                key=lambda row: (row["end_date"] or "", row["id"]), reverse=True
+            )
+        return ordered
+
+    def row(self, vps_id: int) -> Optional[dict]:
+        """缓存中的单行（附带剩余价值）；所属用户的缓存已过期或没有这一行时返回 None"""
+        user_id = self._owners.get(vps_id)
+        if self._loaded.get(user_id, (None, None, None))[2] != self._generation:
+            return None
+        return self._tenants.get(user_id, {}).get(vps_id)
+
+    async def portfolio(self, pool, rate_cache, user_id: int) -> Portfolio:
+        """
+        由缓存行构造某个用户的列式数据（供汇总），无需重新查询整个机队。
+        行对象写入后不再修改（增量更新替换为新对象），取快照后在线程中构造
+        """
+        await self.refresh(pool, rate_cache, user_id)
+        rows = list(self._tenants.get(user_id, {}).values())
+        return await asyncio.to_thread(lambda: Portfolio.from_rows([
+            (row["id"], row["vendor_name"], row["price"], row["currency"],
+             row["end_day"], row["start_day"], row["billing_cycle"])
+            for row in rows
+        ]))
+
+    async def rank(self, pool, rate_cache, user_id: int, metric: str, count: int,
+                   descending: bool = False) -> tuple:
+        """某个用户按性价比指标排名的前 count 行 [(行, 值)] 与参与排名的行数"""
+        await self.refresh(pool, rate_cache, user_id)
+        tenant = self._tenants.get(user_id, {})
+        return ([(tenant[vps_id], value) for value, vps_id in self.ranks.top(user_id, metric, count, descending)],
+                self.ranks.count(user_id, metric))
+
+    async def refresh_row(self, pool, rate_cache, vps_id: int):
+        """新增或修改后重新读取并计算单行；所属用户未加载或已过期时留待下次读取时整体加载"""
+        table = await self._table(rate_cache)
+        in_sync = self._advance()
+        async with pool.read() as db:
+            async with db.execute('SELECT * FROM vps WHERE id = ?', [vps_id]) as cursor:
+                row = await cursor.fetchone()
+        user_id = row["user_id"] if row else self._owners.get(vps_id)
+        lock = self._locks.get(user_id)
+        async with lock or nullcontext():
+            loaded = self._loaded.get(user_id)
+            if not in_sync or loaded is None or loaded[2] != self._generation:
+                self._loaded.pop(user_id, None)
+                return
+            if self._discard(vps_id) is not None and self.ranks is not None:
+                self.ranks.remove(vps_id)
+            if row:
+                row = self._value(dict(row), table, loaded[1])
+                self._add(row)
+                if self.ranks is not None:
+                    self.ranks.upsert(row, table)
+            self._touch(user_id)
+
+    async def remove_row(self, vps_id: int):
+        in_sync = self._advance()
+        user_id = self._owners.get(vps_id)
+        lock = self._locks.get(user_id)
+        async with lock or nullcontext():
+            if not in_sync:
+                return
+            if self._discard(vps_id) is not None:
+                self._touch(user_id)
+                if self.ranks is not None:
+                    self.ranks.remove(vps_id)
+
+    def _advance(self) -> bool:
+        """本进程写入提交后递增版本；期间其他进程也有写入时所有用户标记为过期，返回 False"""
+        version = self.counters.bump("vps")
+        in_sync = version == self.data_version + 1
+        self.data_version = version
+        if not in_sync:
+            self._generation += 1
+        return in_sync
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """批量写入等绕过逐行更新的场景：指定用户时只有该用户在下次读取时重新加载，否则所有用户"""
+        in_sync = self._advance()
+        if user_id is None:
+            if in_sync:
+                self._generation += 1
+        else:
+            self._loaded.pop(user_id, None)
+
+    def etag(self, user_id: int) -> str:
+        """某个用户数据的版本；其他用户的写入不会改变它"""
+        rates_version, today, _ = self._loaded.get(user_id, (0, 0, 0))
+        version = self._versions.get(user_id, 0)
+        return f'W/"{user_id}-{rates_version}-{today}-{version}"'